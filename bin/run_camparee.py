@@ -3,6 +3,7 @@ import argparse
 from camparee.camparee_controller import CampareeController
 from beers_utils.constants import SUPPORTED_SCHEDULER_MODES
 from camparee.camparee_constants import CAMPAREE_VERSION
+from camparee.local_job_monitor import LocalJobMonitor
 
 controller = CampareeController()
 
@@ -14,7 +15,7 @@ optional_named.add_argument('-r', '--run_id', help="Alphanumberic used to specif
                                                    " underscores only).")
 optional_named.add_argument('-d', '--debug', action='store_true',
                             help='Indicates whether additional diagnostics are printed.')
-optional_named.add_argument('-m', '--scheduler_mode', choices=SUPPORTED_SCHEDULER_MODES,
+optional_named.add_argument('-m', '--scheduler_mode', choices=SUPPORTED_SCHEDULER_MODES + [LocalJobMonitor.SCHEDULER_NAME],
                             help='Indicates whether to dispatch jobs serially, or using a job scheduler')
 optional_named.add_argument('-s', '--seed', type=int,
                             help='Optional integer value used as a seed for random number generation.')
@@ -87,6 +87,29 @@ class AbstractCampareeStep(AbstractPipelineStep):
         """
         pass
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by this step, for a specific job/execution,
+        given the dictionary of validation attributes. These are the files the
+        StepCache stores and restores, so the list must include every file the
+        is_output_valid() method and downstream steps depend on. Steps that do not
+        override this method are never restored from the step cache.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            Key-value pairings of attributes generated by the get_validation_attributes()
+            method.
+
+        Returns
+        -------
+        list
+            Paths to all output files created by this step, or None if the
+            output of this step cannot be cached.
+        """
+        return None
+
     @staticmethod
     @abstractmethod
     def main():
@@ -1,13 +1,17 @@
 import argparse
-import re
 import sys
 import os
-import collections
+import itertools
+import queue
+import threading
 
+import numpy
 from pysam import AlignmentFile
 
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeUtils, CampareeException
+from camparee.transcript_gene_table import TranscriptGeneTable
 
 # TODO: Go back through and optimize this code to use fewer class variables
 #       (could pass necessary info as arguments to helper functions).
@@ -28,6 +32,16 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
 
     OUTPUT_ALLELIC_IMBALANCE_FILE_NAME = CAMPAREE_CONSTANTS.ALLELIC_IMBALANCE_OUTPUT_FILENAME
 
+    # Number of read pairs checked against the multimappers at a time.
+    BATCH_SIZE = 100_000
+
+    # Transcript id of unaligned reads.
+    UNALIGNED = -1
+    # Gene ids of read pairs that did not align to either parent's transcriptome,
+    # and of those that aligned to a transcript missing from the annotation.
+    NON_MAPPER = -1
+    NOT_ANNOTATED = -2
+
     def __init__(self, log_directory_path, data_directory_path, parameters=None):
         """Constructor for AllelicImbalanceQuantificationStep object.
 
@@ -51,101 +65,255 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
 
     def create_transcript_gene_map(self):
         """
-        Create dictionary to map transcript id to gene id using geneinfo file
-        Map '*' to '*' to account for unmapped reads in align_file
-        Create entries with suffix '_1' and '_2' for each transcript
+        Map transcript ids and gene ids from the parent 1 annotation to dense
+        integer ids, so read counts can be accumulated into arrays indexed by
+        gene. Genes are numbered in sorted order, which is the order they are
+        listed in the output file. The ids are those of the annotation's
+        TranscriptGeneTable.
 
         """
-        self.transcript_gene_map['*'] = '*'
+        self.transcript_gene_table_1 = TranscriptGeneTable.load_for_annotation(self.geneinfo_filename_1)
+        self.gene_ids = self.transcript_gene_table_1.gene_ids.tolist()
+        self.transcript_indices = {transcript_id: index for index, transcript_id
+                                   in enumerate(self.transcript_gene_table_1.transcript_ids.tolist())}
+        self.transcript_gene_indices = self.transcript_gene_table_1.transcript_genes
 
-        with open(self.geneinfo_filename_1, 'r') as geneinfo_file:
-            next(geneinfo_file)
-            for line in geneinfo_file:
-                fields = line.strip('\n').split('\t')
-                self.transcript_gene_map[fields[7]] = fields[8]
+    def map_references_to_transcripts(self, alignments):
+        """
+        Map the references (transcripts) in the header of a transcriptome
+        alignment file to the integer transcript ids from the annotation.
 
-    def reads_to_ignore(self):
-        reads_to_ignore = []
-        bamfile = AlignmentFile(self.genome_alignment_file, "rb")
-        num_hits_pattern = re.compile('(NH:i:)(\d+)')
+        Parameters
+        ----------
+        alignments : pysam.AlignmentFile
+            Transcriptome alignments.
 
-        for read in bamfile.fetch(until_eof=True):
-            num_hits = dict(read.tags)['NH']
-            if num_hits > 1:
-                reads_to_ignore.append(read.query_name)
+        Returns
+        -------
+        tuple
+            Array of the transcript id of each reference id, followed by
+            UNALIGNED so that reference id -1 (unaligned reads) maps to it, and
+            the list of transcript names indexed by transcript id. References
+            to transcripts missing from the annotation are given ids beyond
+            those of the annotated transcripts.
 
-        return reads_to_ignore
+        """
+        transcript_indices = dict(self.transcript_indices)
+        reference_transcripts = []
+        for reference_name in alignments.references:
+            transcript_id = reference_name.split(':')[0]
+            reference_transcripts.append(transcript_indices.setdefault(transcript_id, len(transcript_indices)))
+        reference_transcripts.append(AllelicImbalanceQuantificationStep.UNALIGNED)
+        return numpy.array(reference_transcripts, dtype=numpy.int64), list(transcript_indices)
 
-    def read_info(self, in_align_filename):
+    def reads_to_ignore(self):
         """
-        Create dictionary which maps a read id in SAM file to a dictionary with two keys 'transcript_id' and 'NM'.
-        The value associated with 'transcript_id' is a list of all transcripts the read aligned to.
-        The value associated with 'NM' is the corresponding edit distance information for each alignment.
-        For non-mappers the transcript_id is '*' and edit distance is 100 (Make it read length).
+        Identify reads with multiple alignments to the reference genome.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted array of the unique 64-bit hashes of the multimapping read
+            names (see CampareeUtils.hash_read_names()). Loaded from the file
+            saved by BamScanStep if one was given, rather than scanning the
+            entire genome alignment again.
 
         """
-        read_info_map = collections.defaultdict(dict)
+        if self.multimapper_read_hashes_file_path:
+            return numpy.load(self.multimapper_read_hashes_file_path)
 
-        # The NM tag in the SAM file tells us the edit distance for the alignment.
-        # This pattern extracts that number.
-        num_mismatches_pattern = re.compile('(NM:i:)(\d+)')
+        reads_to_ignore = set()
+        with AlignmentFile(self.genome_alignment_file, "rb") as bamfile:
+            for read in bamfile.fetch(until_eof=True):
+                if read.get_tag('NH') > 1:
+                    reads_to_ignore.add(read.query_name)
 
-        with open(in_align_filename, 'r') as infile:
-            for line in infile:
-                if line.startswith('@'):
-                    continue
+        return numpy.unique(CampareeUtils.hash_read_names(reads_to_ignore))
 
-                # read forward and reverse read
-                forward = line
-                reverse = next(infile)
+    def read_info(self, read_pairs, reference_transcripts, transcript_names):
+        """
+        Determine the gene each read pair in a batch aligned to, and the edit
+        distance of the alignment, from the pairs' alignment records.
+        For non-mappers the gene is NON_MAPPER and edit distance is 200 (Make it read length).
 
-                # Parse the fields for the forward read into an array
-                fwd_fields = forward.rstrip('\n').split('\t')
+        Parameters
+        ----------
+        read_pairs : list
+            (forward, reverse) tuples of the pysam.AlignedSegment records of
+            each read pair.
+        reference_transcripts : numpy.ndarray
+            Transcript id of each reference id, from map_references_to_transcripts().
+        transcript_names : list
+            Transcript names indexed by transcript id, from map_references_to_transcripts().
 
-                # Parse the fields for the reverse read into an array
-                rev_fields = reverse.rstrip('\n').split('\t')
+        Returns
+        -------
+        tuple
+            Arrays of the gene id and edit distance ('NM') of each read pair.
+            The gene id is NOT_ANNOTATED if the pair aligned to a transcript
+            that is not in the annotation.
 
-                fwd_transcript_id = fwd_fields[2].split(':')[0]
-                rev_transcript_id = rev_fields[2].split(':')[0]
+        """
+        fields = numpy.array([(forward.reference_id, reverse.reference_id,
+                               forward.get_tag('NM') if forward.has_tag('NM') else -1,
+                               reverse.get_tag('NM') if reverse.has_tag('NM') else -1)
+                              for forward, reverse in read_pairs], dtype=numpy.int64).reshape(-1, 4)
+        # Unaligned reads have reference id -1, which maps to UNALIGNED.
+        fwd_transcripts = reference_transcripts[fields[:, 0]]
+        rev_transcripts = reference_transcripts[fields[:, 1]]
+
+        # Unaligned mates are placed at their mate's transcript, if it has one.
+        unaligned = AllelicImbalanceQuantificationStep.UNALIGNED
+        transcripts = numpy.where(fwd_transcripts == unaligned, rev_transcripts, fwd_transcripts)
+        genes = numpy.full(len(transcripts), AllelicImbalanceQuantificationStep.NOT_ANNOTATED, dtype=numpy.int64)
+        # Transcripts missing from our master list of all transcript models (the
+        # geneinfo filename) are skipped.  Really this should not happen but just in case.
+        annotated = (transcripts >= 0) & (transcripts < len(self.transcript_gene_indices))
+        genes[annotated] = self.transcript_gene_indices[transcripts[annotated]]
+        # Mates aligned to different transcripts are only counted if the
+        # concatenated transcript ids name a transcript in the annotation.
+        for index in numpy.flatnonzero((fwd_transcripts != rev_transcripts) &
+                                       (fwd_transcripts != unaligned) & (rev_transcripts != unaligned)):
+            transcript_index = self.transcript_indices.get(transcript_names[fwd_transcripts[index]] +
+                                                           transcript_names[rev_transcripts[index]])
+            genes[index] = AllelicImbalanceQuantificationStep.NOT_ANNOTATED if transcript_index is None \
+                           else self.transcript_gene_indices[transcript_index]
+
+        # The NM tag tells us the edit distance for the alignment. If either read
+        # lacks it, use the edit distance of non-mappers.
+        NM_counts = numpy.where((fields[:, 2] >= 0) & (fields[:, 3] >= 0), fields[:, 2] + fields[:, 3], 200)
+
+        # This means both forward and reverse reads are non-mappers
+        non_mappers = (fwd_transcripts == unaligned) & (rev_transcripts == unaligned)
+        genes[non_mappers] = AllelicImbalanceQuantificationStep.NON_MAPPER
+        NM_counts[non_mappers] = 200
+
+        return genes, NM_counts
+
+    def read_pairs(self, alignments):
+        """
+        Generator of the two alignment records of each read pair, in the order
+        they were written by the aligner. Unpaired (single-end) reads have a
+        single record, which is returned as both records of the pair.
 
-                # This means both forward and reverse reads are non-mappers
-                # So store 'transcript_id' as '*' and 'NM' as 2*read_length
-                if fwd_transcript_id == '*' and rev_transcript_id == '*':
-                    read_info_map[fwd_fields[0]]['transcript_id'] =  '*'
-                    read_info_map[fwd_fields[0]]['NM'] =  200
-                    continue
-                # Get transcript_id for mapped reads
-                elif fwd_transcript_id == rev_transcript_id:
-                    transcript_id = fwd_transcript_id
-                else:
-                    transcript_id = (fwd_transcript_id + rev_transcript_id).replace('*','')
+        Parameters
+        ----------
+        alignments : pysam.AlignmentFile
+            Transcriptome alignments, with the records of each pair adjacent.
 
-                # This probably means the transcript was not in our master list of all transcript models
-                #  (the geneinfo filename).  So we skip it.  Really this should not happen
-                #  but just in case.
-                if not self.transcript_gene_map.get(transcript_id):
-                    continue
+        Returns
+        -------
+        generator
+            Yields a (forward, reverse) tuple of the records of each read pair.
 
-                # Obtain the edit distance information for the forward read
-                fwd_NM_match = re.search(num_mismatches_pattern, forward)
-                rev_NM_match = re.search(num_mismatches_pattern, reverse)
-                if fwd_NM_match and rev_NM_match:
-                    fwd_NM_count = int(fwd_NM_match.group(2))
-                    rev_NM_count = int(rev_NM_match.group(2))
-                    NM_count = fwd_NM_count + rev_NM_count
-                elif not (fwd_NM_match and rev_NM_match):
-                    NM_count = 200
-                else:
-                    NM_count = 100
+        """
+        records = alignments.fetch(until_eof=True)
+        for forward in records:
+            if not forward.is_paired:
+                yield forward, forward
+                continue
+            reverse = next(records, None)
+            if reverse is None or reverse.query_name != forward.query_name:
+                raise AllelicImbalanceQuantificationException(
+                    f"Alignments for read {forward.query_name} are not a pair of adjacent records.")
+            yield forward, reverse
+
+    @staticmethod
+    def read_in_background(items):
+        """
+        Start reading the items of an iterable in a separate thread, which holds
+        them in an unbounded buffer until they are needed. The thread starts
+        reading immediately, and keeps reading even when the caller does not, so
+        a process writing the items to a pipe is never blocked by a full pipe.
+
+        Parameters
+        ----------
+        items : iterable
+            Items to read, e.g. read pairs from read_pairs().
+
+        Returns
+        -------
+        generator
+            Yields the items in order, then re-raises any exception raised
+            while reading them.
+
+        """
+        # Each entry is a list of items, None at the end of the items, or the
+        # exception that stopped the thread.
+        buffered_items = queue.Queue()
+
+        def read():
+            batch = []
+            try:
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == AllelicImbalanceQuantificationStep.BATCH_SIZE:
+                        buffered_items.put(batch)
+                        batch = []
+                buffered_items.put(batch)
+                buffered_items.put(None)
+            except Exception as error:
+                buffered_items.put(batch)
+                buffered_items.put(error)
+
+        def buffered_read():
+            for batch in iter(buffered_items.get, None):
+                if isinstance(batch, Exception):
+                    raise batch
+                yield from batch
+
+        # Started here, rather than in the generator, which would only start
+        # the thread once the first item is requested.
+        threading.Thread(target=read, daemon=True).start()
+        return buffered_read()
+
+    def quantify_reads(self, read_info_1, read_info_2):
+        """
+        Add the contribution of a batch of read pairs to the allele-specific
+        read counts of the genes they aligned to.
 
-                # Update read_info dictionary with transcript_id and corresponding edit distance
-                read_info_map[fwd_fields[0]]['transcript_id'] = transcript_id
-                read_info_map[fwd_fields[0]]['NM'] = NM_count
+        Parameters
+        ----------
+        read_info_1 : tuple
+            The gene id and NM arrays of the pairs' alignments to the parent 1
+            transcriptome from read_info().
+        read_info_2 : tuple
+            The gene id and NM arrays of the pairs' alignments to the parent 2
+            transcriptome from read_info().
 
-        return read_info_map
+        """
+        gene_1, NM_count_1 = read_info_1
+        gene_2, NM_count_2 = read_info_2
+        has_info_1 = gene_1 != AllelicImbalanceQuantificationStep.NOT_ANNOTATED
+        has_info_2 = gene_2 != AllelicImbalanceQuantificationStep.NOT_ANNOTATED
+        # Non-mappers (and reads without alignment info) have negative gene ids.
+        mapped_1 = gene_1 >= 0
+        mapped_2 = gene_2 >= 0
+
+        # Reads with alignment info for only one of the parents count toward that
+        # parent's allele. So do reads that are non-mappers for the other parent.
+        only_1 = mapped_1 & (~has_info_2 | (gene_2 == AllelicImbalanceQuantificationStep.NON_MAPPER))
+        only_2 = mapped_2 & (~has_info_1 | (gene_1 == AllelicImbalanceQuantificationStep.NON_MAPPER))
+        # The read mapped to the same gene in parent 1 and 2. The counts of the
+        # allele with the smaller edit distance are incremented, or the counts
+        # of both alleles by 0.5 if the edit distances are the same.
+        same_gene = mapped_1 & mapped_2 & (gene_1 == gene_2)
+        tied = same_gene & (NM_count_1 == NM_count_2)
+
+        weights_1 = numpy.where(only_1 | (same_gene & (NM_count_1 < NM_count_2)), 1.0, 0.0)
+        weights_2 = numpy.where(only_2 | (same_gene & (NM_count_1 > NM_count_2)), 1.0, 0.0)
+        weights_1[tied] = 0.5
+        weights_2[tied] = 0.5
+
+        genes = numpy.where(mapped_1, gene_1, gene_2)
+        counted = (weights_1 > 0) | (weights_2 > 0)
+        num_genes = len(self.gene_ids)
+        self.gene_final_count[:, 0] += numpy.bincount(genes[counted], weights_1[counted], minlength=num_genes)
+        self.gene_final_count[:, 1] += numpy.bincount(genes[counted], weights_2[counted], minlength=num_genes)
 
     def execute(self, sample_id, genome_alignment_file_path, parent1_annot_file_path,
-                parent2_annot_file_path, parent1_tx_align_file_path, parent2_tx_align_file_path):
+                parent2_annot_file_path, parent1_tx_align_file_path, parent2_tx_align_file_path,
+                multimapper_read_hashes_file_path=None):
         """This is the main method which quantifies allelic imbalance for all
         genes in the annotation based on the aligned files for parents 1 and 2.
 
@@ -167,38 +335,26 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
             Input transcript annotation file for parent 2. This is generally
             prepared by UpdateAnnotationForGenomeStep.
         parent1_tx_align_file_path : string
-            Input SAM file of reads aligned to the variant genome from parent 1.
+            Input BAM (or SAM) file of reads aligned to the variant genome from parent 1.
             This is generally prepared by Bowtie2AlignStep.
         parent2_tx_align_file_path : string
-            Input SAM file of reads aligned to the variant genome from parent 2.
+            Input BAM (or SAM) file of reads aligned to the variant genome from parent 2.
             This is generally prepared by Bowtie2AlignStep.
+        multimapper_read_hashes_file_path : string
+            [Optional] Numpy .npy file of the sorted hashes of the names of reads
+            with multiple genome alignments. This is generally prepared by
+            BamScanStep. If given, multimappers are read from this file instead
+            of the genome alignment file.
 
         """
-        self.genome_alignment_file = genome_alignment_file_path
-        self.geneinfo_filename_1 = parent1_annot_file_path
-        self.geneinfo_filename_2 = parent2_annot_file_path
+        self.prepare_quantification(sample_id, genome_alignment_file_path, parent1_annot_file_path,
+                                    parent2_annot_file_path, multimapper_read_hashes_file_path)
         self.align_filename_1 = parent1_tx_align_file_path
         self.align_filename_2 = parent2_tx_align_file_path
 
         log_file_path = os.path.join(self.log_directory_path, f'sample{sample_id}',
                                      CAMPAREE_CONSTANTS.ALLELIC_IMBALANCE_LOG_FILENAME)
 
-        # Create allelic imbalance distribution file and ensure that it doesn't
-        # currently exist.
-        self.allele_imbalance_dist_filename = os.path.join(self.data_directory_path, f'sample{sample_id}',
-                                                           AllelicImbalanceQuantificationStep.OUTPUT_ALLELIC_IMBALANCE_FILE_NAME)
-        try:
-            os.remove(self.allele_imbalance_dist_filename)
-        except OSError:
-            pass
-
-        # Dictionaries to map transcripts to genes and keep track of final count of reads mapped to a gene
-        # This procedure does not map all gene info keys used.  Consequently we need to insure that
-        # assignments using new keys are initialized to 0
-        self.transcript_gene_map = collections.defaultdict(str)
-        self.gene_final_count = collections.defaultdict(lambda: collections.defaultdict(int))
-        self.exclusive_genes = []
-
         with open(log_file_path, "w") as log_file:
 
             print(f"Quantify allelic imbalance for reads from sample{sample_id}.")
@@ -210,136 +366,124 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
                            f"    Parent 1 transcriptome align path: {self.align_filename_1}\n"
                            f"    Parent 2 transcriptome align path: {self.align_filename_2}\n")
 
-            print("Mapping transcript IDs to gene IDs from Parent 1 annotation file.")
-            log_file.write("Mapping transcript IDs to gene IDs from Parent 1 annotation file.\n")
-            self.create_transcript_gene_map()
-
-            # Create read info dictionaries for each parent
-            print("Extracting read-transcript mappings for parent 1 from"
-                  " transcriptome alignment file.")
-            log_file.write("Extracting read-transcript mappings for parent 1"
-                           " from transcriptome alignment file.")
-            read_info_1 = self.read_info(self.align_filename_1)
-            print("Extracting read-transcript mappings for parent 2 from"
-                  " transcriptome alignment file.")
-            log_file.write("Extracting read-transcript mappings for parent 2"
-                           " from transcriptome alignment file.")
-            read_info_2 = self.read_info(self.align_filename_2)
-
-            print("Identifying multimappers from genome alignments.")
-            log_file.write("Identifying multimappers from genome alignments.\n")
-            reads_to_ignore = self.reads_to_ignore()
-
-            print("Excluding multimappers from further use.")
-            log_file.write("Excluding multimappers from further use.\n")
-            read_ids_1 = set(read_info_1.keys()).difference(reads_to_ignore)
-            read_ids_2 = set(read_info_2.keys()).difference(reads_to_ignore)
-
-            read_ids = read_ids_1.intersection(read_ids_2)
-            read_ids_1_u = read_ids_1.difference(read_ids)
-            read_ids_2_u = read_ids_2.difference(read_ids)
-
-            print("Quantifying reads aligned only to parental genome 1.")
-            log_file.write("Quantifying reads aligned only to parental genome 1.\n")
-            for read in read_ids_1_u:
-                transcript = read_info_1[read]['transcript_id']
-                gene = self.transcript_gene_map[transcript]
-                self.gene_final_count[gene]['1'] += 1
-
-            print("Quantifying reads aligned only to parental genome 2.")
-            log_file.write("Quantifying reads aligned only to parental genome 2.\n")
-            for read in read_ids_2_u:
-                transcript = read_info_2[read]['transcript_id']
-                gene = self.transcript_gene_map[transcript]
-                self.gene_final_count[gene]['2'] += 1
-
-            print("Quantifying reads aligned to both parental genomes.")
-            log_file.write("Quantifying reads aligned to both parental genomes.\n")
-            for read in read_ids:
-                # Transcripts to which the read mapped for each parent
-                transcript_1 = read_info_1[read]['transcript_id']
-                transcript_2 = read_info_2[read]['transcript_id']
-
-                # The read did not map to any transcript in either parent
-                if transcript_1 == '*' and transcript_2 == '*':
-                    continue
-                # The read mapped to atleast one transcript in each parent
-                elif transcript_1 != '*' and transcript_2 != '*':
-                    # Get the genes in parent 1 to which the read mapped
-                    gene_1 = self.transcript_gene_map[transcript_1]
-                    NM_count_1 = read_info_1[read]['NM']
-
-                    # Get the genes in parent 2 to which the read mapped
-                    gene_2 = self.transcript_gene_map[transcript_2]
-                    NM_count_2 = read_info_2[read]['NM']
-
-                    # Amongst the genes to which the read mapped,
-                    # there is exactly one gene in common between parent 1 and 2.
-                    if gene_1 == gene_2:
-                        # Minimum edit distance for the mapping to the gene is the same in
-                        # parent 1 and parent 2. So increment counts of both alleles of the genes by 0.5
-                        if NM_count_1 == NM_count_2:
-                            self.gene_final_count[gene_1]['1'] += 0.5
-                            self.gene_final_count[gene_1]['2'] += 0.5
-                        # Minimum edit distance for the mapping to the gene is less in parent 1.
-                        # So increment count of allele of gene corresponding to parent 1.
-                        elif NM_count_1 < NM_count_2:
-                            self.gene_final_count[gene_1]['1'] += 1
-                        # Minimum edit distance for the mapping to the gene is less in parent 2.
-                        # So increment count of allele of gene corresponding to parent 2.
-                        else:
-                            self.gene_final_count[gene_1]['2'] += 1
-                # The read is a non-mapper for the parent 1 transcriptome
-                elif transcript_1 == '*':
-                    # Get the genes in parent 2 to which the read mapped
-                    gene_2 = self.transcript_gene_map[transcript_2]
-                    self.gene_final_count[gene_2]['2'] += 1
-
-                # The read is a non-mapper for the parent 2 transcriptome
-                elif transcript_2 == '*':
-                    gene_1 = self.transcript_gene_map[transcript_1]
-                    self.gene_final_count[gene_1]['1'] += 1
-
-            print("Writing file of allelic imbalance quantification results.")
-            log_file.write("Writing file of allelic imbalance quantification results.\n")
-            self.make_allele_imbalance_dist_file()
+            with AlignmentFile(self.align_filename_1) as alignments_1, \
+                 AlignmentFile(self.align_filename_2) as alignments_2:
+                self.quantify_alignments(alignments_1, alignments_2, log_file)
 
             log_file.write("\nALL DONE!\n")
 
-    def make_allele_imbalance_dist_file(self):
-        genelist_1 = []
-        with open(self.geneinfo_filename_1, 'r') as geneinfo_file_1:
-            for line in geneinfo_file_1:
-                if line.startswith('#'):
-                    continue
-                fields = line.strip('\n').split('\t')
-                genelist_1.append(fields[8])
+    def prepare_quantification(self, sample_id, genome_alignment_file_path, parent1_annot_file_path,
+                               parent2_annot_file_path, multimapper_read_hashes_file_path=None):
+        """Store the inputs shared by all transcriptome alignments of a sample
+        and remove any existing output, before calling quantify_alignments().
+        The parameters are the same as those of execute().
 
-        genelist_2 = []
-        with open(self.geneinfo_filename_2, 'r') as geneinfo_file_2:
-            for line in geneinfo_file_2:
-                if line.startswith('#'):
-                    continue
-                fields = line.strip('\n').split('\t')
-                genelist_2.append(fields[8])
+        """
+        self.genome_alignment_file = genome_alignment_file_path
+        self.multimapper_read_hashes_file_path = multimapper_read_hashes_file_path
+        self.geneinfo_filename_1 = parent1_annot_file_path
+        self.geneinfo_filename_2 = parent2_annot_file_path
+
+        # Create allelic imbalance distribution file and ensure that it doesn't
+        # currently exist.
+        self.allele_imbalance_dist_filename = os.path.join(self.data_directory_path, f'sample{sample_id}',
+                                                           AllelicImbalanceQuantificationStep.OUTPUT_ALLELIC_IMBALANCE_FILE_NAME)
+        try:
+            os.remove(self.allele_imbalance_dist_filename)
+        except OSError:
+            pass
+
+    def quantify_alignments(self, alignments_1, alignments_2, log_file, read_in_background=False):
+        """Quantify allelic imbalance from the transcriptome alignments of both
+        parents and write the allelic imbalance distribution file. Call
+        prepare_quantification() first.
+
+        Parameters
+        ----------
+        alignments_1 : pysam.AlignmentFile
+            Alignments to the parent 1 transcriptome, from a file or a stream.
+        alignments_2 : pysam.AlignmentFile
+            Alignments to the parent 2 transcriptome, listing the read pairs in
+            the same order as alignments_1.
+        log_file : file object
+            Log file to which progress is written.
+        read_in_background : boolean
+            Read each parent's alignments in a separate thread (see
+            read_in_background()). Use this for alignments streamed from
+            processes that share their input (e.g. two bowtie2 processes fed by
+            a FastqStreamer), which could otherwise deadlock waiting on each
+            other. Both threads start reading before the annotation and the
+            multimappers are loaded, so the processes keep running meanwhile.
+            Leave this off for alignment files, since the alignments that one
+            parent is ahead by are held in memory.
 
-        exclusive_genes = list(set(genelist_1).difference(set(genelist_2)))
+        """
+        read_pairs_1 = self.read_pairs(alignments_1)
+        read_pairs_2 = self.read_pairs(alignments_2)
+        if read_in_background:
+            read_pairs_1 = AllelicImbalanceQuantificationStep.read_in_background(read_pairs_1)
+            read_pairs_2 = AllelicImbalanceQuantificationStep.read_in_background(read_pairs_2)
+
+        print("Mapping transcript IDs to gene IDs from Parent 1 annotation file.")
+        log_file.write("Mapping transcript IDs to gene IDs from Parent 1 annotation file.\n")
+        self.create_transcript_gene_map()
+        # Final count of reads mapped to each allele (columns) of each gene (rows).
+        self.gene_final_count = numpy.zeros((len(self.gene_ids), 2))
+
+        print("Identifying multimappers from genome alignments.")
+        log_file.write("Identifying multimappers from genome alignments.\n")
+        reads_to_ignore = self.reads_to_ignore()
+
+        # Both transcriptome alignments list the read pairs in the same order
+        # (the order of the input FASTQ files), so they are read in lockstep,
+        # one batch of read pairs at a time.
+        print("Quantifying reads aligned to parental genomes 1 and 2.")
+        log_file.write("Quantifying reads aligned to parental genomes 1 and 2.\n")
+        num_read_pairs = 0
+        num_multimappers = 0
+        references_1 = self.map_references_to_transcripts(alignments_1)
+        references_2 = self.map_references_to_transcripts(alignments_2)
+        read_pairs = itertools.zip_longest(read_pairs_1, read_pairs_2)
+        for batch in iter(lambda: list(itertools.islice(read_pairs, AllelicImbalanceQuantificationStep.BATCH_SIZE)), []):
+            read_ids = []
+            for pair_1, pair_2 in batch:
+                if pair_1 is None or pair_2 is None or pair_1[0].query_name != pair_2[0].query_name:
+                    raise AllelicImbalanceQuantificationException(
+                        "The reads in the parent 1 and parent 2 transcriptome alignments"
+                        " are not in the same order.")
+                read_ids.append(pair_1[0].query_name)
+            # Exclude multimappers from further use.
+            is_multimapper = CampareeUtils.find_hashed_read_names(read_ids, reads_to_ignore)
+            num_multimappers += int(is_multimapper.sum())
+            num_read_pairs += len(batch)
+            batch = [pairs for pairs, multimapper in zip(batch, is_multimapper) if not multimapper]
+            self.quantify_reads(self.read_info([pair_1 for pair_1, _ in batch], *references_1),
+                                self.read_info([pair_2 for _, pair_2 in batch], *references_2))
+        log_file.write(f"Quantified {num_read_pairs - num_multimappers} read pairs, "
+                       f"excluding {num_multimappers} multimappers.\n")
+
+        print("Writing file of allelic imbalance quantification results.")
+        log_file.write("Writing file of allelic imbalance quantification results.\n")
+        self.make_allele_imbalance_dist_file()
+
+    def make_allele_imbalance_dist_file(self):
+        # Genes missing from the parent 2 annotation (e.g. on chromosomes with a
+        # ploidy of 1) are entirely expressed from parent 1.
+        transcript_gene_table_2 = TranscriptGeneTable.load_for_annotation(self.geneinfo_filename_2)
+        is_exclusive_gene = numpy.isin(self.transcript_gene_table_1.gene_ids, transcript_gene_table_2.gene_ids,
+                                       invert=True)
 
         # Write the allelic imbalance quantification information to allele imbalance dist filename
         with open(self.allele_imbalance_dist_filename, 'w') as allele_imbalance_dist_file:
             allele_imbalance_dist_file.write('#gene_id' + '\t' + '_1' + '\t' + '_2' + '\n')
 
-            #for key, value in list(self.gene_final_count.items()):
-            for gene_id in sorted(set(self.transcript_gene_map.values())):
-                if gene_id in exclusive_genes:
+            for gene_id, (read_count_1, read_count_2), exclusive_gene in zip(self.gene_ids,
+                                                                             self.gene_final_count.tolist(),
+                                                                             is_exclusive_gene.tolist()):
+                if exclusive_gene:
                     allele_imbalance_dist_file.write(str(gene_id) + '\t' + str(1.0) + '\t' + str(0.0) + '\n')
                     continue
 
-                if gene_id == "*":
-                    continue
-
-                read_count_1 = self.gene_final_count[gene_id]['1']
-                read_count_2 = self.gene_final_count[gene_id]['2']
                 gene_read_count = read_count_1 + read_count_2
 
                 if gene_read_count == 0:
@@ -350,7 +494,8 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
 
     def get_commandline_call(self, sample_id, genome_alignment_file_path,
                              parent1_annot_file_path, parent2_annot_file_path,
-                             parent1_tx_align_file_path, parent2_tx_align_file_path):
+                             parent1_tx_align_file_path, parent2_tx_align_file_path,
+                             multimapper_read_hashes_file_path=None):
         """Prepare command to execute the AllelicImbalanceQuantificationStep from
         the command line, given all of the arugments used to run the execute()
         function.
@@ -373,11 +518,14 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
             Input transcript annotation file for parent 2. This is generally
             prepared by UpdateAnnotationForGenomeStep.
         parent1_tx_align_file_path : string
-            Input SAM file of reads aligned to the variant genome from parent 1.
+            Input BAM (or SAM) file of reads aligned to the variant genome from parent 1.
             This is generally prepared by Bowtie2AlignStep.
         parent2_tx_align_file_path : string
-            Input SAM file of reads aligned to the variant genome from parent 2.
+            Input BAM (or SAM) file of reads aligned to the variant genome from parent 2.
             This is generally prepared by Bowtie2AlignStep.
+        multimapper_read_hashes_file_path : string
+            [Optional] Numpy .npy file of the sorted hashes of the names of reads
+            with multiple genome alignments, generally prepared by BamScanStep.
 
         Returns
         -------
@@ -401,12 +549,15 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
                    f" --parent2_annot_path {parent2_annot_file_path}"
                    f" --parent1_tx_align_path {parent1_tx_align_file_path}"
                    f" --parent2_tx_align_path {parent2_tx_align_file_path}")
+        if multimapper_read_hashes_file_path is not None:
+            command += f" --multimapper_read_hashes_path {multimapper_read_hashes_file_path}"
 
         return command
 
     def get_validation_attributes(self, sample_id, genome_alignment_file_path,
                              parent1_annot_file_path, parent2_annot_file_path,
-                             parent1_tx_align_file_path, parent2_tx_align_file_path):
+                             parent1_tx_align_file_path, parent2_tx_align_file_path,
+                             multimapper_read_hashes_file_path=None):
         """Prepare attributes required by is_output_valid() function to validate
         output generated by the AllelicImbalanceQuantificationStep job.
 
@@ -434,15 +585,19 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
             is captured just so get_validation_attributes() accepts the same
             arguments as get_commandline_call(). It is not used here.]
         parent1_tx_align_file_path : string
-            Input SAM file of reads aligned to the variant genome from parent 1.
+            Input BAM (or SAM) file of reads aligned to the variant genome from parent 1.
             This is generally prepared by Bowtie2AlignStep. [Note: this parameter
             is captured just so get_validation_attributes() accepts the same
             arguments as get_commandline_call(). It is not used here.]
         parent2_tx_align_file_path : string
-            Input SAM file of reads aligned to the variant genome from parent 2.
+            Input BAM (or SAM) file of reads aligned to the variant genome from parent 2.
             This is generally prepared by Bowtie2AlignStep. [Note: this parameter
             is captured just so get_validation_attributes() accepts the same
             arguments as get_commandline_call(). It is not used here.]
+        multimapper_read_hashes_file_path : string
+            [Optional] File of the hashes of multimapping read names. [Note: this parameter is captured just so
+            get_validation_attributes() accepts the same arguments as
+            get_commandline_call(). It is not used here.]
 
         Returns
         -------
@@ -505,6 +660,35 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by AllelicImbalanceQuantificationStep for a
+        specific job/execution, given a job's data directory, log directory, and
+        sample ID. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, and corresponding sample_id.
+
+        Returns
+        -------
+        list
+            Paths to the allelic imbalance distribution file and log file.
+
+        """
+
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+
+        return [os.path.join(data_directory_path, f'sample{sample_id}',
+                             AllelicImbalanceQuantificationStep.OUTPUT_ALLELIC_IMBALANCE_FILE_NAME),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             CAMPAREE_CONSTANTS.ALLELIC_IMBALANCE_LOG_FILENAME)]
+
     @staticmethod
     def main():
         """Entry point into script. Parses the argument list to obtain all the
@@ -527,9 +711,12 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
         parser.add_argument('--parent2_annot_path', required=True,
                             help='Annotation file from genome for parent 2.')
         parser.add_argument('--parent1_tx_align_path', required=True,
-                            help='SAM file of reads aligned to parent 1 transcriptome.')
+                            help='BAM or SAM file of reads aligned to parent 1 transcriptome.')
         parser.add_argument('--parent2_tx_align_path', required=True,
-                            help='SAM file of reads aligned to parent 2 transcriptome.')
+                            help='BAM or SAM file of reads aligned to parent 2 transcriptome.')
+        parser.add_argument('--multimapper_read_hashes_path', default=None,
+                            help='[Optional] Numpy .npy file of hashes of multimapping read names.'
+                                 ' If omitted, multimappers are found from the genome alignment.')
 
         args = parser.parse_args()
 
@@ -540,7 +727,13 @@ class AllelicImbalanceQuantificationStep(AbstractCampareeStep):
                                       parent1_annot_file_path=args.parent1_annot_path,
                                       parent2_annot_file_path=args.parent2_annot_path,
                                       parent1_tx_align_file_path=args.parent1_tx_align_path,
-                                      parent2_tx_align_file_path=args.parent2_tx_align_path)
+                                      parent2_tx_align_file_path=args.parent2_tx_align_path,
+                                      multimapper_read_hashes_file_path=args.multimapper_read_hashes_path)
+
+
+class AllelicImbalanceQuantificationException(CampareeException):
+    pass
+
 
 if __name__ == "__main__":
     sys.exit(AllelicImbalanceQuantificationStep.main())
@@ -1,17 +1,30 @@
 import collections
-import itertools
 import os
 import argparse
 import json
+import mmap
+import pickle
+import struct
+import hashlib
+import tempfile
 import numpy
 
+from camparee.camparee_utils import CampareeUtils
+
 ##### "Plain old data" classes representing the elements inside a gene info file
+# These classes use __slots__ to avoid a per-instance dict, since a full annotation
+# contains millions of them. Relationships between introns and mintrons are not
+# stored on the objects themselves. Instead, they are stored in arrays indexed by
+# intron ID / mintron index on the AnnotationInfo, and the objects provide views of
+# these arrays through properties.
 
 class Gene:
     """Representation of a gene, including it's transcripts.
 
     start, end coordinates indicate the min/max of the start/end coordinates of all its transcripts
     """
+    __slots__ = ('info', 'chrom', 'strand', 'gene_id', 'start', 'end', 'transcripts')
+
     def __init__(self, info, gene_id, chrom, strand, start, end, transcripts=None):
         if transcripts is None:
             transcripts = []
@@ -33,6 +46,8 @@ class Gene:
 class Transcript:
     """ Transcript of a gene, tracks its introns, exons
     """
+    __slots__ = ('info', 'chrom', 'strand', 'gene_id', 'transcript_id', 'start', 'end', 'exons', 'introns')
+
     def __init__(self, info, gene_id, transcript_id, chrom, strand, start, end, exons=None, introns=None):
         if introns is None:
             introns = []
@@ -62,6 +77,8 @@ class Region:
     strand = +,-, or . if not strand-specific region (eg: an intergenic region)
     'comment' is any extra information to carry along, for the purposes of debugging/printing
     """
+    __slots__ = ('info', 'chrom', 'strand', 'start', 'end', 'comment')
+
     def __init__(self, info, chrom, strand, start, end, comment=None):
         self.info = info
         self.chrom = chrom
@@ -77,11 +94,11 @@ class Region:
 class TranscriptRegion(Region):
     """ Region that is part of a transcript (eg: intron or exon)
     """
+    __slots__ = ('gene_id', 'transcript_id')
+
     def __init__(self, info, gene_id, transcript_id, *args):
         self.gene_id = gene_id
         self.transcript_id = transcript_id
-        self.effective_length = 0
-        self.antisense_effective_length = 0
         Region.__init__(self, info, *args)
 
     def get_gene(self):
@@ -95,24 +112,82 @@ class TranscriptRegion(Region):
 
 
 class Intron(TranscriptRegion):
+    """ Intron of a transcript, including the flanks added to either end of the transcript.
+    intron_id is the intron's index into the AnnotationInfo's intron arrays, assigned once all
+    introns have been created.
+    """
+    __slots__ = ('intron_id',)
+
     def __init__(self, *args):
         TranscriptRegion.__init__(self, *args)
-        self.mintrons = [] # List of all mintrons that this overlaps
-        self.antisense_mintrons = [] # List of mintrons on the other strand that aren't sense for something else
+        self.intron_id = None
+
+    def get_mintrons(self):
+        """ List of all mintrons that this overlaps """
+        first, stop = self.info.intron_mintron_ranges[self.intron_id]
+        return self.info.mintrons_by_chrom[self.chrom, self.strand][first:stop]
+
+    def get_antisense_mintrons(self):
+        """ List of all mintrons on the other strand that this overlaps """
+        first, stop = self.info.intron_antisense_mintron_ranges[self.intron_id]
+        if first == stop:
+            return []
+        antisense_strand = "+" if self.strand == "-" else "-"
+        return self.info.mintrons_by_chrom[self.chrom, antisense_strand][first:stop]
+
+    def get_effective_length(self):
+        return int(self.info.intron_effective_lengths[self.intron_id])
+
+    def get_antisense_effective_length(self):
+        return int(self.info.intron_antisense_effective_lengths[self.intron_id])
+
+    mintrons = property(get_mintrons)
+    antisense_mintrons = property(get_antisense_mintrons)
+    effective_length = property(get_effective_length)
+    antisense_effective_length = property(get_antisense_effective_length)
 
 
 class Mintron(Region):
+    """ Piece of intron (neither exonic nor intergenic) on one strand. mintron_index is the mintron's
+    position among the mintrons of its chromosome and strand.
+    """
+    __slots__ = ('mintron_index',)
+
     def __init__(self, info, *args):
         Region.__init__(self, info, *args)
-        self.introns = []
-        self.primary_introns = []
-        self.primary_gene = None
-        self.primary_antisense_introns = []
-        self.antisense_introns = []
+        self.mintron_index = None
+
+    def _get_intron_list(self, intron_table):
+        indptr, intron_ids = intron_table[self.chrom, self.strand]
+        return [self.info.introns[intron_id]
+                for intron_id in intron_ids[indptr[self.mintron_index]:indptr[self.mintron_index + 1]]]
+
+    def get_introns(self):
+        return self._get_intron_list(self.info.mintron_introns)
+
+    def get_primary_introns(self):
+        return self._get_intron_list(self.info.mintron_primary_introns)
+
+    def get_antisense_introns(self):
+        return self._get_intron_list(self.info.mintron_antisense_introns)
+
+    def get_primary_antisense_introns(self):
+        return self._get_intron_list(self.info.mintron_primary_antisense_introns)
+
+    def get_primary_gene(self):
+        # All primary introns (sense or antisense) belong to the primary gene
+        primary_introns = self.primary_introns or self.primary_antisense_introns
+        return primary_introns[0].gene if primary_introns else None
 
     def __repr__(self):
         return f"Mintron({self.chrom}, {self.strand}, {self.start}, {self.end}, {self.primary_introns}, {self.primary_gene})"
 
+    introns = property(get_introns)
+    primary_introns = property(get_primary_introns)
+    antisense_introns = property(get_antisense_introns)
+    primary_antisense_introns = property(get_primary_antisense_introns)
+    primary_gene = property(get_primary_gene)
+
 
 class AnnotationInfo:
     """ Data structure containing all the information in a gene info file.
@@ -120,6 +195,12 @@ class AnnotationInfo:
      Stores genes, transcripts, intergenic regions, and exons both for easy access by ID and for quick lookup by
      position, using sorted lists by start position, allowing binary search."""
 
+    # Increment whenever the attributes stored by AnnotationInfo change, so
+    # cached copies from older versions are not loaded.
+    CACHE_FORMAT_VERSION = 4
+    # Alignment (in bytes) of the arrays stored in a cache file.
+    CACHE_ARRAY_ALIGNMENT = 64
+
     def __init__(self, geneinfo_file_path, chrom_lengths, flank_size=1500):
         """
         Load geneinfo file as a large datastructure containing all the information
@@ -190,124 +271,347 @@ class AnnotationInfo:
         # Get intergenic regions sorted by start
         self.intergenics = self.complement_regions(self.flanked_genics, by_strand=False)
 
-        # Compute the mintrons and their inclusions
-        # mintrons are each region that is neither intergenic nor exonic - pieces of intron
-        intergenic_and_exonic = {(chrom, strand): sorted(itertools.chain(self.intergenics[chrom], self.merged_exons[chrom, strand]), key=lambda x: x.start)
-                                 for chrom, strand in self.merged_exons}
-        self.intergenic_and_exonic = self.merge_regions(intergenic_and_exonic)
-        self.mintrons_by_chrom = self.complement_regions(self.intergenic_and_exonic, cls=Mintron)
-
-        # The start,ends of the mintrons/intergenics as numpy arrays for fast lookup
-        self.mintron_extents_by_chrom = {(chrom, strand): (numpy.array([mintron.start for mintron in mintrons]),
-                                                           numpy.array([mintron.end for mintron in mintrons]))
-                                         for (chrom, strand), mintrons in self.mintrons_by_chrom.items()}
-        self.intergenic_extents_by_chrom = {chrom: (numpy.array([intergenic.start for intergenic in intergenics]),
-                                                    numpy.array([intergenic.end for intergenic in intergenics]))
+        # The start,ends of the intergenics as numpy arrays for fast lookup
+        self.intergenic_extents_by_chrom = {chrom: (numpy.array([intergenic.start for intergenic in intergenics],
+                                                                dtype=numpy.int64),
+                                                    numpy.array([intergenic.end for intergenic in intergenics],
+                                                                dtype=numpy.int64))
                                             for chrom, intergenics in self.intergenics.items()}
 
+        # Compute the mintrons with a sweep over the intergenic and exonic regions of each contig
+        # mintrons are each region that is neither intergenic nor exonic - pieces of intron
+        # The start,ends of the mintrons are also kept as numpy arrays for fast lookup
+        self.mintron_extents_by_chrom = dict()
+        self.mintrons_by_chrom = dict()
+        for (chrom, strand), exons in self.merged_exons.items():
+            intergenic_starts, intergenic_ends = self.intergenic_extents_by_chrom[chrom]
+            covered_starts, covered_ends = AnnotationInfo.merge_extents(
+                numpy.concatenate([intergenic_starts, numpy.array([exon.start for exon in exons], dtype=numpy.int64)]),
+                numpy.concatenate([intergenic_ends, numpy.array([exon.end for exon in exons], dtype=numpy.int64)]))
+            mintron_starts, mintron_ends = AnnotationInfo.complement_extents(covered_starts, covered_ends,
+                                                                             self.chrom_lengths[chrom])
+            self.mintron_extents_by_chrom[chrom, strand] = mintron_starts, mintron_ends
+            # Mintrons are kept in plain lists, so they can be looked up by index
+            mintrons = [Mintron(self, chrom, strand, start, end)
+                        for start, end in zip(mintron_starts.tolist(), mintron_ends.tolist())]
+            for mintron_index, mintron in enumerate(mintrons):
+                mintron.mintron_index = mintron_index
+            self.mintrons_by_chrom[chrom, strand] = mintrons
+
+        # Number every intron (including flanks), so the mintrons of each intron can be stored in arrays
+        self.introns = [intron for transcript in self.transcripts.values() for intron in transcript.introns]
+        for intron_id, intron in enumerate(self.introns):
+            intron.intron_id = intron_id
+        # [first, stop) range of indices into mintrons_by_chrom of the mintrons each intron overlaps,
+        # on its own strand and on the opposite strand
+        self.intron_mintron_ranges = numpy.zeros((len(self.introns), 2), dtype=numpy.int64)
+        self.intron_antisense_mintron_ranges = numpy.zeros((len(self.introns), 2), dtype=numpy.int64)
+        # Sum of the lengths of those mintrons
+        self.intron_effective_lengths = numpy.zeros(len(self.introns), dtype=numpy.int64)
+        self.intron_antisense_effective_lengths = numpy.zeros(len(self.introns), dtype=numpy.int64)
+        # Introns overlapping each mintron, as (indptr, intron_ids) tables by contig. The intron IDs for the
+        # mintron at index i are intron_ids[indptr[i]:indptr[i+1]]
+        self.mintron_introns = dict()
+        self.mintron_primary_introns = dict()
+        self.mintron_antisense_introns = dict()
+        self.mintron_primary_antisense_introns = dict()
+
         # Give mintrons their annotations
-        for (chrom, strand), transcripts in self.transcripts_by_chrom.items():
-            mintrons = self.mintrons_by_chrom[chrom, strand]
-            mintron_starts = numpy.array([m.start for m in mintrons])
-            for transcript in transcripts:
-                for intron in transcript.introns:
-                    # Find corresponding mintrons
-                    # first find the one that starts before us, which we may or may not intersect
-                    index_before = numpy.searchsorted(mintron_starts, intron.start, side="right") - 1
-                    if index_before == -1:  # No mintrons before our start
-                        index_before = 0
-                    mintron_before = mintrons[index_before]
-                    if mintron_before.end < intron.start:
-                        # We do not intersect with this one
-                        # But the next one either does intersect or is past us to the right
-                        index_before = index_before + 1
-
-                    # Find first mintron that is completely to our right
-                    index_after = numpy.searchsorted(mintron_starts, intron.end, side="right")
-                    if index_after == len(mintron_starts):  # no mintrons after our end
-                        index_after = len(mintron_starts)
-
-                    mintrons_intersected = range(index_before,
-                                                 index_after)  # possibly nothing in this range if these are equal
-
-                    intron.mintrons = [mintrons[i] for i in mintrons_intersected]
-                    for mintron in intron.mintrons:
-                        mintron.introns.append(intron)
-                        if mintron.primary_gene is None:
-                            mintron.primary_gene = intron.gene
-                            mintron.primary_introns = [intron]
-                        elif mintron.primary_gene == intron.gene:
-                            mintron.primary_introns.append(intron)
-                        else:
-                            if intron.gene.start > mintron.primary_gene.start:
-                                # Overwrite existing primary introns since we start closer to their mintron
-                                mintron.primary_introns = [intron]
-                                mintron.primary_gene = intron.gene
-                            else:
-                                pass
-                                # Skip if our gene starts before the primary one
-                                # Idea is if a gene lives inside another one, it should get priority over the introns
-                                # of the bigger gene since we won't want to count a read for both genes
-
-            # Now add in anti-sense if necessary
-            # Sense gets preference so annotate only if no sense annotation already exists
+        # Each mintron's primary gene is the gene that starts closest to it (ie: the largest start position)
+        # out of all genes with introns overlapping it. Ties go to the gene whose transcript comes first.
+        # The idea is if a gene lives inside another one, it should get priority over the introns of the
+        # bigger gene since we won't want to count a read for both genes.
+        # Sense gets preference, so a mintron only gets anti-sense annotations if no sense intron overlaps it.
+        gene_indices = {gene_id: gene_index for gene_index, gene_id in enumerate(self.genes)}
+        for (chrom, strand), mintrons in self.mintrons_by_chrom.items():
+            mintron_starts, mintron_ends = self.mintron_extents_by_chrom[chrom, strand]
             antisense_strand = "+" if strand == "-" else "-"
             # Use .get() to avoid a KeyError if there are no transcripts on the given
             # chromosome/strand (like small chromsomes and non-standard contigs).
-            for transcript in self.transcripts_by_chrom.get((chrom, antisense_strand), []):
-                for intron in transcript.introns:
-                    # Find corresponding mintrons
-                    # first find the one that starts before us, which we may or may not intersect
-                    index_before = numpy.searchsorted(mintron_starts, intron.start, side="right") - 1
-                    if index_before == -1:  # No mintrons before our start
-                        index_before = 0
-                    mintron_before = mintrons[index_before]
-                    if mintron_before.end < intron.start:
-                        # We do not intersect with this one
-                        # But the next one either does intersect or is past us to the right
-                        index_before = index_before + 1
-
-                    # Find first mintron that is completely to our right
-                    index_after = numpy.searchsorted(mintron_starts, intron.end, side="right")
-                    if index_after == len(mintron_starts):  # no mintrons after our end
-                        index_after = len(mintron_starts)
-
-                    mintrons_intersected = range(index_before,
-                                                 index_after)  # possibly nothing in this range if these are equal
-
-                    intron.antisense_mintrons = [mintrons[i] for i in mintrons_intersected]
-                    for mintron in intron.antisense_mintrons:
-                        mintron.antisense_introns.append(intron)
-                        if mintron.primary_gene is None:
-                            mintron.primary_antisense_introns = [intron]
-                            mintron.primary_gene = intron.gene
-                        elif mintron.primary_gene == intron.gene:
-                            mintron.primary_antisense_introns.append(intron)
-                        elif mintron.primary_gene.strand == antisense_strand:
-                            if intron.gene.start > mintron.primary_gene.start:
-                                # Overwrite existing primary introns since we start closer to their mintron
-                                mintron.primary_antisense_introns = [intron]
-                                mintron.primary_gene = intron.gene
-                            else:
-                                pass
-                                # Skip if our gene starts before the primary one
-                                # Idea is if a gene lives inside another one, it should get priority over the introns
-                                # of the bigger gene since we won't want to count a read for both genes
-                        else:
-                            pass
-                            # Do nothing since the mintron already has sense annotations, don't give it any anti-sense
-
-            # Compute effective lengths of each intron
-            for transcript in self.transcripts.values():
-                for intron in transcript.introns:
-                    intron.effective_length = 0
-                    for mintron in intron.mintrons:
-                        intron.effective_length += mintron.end - mintron.start + 1
-                    intron.antisense_effective_length = 0
-                    for mintron in intron.antisense_mintrons:
-                        intron.antisense_effective_length += mintron.end - mintron.start + 1
+            sense_overlaps = self.find_mintron_overlaps(
+                self.transcripts_by_chrom.get((chrom, strand), []), mintron_starts, mintron_ends, gene_indices,
+                self.intron_mintron_ranges, self.intron_effective_lengths)
+            antisense_overlaps = self.find_mintron_overlaps(
+                self.transcripts_by_chrom.get((chrom, antisense_strand), []), mintron_starts, mintron_ends,
+                gene_indices, self.intron_antisense_mintron_ranges, self.intron_antisense_effective_lengths)
+
+            sense_mintron_indices, sense_intron_ids, _, _ = sense_overlaps
+            is_sense_primary = AnnotationInfo.find_primary_overlaps(*sense_overlaps, len(mintrons))
+            antisense_mintron_indices, antisense_intron_ids, _, _ = antisense_overlaps
+            is_antisense_primary = AnnotationInfo.find_primary_overlaps(*antisense_overlaps, len(mintrons))
+            has_sense_introns = numpy.zeros(len(mintrons), dtype=bool)
+            has_sense_introns[sense_mintron_indices] = True
+            is_antisense_primary &= ~has_sense_introns[antisense_mintron_indices]
+
+            self.mintron_introns[chrom, strand] = AnnotationInfo.build_intron_table(
+                sense_mintron_indices, sense_intron_ids, len(mintrons))
+            self.mintron_primary_introns[chrom, strand] = AnnotationInfo.build_intron_table(
+                sense_mintron_indices[is_sense_primary], sense_intron_ids[is_sense_primary], len(mintrons))
+            self.mintron_antisense_introns[chrom, strand] = AnnotationInfo.build_intron_table(
+                antisense_mintron_indices, antisense_intron_ids, len(mintrons))
+            self.mintron_primary_antisense_introns[chrom, strand] = AnnotationInfo.build_intron_table(
+                antisense_mintron_indices[is_antisense_primary], antisense_intron_ids[is_antisense_primary],
+                len(mintrons))
+
+    def find_mintron_overlaps(self, transcripts, mintron_starts, mintron_ends, gene_indices,
+                              intron_mintron_ranges, intron_effective_lengths):
+        """
+        Find the mintrons that intersect each intron of the given transcripts, recording the range of
+        mintrons and the effective length of each intron.
+
+        :param transcripts: transcripts whose introns are located, in order of their start position
+        :param mintron_starts: sorted numpy array of the start positions of the mintrons on one contig
+        :param mintron_ends: numpy array of the corresponding end positions
+        :param gene_indices: dictionary of {gene_id -> integer identifying the gene}
+        :param intron_mintron_ranges: array, indexed by intron ID, in which to store the [first, stop) range
+                                      of indices of the intersected mintrons
+        :param intron_effective_lengths: array, indexed by intron ID, in which to store the total length of
+                                         the intersected mintrons
+        :return: (mintron_indices, intron_ids, gene_starts, gene_indices) numpy arrays, with one entry per
+                 intersecting (mintron, intron) pair. Pairs are sorted by mintron, then by the order of the
+                 introns in the transcripts.
+        """
+        introns = [intron for transcript in transcripts for intron in transcript.introns]
+        intron_ids = numpy.array([intron.intron_id for intron in introns], dtype=numpy.int64)
+        intron_starts = numpy.array([intron.start for intron in introns], dtype=numpy.int64)
+        intron_ends = numpy.array([intron.end for intron in introns], dtype=numpy.int64)
+        intron_genes = [self.genes[intron.gene_id] for intron in introns]
+        intron_gene_starts = numpy.array([gene.start for gene in intron_genes], dtype=numpy.int64)
+        intron_gene_indices = numpy.array([gene_indices[gene.gene_id] for gene in intron_genes], dtype=numpy.int64)
+
+        first, stop = AnnotationInfo.find_mintron_ranges(mintron_starts, mintron_ends, intron_starts, intron_ends)
+        intron_mintron_ranges[intron_ids, 0] = first
+        intron_mintron_ranges[intron_ids, 1] = stop
+        mintron_length_cumsum = numpy.zeros(len(mintron_starts) + 1, dtype=numpy.int64)
+        numpy.cumsum(mintron_ends - mintron_starts + 1, out=mintron_length_cumsum[1:])
+        intron_effective_lengths[intron_ids] = mintron_length_cumsum[stop] - mintron_length_cumsum[first]
+
+        # Expand each intron into one entry per intersected mintron
+        overlap_counts = stop - first
+        overlap_introns = numpy.repeat(numpy.arange(len(introns)), overlap_counts)
+        overlap_offsets = numpy.arange(len(overlap_introns)) - numpy.repeat(numpy.cumsum(overlap_counts) - overlap_counts,
+                                                                           overlap_counts)
+        overlap_mintrons = first[overlap_introns] + overlap_offsets
+        # Stable sort, so pairs of each mintron stay in intron order
+        order = numpy.argsort(overlap_mintrons, kind="stable")
+        overlap_introns = overlap_introns[order]
+        return (overlap_mintrons[order], intron_ids[overlap_introns],
+                intron_gene_starts[overlap_introns], intron_gene_indices[overlap_introns])
+
+    @staticmethod
+    def find_mintron_ranges(mintron_starts, mintron_ends, intron_starts, intron_ends):
+        """
+        Find the mintrons that intersect each of the given introns.
+
+        :param mintron_starts: sorted numpy array of the start positions of the mintrons on one contig
+        :param mintron_ends: numpy array of the corresponding end positions
+        :param intron_starts: numpy array of the start positions of the introns
+        :param intron_ends: numpy array of the corresponding end positions
+        :return: (first, stop) numpy arrays giving the range of indices of the mintrons intersected by each
+                 intron (empty if first == stop)
+        """
+        if len(mintron_starts) == 0:
+            return numpy.zeros_like(intron_starts), numpy.zeros_like(intron_starts)
+        # first find the one that starts before us, which we may or may not intersect
+        first = numpy.maximum(numpy.searchsorted(mintron_starts, intron_starts, side="right") - 1, 0)
+        # If we do not intersect with this one, the next one either does intersect or is past us to the right
+        first += mintron_ends[first] < intron_starts
+        # Find first mintron that is completely to our right
+        stop = numpy.searchsorted(mintron_starts, intron_ends, side="right")
+        return first, numpy.maximum(first, stop)
+
+    @staticmethod
+    def find_primary_overlaps(mintron_indices, intron_ids, gene_starts, gene_indices, num_mintrons):
+        """
+        Determine which (mintron, intron) pairs belong to the primary gene of their mintron: the gene with
+        the largest start position, with ties going to the gene of the earliest intron.
+
+        :param mintron_indices: numpy array of the mintron of each pair, in the order given by
+                                find_mintron_overlaps()
+        :param intron_ids: numpy array of the intron of each pair
+        :param gene_starts: numpy array of the start position of the gene of each pair's intron
+        :param gene_indices: numpy array identifying the gene of each pair's intron
+        :param num_mintrons: number of mintrons on the contig
+        :return: boolean numpy array, True for pairs whose intron is one of the mintron's primary introns
+        """
+        # Order each mintron's pairs by descending gene start, keeping intron order within ties, so the
+        # primary gene is the gene of the first pair for each mintron
+        order = numpy.lexsort((numpy.arange(len(mintron_indices)), -gene_starts, mintron_indices))
+        is_first = numpy.ones(len(order), dtype=bool)
+        is_first[1:] = mintron_indices[order[1:]] != mintron_indices[order[:-1]]
+        primary_gene_indices = numpy.full(num_mintrons, -1, dtype=numpy.int64)
+        primary_gene_indices[mintron_indices[order[is_first]]] = gene_indices[order[is_first]]
+        return gene_indices == primary_gene_indices[mintron_indices]
+
+    @staticmethod
+    def merge_extents(starts, ends):
+        """
+        Merge overlapping or adjacent regions, given as numpy arrays of their starts and ends (in any order).
+
+        :param starts: numpy array of region start positions
+        :param ends: numpy array of the corresponding end positions
+        :return: (starts, ends) numpy arrays of the merged regions, sorted by start position
+        """
+        if len(starts) == 0:
+            return starts, ends
+        order = numpy.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+        # A region starts a new merged region if it begins past the furthest end of all regions before it
+        furthest_ends = numpy.maximum.accumulate(ends)
+        is_new = numpy.ones(len(starts), dtype=bool)
+        is_new[1:] = starts[1:] > furthest_ends[:-1] + 1
+        new_indices = numpy.flatnonzero(is_new)
+        return starts[new_indices], numpy.maximum.reduceat(ends, new_indices)
+
+    @staticmethod
+    def complement_extents(starts, ends, chrom_length):
+        """
+        Find the regions of a chromosome not covered by the given merged regions.
+
+        :param starts: sorted numpy array of the start positions of merged regions
+        :param ends: numpy array of the corresponding end positions
+        :param chrom_length: length of the chromosome
+        :return: (starts, ends) numpy arrays of the complementary regions
+        """
+        complement_starts = numpy.concatenate([[1], ends + 1])
+        complement_ends = numpy.concatenate([starts - 1, [chrom_length]])
+        # No complement on left end if the first region starts at 1, and none on the right end
+        # unless there is room past the last region
+        keep = numpy.ones(len(complement_starts), dtype=bool)
+        keep[0] = len(starts) == 0 or starts[0] != 1
+        keep[-1] = complement_starts[-1] < chrom_length
+        return complement_starts[keep], complement_ends[keep]
+
+    @staticmethod
+    def build_intron_table(mintron_indices, intron_ids, num_mintrons):
+        """
+        Pack (mintron, intron) pairs into a pair of flat arrays listing the introns of each mintron.
 
+        :param mintron_indices: numpy array of the mintron of each pair, sorted
+        :param intron_ids: numpy array of the intron of each pair
+        :param num_mintrons: number of mintrons on the contig
+        :return: (indptr, intron_ids) where the IDs for mintron i are intron_ids[indptr[i]:indptr[i+1]]
+        """
+        indptr = numpy.zeros(num_mintrons + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(mintron_indices, minlength=num_mintrons), out=indptr[1:])
+        return indptr, intron_ids
+
+    @staticmethod
+    def load_or_build(geneinfo_file_path, chrom_lengths, flank_size=1500, cache_directory_path=None):
+        """
+        Load the AnnotationInfo for the given geneinfo file from the cache, or
+        build it and add it to the cache. Cache entries are keyed by the contents
+        of the geneinfo file, the chromosome lengths, and the flank size, so the
+        annotation is only processed once, no matter how many samples or runs
+        use it.
 
+        :param geneinfo_file_path: file path to find the geneinfo file
+        :param chrom_lengths: dictionary of {chromosome -> chromosome lengths}, obtainable from header of a SAM/BAM file
+        :param flank_size: Size of flanks to add to each gene
+        :param cache_directory_path: directory where serialized AnnotationInfo objects are stored (see
+                                     save_cache_file()). If None, the AnnotationInfo is always built from the
+                                     geneinfo file.
+        :return: AnnotationInfo for the given geneinfo file
+        """
+        if not cache_directory_path:
+            return AnnotationInfo(geneinfo_file_path, chrom_lengths, flank_size)
+
+        cache_key = hashlib.sha256()
+        cache_key.update(CampareeUtils.compute_file_digest(geneinfo_file_path).encode())
+        cache_key.update(json.dumps(chrom_lengths, sort_keys=True).encode())
+        cache_key.update(str(flank_size).encode())
+        cache_key.update(str(AnnotationInfo.CACHE_FORMAT_VERSION).encode())
+        cache_file_path = os.path.join(cache_directory_path, f"annotation_info.{cache_key.hexdigest()}.cache")
+
+        if os.path.isfile(cache_file_path):
+            info = AnnotationInfo.load_cache_file(cache_file_path)
+            if info is not None:
+                return info
+            print(f"Annotation cache file {cache_file_path} is corrupt. Rebuilding it.")
+
+        info = AnnotationInfo(geneinfo_file_path, chrom_lengths, flank_size)
+        # Write to a temporary file and rename it into place, so other jobs
+        # never load a partially written cache entry.
+        os.makedirs(cache_directory_path, mode=0o0755, exist_ok=True)
+        staging_file_descriptor, staging_file_path = tempfile.mkstemp(prefix=".annotation_info.",
+                                                                      dir=cache_directory_path)
+        try:
+            with os.fdopen(staging_file_descriptor, "wb") as cache_file:
+                AnnotationInfo.save_cache_file(info, cache_file)
+            os.chmod(staging_file_path, 0o0644)
+            os.replace(staging_file_path, cache_file_path)
+        except BaseException:
+            os.remove(staging_file_path)
+            raise
+        return info
+
+    @staticmethod
+    def save_cache_file(info, cache_file):
+        """
+        Serialize an AnnotationInfo to an open binary file. The objects are pickled, but the numpy arrays (extents
+        and intron/mintron tables) are written out-of-band as raw, aligned data after the pickle, so that
+        load_cache_file() can memory-map them rather than reading and copying them.
+
+        The file contains the length of the header (a little-endian 64-bit integer), the header (a pickled tuple of
+        the pickled AnnotationInfo and the (offset, length) of each array's data, relative to the start of the array
+        data), then the array data, starting at the first multiple of CACHE_ARRAY_ALIGNMENT after the header.
+
+        :param info: AnnotationInfo to save
+        :param cache_file: file object opened for writing in binary mode
+        """
+        buffers = []
+        pickled_info = pickle.dumps(info, protocol=5, buffer_callback=buffers.append)
+        buffers = [buffer.raw() for buffer in buffers]
+        buffer_extents = []
+        offset = 0
+        for buffer in buffers:
+            buffer_extents.append((offset, buffer.nbytes))
+            offset = AnnotationInfo._align_cache_offset(offset + buffer.nbytes)
+        header = pickle.dumps((pickled_info, buffer_extents), protocol=pickle.HIGHEST_PROTOCOL)
+        header_length = struct.calcsize("<Q") + len(header)
+        cache_file.write(struct.pack("<Q", len(header)))
+        cache_file.write(header)
+        cache_file.write(bytes(AnnotationInfo._align_cache_offset(header_length) - header_length))
+        for buffer, (offset, nbytes) in zip(buffers, buffer_extents):
+            cache_file.write(buffer)
+            cache_file.write(bytes(AnnotationInfo._align_cache_offset(offset + nbytes) - (offset + nbytes)))
+
+    @staticmethod
+    def load_cache_file(cache_file_path):
+        """
+        Load an AnnotationInfo saved by save_cache_file(). Its numpy arrays are read-only views of the memory-mapped
+        file.
+
+        :param cache_file_path: path to the cache file
+        :return: the AnnotationInfo, or None if the cache file is truncated or otherwise corrupt
+        """
+        try:
+            with open(cache_file_path, "rb") as cache_file:
+                file_size = os.fstat(cache_file.fileno()).st_size
+                header_length, = struct.unpack("<Q", cache_file.read(struct.calcsize("<Q")))
+                if struct.calcsize("<Q") + header_length > file_size:
+                    return None
+                pickled_info, buffer_extents = pickle.loads(cache_file.read(header_length))
+                data_start = AnnotationInfo._align_cache_offset(struct.calcsize("<Q") + header_length)
+                if any(data_start + offset + nbytes > file_size for offset, nbytes in buffer_extents):
+                    return None
+                if buffer_extents:
+                    cache_data = memoryview(mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ))
+                    buffers = [cache_data[data_start + offset:data_start + offset + nbytes]
+                               for offset, nbytes in buffer_extents]
+                else:
+                    buffers = []
+            return pickle.loads(pickled_info, buffers=buffers)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError,
+                TypeError, ValueError, struct.error):
+            return None
+
+    @staticmethod
+    def _align_cache_offset(offset):
+        """
+        Round an offset in a cache file up to the next multiple of CACHE_ARRAY_ALIGNMENT.
+        """
+        return -(-offset // AnnotationInfo.CACHE_ARRAY_ALIGNMENT) * AnnotationInfo.CACHE_ARRAY_ALIGNMENT
 
     def add_flanks(self, flank_size):
         """
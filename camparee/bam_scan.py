@@ -0,0 +1,501 @@
+import os
+import sys
+import argparse
+import json
+
+import numpy
+import pysam
+
+from beers_utils.sample import Sample
+from camparee.abstract_camparee_step import AbstractCampareeStep
+from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeUtils, CampareeException
+from camparee.variants_finder import VariantsFinderStep
+from camparee.intron_quant import IntronQuantificationStep, RegionOverlapCounter
+
+class BamScanStep(AbstractCampareeStep):
+    """Reads a sample's genome-aligned BAM file once and produces the output of
+    every step that scans the full BAM file.
+
+    Separately, the VariantsFinderStep, IntronQuantificationStep, and the
+    multimapper search of the AllelicImbalanceQuantificationStep each decompress
+    and parse the entire BAM file. This step streams the reads a single time,
+    handing each read to a set of consumers:
+
+    - VariantsFinderConsumer, which calls variants chromosome by chromosome and
+      writes the VariantsFinderStep's variants and log files.
+    - IntronQuantificationConsumer, which counts intron and intergenic reads and
+      writes the IntronQuantificationStep's quantification files. This consumer
+      is skipped if the user provided intron quantifications.
+    - MultimapperConsumer, which saves hashes of the names of reads with more
+      than one alignment, so the AllelicImbalanceQuantificationStep does not
+      need to search the BAM file for them.
+
+    The outputs are identical to those of the individual steps. The BAM file must
+    be sorted by coordinate, as it is when generated by the GenomeAlignmentStep.
+
+    """
+
+    def __init__(self, log_directory_path, data_directory_path, parameters=None):
+        """Constructor for BamScanStep object.
+
+        Parameters
+        ----------
+        log_directory_path : string
+            Full path to log directory.
+        data_directory_path : string
+            Full path to data directory.
+        parameters : dict
+            Dictionary of other parameters specified by the config file. This
+            parameter is not used by this class, since the parameters of the
+            VariantsFinderStep and IntronQuantificationStep are passed to
+            execute(). It is retained for uniformity with all other CAMPAREE
+            steps.
+
+        """
+        self.log_directory_path = log_directory_path
+        self.data_directory_path = data_directory_path
+
+    def validate(self):
+        return True
+
+    def execute(self, sample, alignment_file_path, chr_ploidy_data, reference_genome,
+                geneinfo_file_path, seed=None, variants_finder_parameters=None,
+                intron_quant_parameters=None):
+        """Scan the BAM file once, generating the variants, intron/intergenic
+        quantifications, and multimapping read hashes for the given sample.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample associated with the BAM file.
+        alignment_file_path : string
+            Path to the coordinate-sorted BAM file of reads aligned to the
+            reference genome.
+        chr_ploidy_data : dict
+            Dictionary of chromosomes as keys and a dictionary of male/female
+            ploidy as values.
+        reference_genome : dict
+            Dictionary representation of the reference genome.
+        geneinfo_file_path : string
+            Geneinfo file in BED format with 1-based, inclusive coordinates.
+        seed : integer
+            Seed for random number generator used by the VariantsFinderStep.
+        variants_finder_parameters : dict
+            Config file parameters for the VariantsFinderStep.
+        intron_quant_parameters : dict
+            Config file parameters for the IntronQuantificationStep. If None,
+            intron quantification is skipped (e.g. the user provided intron
+            quantifications for this sample).
+
+        """
+        log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
+                                     CAMPAREE_CONSTANTS.BAM_SCAN_LOG_FILENAME)
+        sample_data_directory_path = os.path.join(self.data_directory_path, f'sample{sample.sample_id}')
+
+        with open(log_file_path, 'w') as log_file, \
+             pysam.AlignmentFile(alignment_file_path, "rb") as alignments:
+
+            log_file.write(f"Scanning alignments for sample{sample.sample_id} in {alignment_file_path}\n")
+            # Consumers rely on reads from each chromosome arriving together and
+            # in order of their start position.
+            if alignments.header.to_dict().get('HD', {}).get('SO') != "coordinate":
+                raise BamScanException(f"{alignment_file_path} is not sorted by coordinate.")
+
+            variants_finder = VariantsFinderStep(self.log_directory_path, self.data_directory_path,
+                                                 variants_finder_parameters or {})
+            variants_finder.prepare_variant_calling(sample, chr_ploidy_data, reference_genome, seed)
+            consumers = [VariantsFinderConsumer(variants_finder),
+                         MultimapperConsumer(os.path.join(sample_data_directory_path,
+                                                          CAMPAREE_CONSTANTS.MULTIMAPPER_READ_HASHES_FILENAME))]
+            if intron_quant_parameters is not None:
+                intron_quant = IntronQuantificationStep(self.log_directory_path, self.data_directory_path,
+                                                        intron_quant_parameters)
+                consumers.append(IntronQuantificationConsumer(intron_quant, alignments, geneinfo_file_path,
+                                                              sample_data_directory_path))
+            log_file.write(f"Consumers: {', '.join(type(consumer).__name__ for consumer in consumers)}\n")
+
+            read_count = 0
+            for read in alignments.fetch(until_eof=True):
+                read_count += 1
+                for consumer in consumers:
+                    consumer.add_read(read)
+            log_file.write(f"Scanned {read_count} alignments.\n")
+
+            for consumer in consumers:
+                print(f"Finishing {type(consumer).__name__}")
+                consumer.finish()
+                log_file.write(f"Finished {type(consumer).__name__}.\n")
+
+            log_file.write("ALL DONE!\n")
+
+    def get_commandline_call(self, sample, alignment_file_path, chr_ploidy_file_path,
+                             reference_genome_file_path, geneinfo_file_path, seed=None,
+                             variants_finder_parameters=None, intron_quant_parameters=None):
+        """Prepare command to execute the BamScanStep from the command line,
+        given all of the arguments used to run the execute() function.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample associated with the BAM file.
+        alignment_file_path : string
+            Path to the coordinate-sorted BAM file of reads aligned to the
+            reference genome.
+        chr_ploidy_file_path : string
+            File that maps chromosome names to their male/female ploidy.
+        reference_genome_file_path : string
+            File that maps chromosome names in reference to nucleotide sequence.
+        geneinfo_file_path : string
+            Geneinfo file in BED format with 1-based, inclusive coordinates.
+        seed : integer
+            Seed for random number generator used by the VariantsFinderStep.
+        variants_finder_parameters : dict
+            Config file parameters for the VariantsFinderStep.
+        intron_quant_parameters : dict
+            Config file parameters for the IntronQuantificationStep. If None,
+            intron quantification is skipped.
+
+        Returns
+        -------
+        string
+            Command to execute on the command line. It will perform the same
+            operations as a call to execute() with the same parameters.
+
+        """
+        #Retrieve path to the bam_scan.py script.
+        bam_scan_path = os.path.realpath(__file__)
+        #If the above command returns a string with a "pyc" extension, instead
+        #of "py", strip off "c" so it points to this script.
+        bam_scan_path = bam_scan_path.rstrip('c')
+
+        command = (f" python {bam_scan_path}"
+                   f" --log_directory_path {self.log_directory_path}"
+                   f" --data_directory_path {self.data_directory_path}"
+                   f" --sample '{repr(sample)}'"
+                   f" --bam_filename {alignment_file_path}"
+                   f" --chr_ploidy_file_path {chr_ploidy_file_path}"
+                   f" --reference_genome_file_path {reference_genome_file_path}"
+                   f" --geneinfo_file_path {geneinfo_file_path}"
+                   f" --variants_finder_parameters '{json.dumps(variants_finder_parameters or {})}'")
+
+        if intron_quant_parameters is not None:
+            command += f" --intron_quant_parameters '{json.dumps(intron_quant_parameters)}'"
+        if seed is not None:
+            command += f" --seed {seed}"
+
+        return command
+
+    def get_validation_attributes(self, sample, alignment_file_path, chr_ploidy_file_path,
+                                  reference_genome_file_path, geneinfo_file_path, seed=None,
+                                  variants_finder_parameters=None, intron_quant_parameters=None):
+        """Prepare attributes required by is_output_valid() function to validate
+        output generated by the BamScanStep job corresponding to the given sample.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample associated with the BAM file.
+        alignment_file_path : string
+            Path to the BAM file. [Note: this parameter is captured just so
+            get_validation_attributes() accepts the same arguments as
+            get_commandline_call(). It is not used here.]
+        chr_ploidy_file_path : string
+            File that maps chromosome names to their male/female ploidy. [Note:
+            this parameter is captured just so get_validation_attributes()
+            accepts the same arguments as get_commandline_call(). It is not used
+            here.]
+        reference_genome_file_path : string
+            File that maps chromosome names in reference to nucleotide sequence.
+            [Note: this parameter is captured just so get_validation_attributes()
+            accepts the same arguments as get_commandline_call(). It is not used
+            here.]
+        geneinfo_file_path : string
+            Geneinfo file in BED format. [Note: this parameter is captured just
+            so get_validation_attributes() accepts the same arguments as
+            get_commandline_call(). It is not used here.]
+        seed : integer
+            Seed for random number generator. [Note: this parameter is captured
+            just so get_validation_attributes() accepts the same arguments as
+            get_commandline_call(). It is not used here.]
+        variants_finder_parameters : dict
+            Config file parameters for the VariantsFinderStep. [Note: this
+            parameter is captured just so get_validation_attributes() accepts
+            the same arguments as get_commandline_call(). It is not used here.]
+        intron_quant_parameters : dict
+            Config file parameters for the IntronQuantificationStep. Only used
+            to determine whether intron quantifications are generated.
+
+        Returns
+        -------
+        dict
+            A BamScanStep job's data_directory, log_directory, sample_id, and
+            whether it quantifies introns.
+
+        """
+        validation_attributes = {}
+        validation_attributes['data_directory'] = self.data_directory_path
+        validation_attributes['log_directory'] = self.log_directory_path
+        validation_attributes['sample_id'] = sample.sample_id
+        validation_attributes['quantify_introns'] = intron_quant_parameters is not None
+        return validation_attributes
+
+    @staticmethod
+    def main():
+        """
+        Entry point into script. Allows script to be executed/submitted via the
+        command line.
+        """
+
+        parser = argparse.ArgumentParser(description='Command line wrapper around'
+                                                     ' the single-pass BAM scan')
+        parser.add_argument('--log_directory_path')
+        parser.add_argument('--data_directory_path')
+        parser.add_argument('--sample')
+        parser.add_argument('--bam_filename')
+        parser.add_argument('--chr_ploidy_file_path')
+        parser.add_argument('--reference_genome_file_path')
+        parser.add_argument('--geneinfo_file_path')
+        parser.add_argument('--variants_finder_parameters', default='{}')
+        parser.add_argument('--intron_quant_parameters', default=None,
+                            help="jsonified IntronQuantificationStep parameters. If omitted,"
+                                 " intron quantification is skipped.")
+        parser.add_argument('--seed', type=int, default=None)
+        args = parser.parse_args()
+
+        bam_scan = BamScanStep(args.log_directory_path, args.data_directory_path)
+        sample = eval(args.sample)
+        reference_genome = CampareeUtils.create_genome(args.reference_genome_file_path)
+        chr_ploidy_data = CampareeUtils.create_chr_ploidy_data(args.chr_ploidy_file_path)
+        intron_quant_parameters = json.loads(args.intron_quant_parameters) \
+                                  if args.intron_quant_parameters is not None else None
+        bam_scan.execute(sample,
+                         args.bam_filename,
+                         chr_ploidy_data,
+                         reference_genome,
+                         args.geneinfo_file_path,
+                         args.seed,
+                         json.loads(args.variants_finder_parameters),
+                         intron_quant_parameters)
+
+    @staticmethod
+    def is_output_valid(validation_attributes):
+        """
+        Check if output of BamScanStep for a specific job/execution is correctly
+        formed and valid, given a job's data directory, log directory, and sample
+        id. Prepare these attributes for a given sample's jobs using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, sample_id, and whether it
+            quantifies introns.
+
+        Returns
+        -------
+        boolean
+            True  - The BamScanStep log, the VariantsFinderStep output, the
+                    multimapper read name hashes, and (if requested) the
+                    IntronQuantificationStep output were created and are well
+                    formed.
+            False - Any of these files do not exist or are missing data.
+
+        """
+        data_directory = validation_attributes['data_directory']
+        log_directory = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+
+        log_file_path = os.path.join(log_directory, f"sample{sample_id}",
+                                     CAMPAREE_CONSTANTS.BAM_SCAN_LOG_FILENAME)
+        multimapper_file_path = os.path.join(data_directory, f"sample{sample_id}",
+                                             CAMPAREE_CONSTANTS.MULTIMAPPER_READ_HASHES_FILENAME)
+        if not os.path.isfile(log_file_path) or not os.path.isfile(multimapper_file_path):
+            return False
+
+        #Read last line in bam scan log file
+        line = ""
+        with open(log_file_path, "r") as log_file:
+            for line in log_file:
+                line = line.rstrip()
+        if line != "ALL DONE!":
+            return False
+
+        if not VariantsFinderStep.is_output_valid(validation_attributes):
+            return False
+        if validation_attributes['quantify_introns'] and \
+           not IntronQuantificationStep.is_output_valid(BamScanStep._get_intron_quant_attributes(validation_attributes)):
+            return False
+        return True
+
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by BamScanStep for a specific job/execution,
+        given a job's data directory, log directory, and sample id. Prepare these
+        attributes for a given job using the get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, sample_id, and whether it
+            quantifies introns.
+
+        Returns
+        -------
+        list
+            Paths to the BamScanStep log file, the multimapper read hashes file,
+            and the output files of the VariantsFinderStep and (if requested)
+            IntronQuantificationStep.
+
+        """
+        data_directory = validation_attributes['data_directory']
+        log_directory = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+
+        output_file_paths = [os.path.join(log_directory, f"sample{sample_id}",
+                                          CAMPAREE_CONSTANTS.BAM_SCAN_LOG_FILENAME),
+                             os.path.join(data_directory, f"sample{sample_id}",
+                                          CAMPAREE_CONSTANTS.MULTIMAPPER_READ_HASHES_FILENAME)]
+        output_file_paths.extend(VariantsFinderStep.get_output_file_paths(validation_attributes))
+        if validation_attributes['quantify_introns']:
+            output_file_paths.extend(IntronQuantificationStep.get_output_file_paths(
+                BamScanStep._get_intron_quant_attributes(validation_attributes)))
+        return output_file_paths
+
+    @staticmethod
+    def _get_intron_quant_attributes(validation_attributes):
+        """Return the IntronQuantificationStep validation attributes for the
+        intron quantifications written by a BamScanStep job.
+        """
+        return {'output_directory': os.path.join(validation_attributes['data_directory'],
+                                                 f"sample{validation_attributes['sample_id']}")}
+
+
+class VariantsFinderConsumer:
+    """Collects the reads of each chromosome for a VariantsFinderStep, calling
+    the chromosome's variants once the scan moves on to the next chromosome.
+
+    Variants are written once the scan completes, in the VariantsFinderStep's
+    chromosome order, so the output matches that of the VariantsFinderStep.
+    """
+
+    def __init__(self, variants_finder):
+        """
+        Parameters
+        ----------
+        variants_finder : VariantsFinderStep
+            Step whose prepare_variant_calling() method was already called.
+
+        """
+        self.variants_finder = variants_finder
+        self.chromosomes = set(variants_finder.chromosomes)
+        self.current_chromosome = None
+        self.variants_by_chromosome = {}
+
+    def add_read(self, read):
+        if read.reference_name != self.current_chromosome:
+            self._call_current_chromosome()
+            self.current_chromosome = read.reference_name
+        if self.current_chromosome in self.chromosomes:
+            self.variants_finder.add_read(read)
+
+    def finish(self):
+        self._call_current_chromosome()
+        for chromosome in self.variants_finder.chromosomes:
+            self.variants_finder.record_variants(chromosome, self.variants_by_chromosome.get(chromosome, []))
+        self.variants_finder.write_log()
+
+    def _call_current_chromosome(self):
+        """Call the variants from the reads of the chromosome currently being
+        collected, if variants are called for that chromosome, and clear the
+        collected reads.
+        """
+        if self.current_chromosome in self.chromosomes:
+            print(f"Finding variants for chromosome {self.current_chromosome}")
+            self.variants_by_chromosome[self.current_chromosome] = \
+                self.variants_finder.call_variants(self.current_chromosome, self.variants_finder.reads)
+        self.variants_finder.start_read_collection()
+
+
+class IntronQuantificationConsumer:
+    """Counts the intron and intergenic reads for an IntronQuantificationStep,
+    writing its quantification files once the scan completes.
+    """
+
+    def __init__(self, intron_quant, alignments, geneinfo_file_path, output_directory):
+        """
+        Parameters
+        ----------
+        intron_quant : IntronQuantificationStep
+            Step used to count and quantify the reads.
+        alignments : pysam.AlignmentFile
+            Alignment file being scanned. Provides the chromosome lengths.
+        geneinfo_file_path : string
+            Geneinfo file in BED format with 1-based, inclusive coordinates.
+        output_directory : string
+            Directory where the quantification files are saved.
+
+        """
+        self.intron_quant = intron_quant
+        self.output_directory = output_directory
+        self.intron_quant.load_annotation(alignments, geneinfo_file_path)
+        self.overlap_counter = RegionOverlapCounter(self.intron_quant.info)
+        self.intron_quant.start_counting(self.overlap_counter, coordinate_sorted=True)
+
+    def add_read(self, read):
+        self.intron_quant.add_read(read)
+
+    def finish(self):
+        self.intron_quant.finish_counting()
+        self.intron_quant.quantify(self.overlap_counter, self.output_directory)
+
+
+class MultimapperConsumer:
+    """Collects the names of reads with more than one alignment (NH > 1) and
+    saves the sorted array of their unique 64-bit hashes (see
+    CampareeUtils.hash_read_names()) as a numpy .npy file.
+
+    Names are hashed in batches as they are collected, so only the hashes of
+    all but the most recent batch are held in memory.
+    """
+
+    BATCH_SIZE = 1_000_000
+
+    def __init__(self, output_file_path):
+        """
+        Parameters
+        ----------
+        output_file_path : string
+            File where the read name hashes are saved.
+
+        """
+        self.output_file_path = output_file_path
+        self.read_names = set()
+        self.read_name_hash_batches = []
+
+    def add_read(self, read):
+        if read.has_tag('NH') and read.get_tag('NH') > 1:
+            self.read_names.add(read.query_name)
+            if len(self.read_names) >= MultimapperConsumer.BATCH_SIZE:
+                self._hash_read_names()
+
+    def finish(self):
+        self._hash_read_names()
+        read_name_hashes = numpy.unique(numpy.concatenate(self.read_name_hash_batches))
+        with open(self.output_file_path, 'wb') as output_file:
+            numpy.save(output_file, read_name_hashes)
+
+    def _hash_read_names(self):
+        """Move the collected read names into the batches of hashes.
+        """
+        self.read_name_hash_batches.append(numpy.unique(CampareeUtils.hash_read_names(self.read_names)))
+        self.read_names = set()
+
+
+class BamScanException(CampareeException):
+    pass
+
+
+if __name__ == "__main__":
+    sys.exit(BamScanStep.main())
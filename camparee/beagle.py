@@ -227,5 +227,30 @@ class BeagleStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by BeagleStep for a specific job/execution,
+        given a CAMPAREE run's data directory and log directory. Prepare these
+        attributes for a given job using the get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A CAMPAREE run's data_directory and log_directory.
+
+        Returns
+        -------
+        list
+            Paths to the phased VCF file and log file.
+
+        """
+
+        data_directory = validation_attributes['data_directory']
+        log_directory = validation_attributes['log_directory']
+
+        return [os.path.join(data_directory, BeagleStep.BEAGLE_OUTPUT_FILENAME + ".vcf.gz"),
+                os.path.join(log_directory, BeagleStep.BEAGLE_LOG_FILENAME)]
+
 if __name__ == "__main__":
     sys.exit(BeagleStep.main())
@@ -3,10 +3,20 @@ import sys
 import argparse
 import subprocess
 import json
+import gzip
+import errno
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import pysam
 
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_utils import CampareeException
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.transcriptome_index_cache import TranscriptomeIndexCache
 from beers_utils.sample import Sample
 
 # TODO: Add support for additional command line arguments to pass to Bowtie2 commands.
@@ -19,6 +29,10 @@ class Bowtie2IndexStep(AbstractCampareeStep):
     BOWTIE2_INDEX_DIR_PATTERN = CAMPAREE_CONSTANTS.BOWTIE2_INDEX_DIR_PATTERN
     BOWTIE2_INDEX_PREFIX_PATTERN = CAMPAREE_CONSTANTS.BOWTIE2_INDEX_PREFIX_PATTERN
     BOWTIE2_INDEX_LOG_FILENAME_PATTERN = CAMPAREE_CONSTANTS.BOWTIE2_INDEX_LOG_FILENAME_PATTERN
+    # Extensions of the 6 index files produced by bowtie2-build.
+    BOWTIE2_INDEX_FILE_EXTENSIONS = [".1.bt2", ".2.bt2", ".3.bt2", ".4.bt2", ".rev.1.bt2", ".rev.2.bt2"]
+    # Prefix under which Bowtie2 index files are stored in the index cache.
+    BOWTIE2_INDEX_CACHE_PREFIX = "bowtie2_transcriptome"
 
     #The basic Bowtie2 command used to generate indexes from a given FASTA.
     BASE_BOWTIE2_INDEX_COMMAND = ('{bowtie2_bin_dir}/bowtie2-build'
@@ -39,13 +53,18 @@ class Bowtie2IndexStep(AbstractCampareeStep):
         parameters : dict
             [Optional] Dictionary of Bowtie2 parameters specified by the config
             file (Note, the "num_bowtie_threads" entry in the config file maps
-            to the bowtie2 "--threads" command line parameter).
+            to the bowtie2 "--threads" command line parameter). The optional
+            "index_cache_directory_path" entry points to a directory where
+            Bowtie2 indexes are cached and shared across samples and runs,
+            keyed by the contents of the transcriptome FASTA.
 
         """
         self.data_directory_path = data_directory_path
         self.log_directory_path = log_directory_path
         self.num_bowtie2_threads = parameters.pop('num_bowtie_threads', 1)
-        # Remaining parameters (if any) aside from  "num_bowtie_threads"
+        self.index_cache_directory_path = parameters.pop('index_cache_directory_path', None)
+        # Remaining parameters (if any) aside from "num_bowtie_threads" and
+        # "index_cache_directory_path"
         self.bowtie2_cmd_options = parameters
 
     def validate(self):
@@ -106,7 +125,8 @@ class Bowtie2IndexStep(AbstractCampareeStep):
                            f"    Bowtie2 index directory: {bowtie2_index_dir_path}\n"
                            f"    Bowtie2 index file prefix: {bowtie2_index_file_prefix}\n"
                            f"    Input transcriptome FASTA: {transcriptome_fasta_path}\n"
-                           f"    Number of Bowtie2 threads: {self.num_bowtie2_threads}\n")
+                           f"    Number of Bowtie2 threads: {self.num_bowtie2_threads}\n"
+                           f"    Bowtie2 index cache directory: {self.index_cache_directory_path}\n")
 
             log_file.write("Create Bowtie2 index directory.\n")
             if os.path.isdir(bowtie2_index_dir_path):
@@ -114,6 +134,28 @@ class Bowtie2IndexStep(AbstractCampareeStep):
             else:
                 os.mkdir(bowtie2_index_dir_path)
 
+            # Reuse a previously built index if an identical transcriptome was
+            # already indexed by another sample, parental genome, or run. The
+            # number of threads does not affect the index, so it is not part of
+            # the cache key.
+            index_cache = None
+            if self.index_cache_directory_path:
+                index_tool_version = TranscriptomeIndexCache.get_tool_version(
+                    os.path.join(bowtie2_bin_dir, "bowtie2-build"), "--version")
+                index_cache = TranscriptomeIndexCache(self.index_cache_directory_path, index_type="bowtie2",
+                                                      index_parameters=self.bowtie2_cmd_options,
+                                                      index_tool_version=index_tool_version)
+                cache_key = index_cache.get_cache_key(transcriptome_fasta_path)
+                cached_index_paths = {Bowtie2IndexStep.BOWTIE2_INDEX_CACHE_PREFIX + extension:
+                                          bowtie2_index_file_prefix + extension
+                                      for extension in Bowtie2IndexStep.BOWTIE2_INDEX_FILE_EXTENSIONS}
+                log_file.write(f"Bowtie2 index cache key: {cache_key}\n")
+                if index_cache.fetch(cache_key, cached_index_paths):
+                    print("Found matching Bowtie2 index in the index cache.\n")
+                    log_file.write("Copied matching Bowtie2 index from the index cache.\n")
+                    log_file.write("ALL DONE!\n")
+                    return
+
             bwt2_cmd_options = ' '.join( f"{key} {value}" for key,value in self.bowtie2_cmd_options.items() )
 
             bowtie2_command = Bowtie2IndexStep.BASE_BOWTIE2_INDEX_COMMAND.format(bowtie2_bin_dir=bowtie2_bin_dir,
@@ -145,6 +187,11 @@ class Bowtie2IndexStep(AbstractCampareeStep):
             print("Finished generating Bowtie2 index.\n")
             log_file.write(f"{bowtie2_result.stdout}\n")
             log_file.write("\nFinished generating Bowtie2 index.\n")
+
+            if index_cache:
+                index_cache.store(cache_key, cached_index_paths)
+                log_file.write("Stored Bowtie2 index in the index cache.\n")
+
             log_file.write("ALL DONE!\n")
 
     def get_commandline_call(self, sample_id, genome_suffix, bowtie2_bin_dir, transcriptome_fasta_path):
@@ -193,6 +240,10 @@ class Bowtie2IndexStep(AbstractCampareeStep):
                    f" --transcriptome_fasta_file_path {transcriptome_fasta_path}"
                    f" --num_bowtie2_threads {self.num_bowtie2_threads}"
                    f" --bowtie2_parameters '{json.dumps(self.bowtie2_cmd_options)}'")
+
+        if self.index_cache_directory_path:
+            command += f" --index_cache_directory_path {self.index_cache_directory_path}"
+
         return command
 
     def get_validation_attributes(self, sample_id, genome_suffix, bowtie2_bin_dir, transcriptome_fasta_path):
@@ -272,12 +323,8 @@ class Bowtie2IndexStep(AbstractCampareeStep):
 
         # Note, bowtie2-build should produce 6 different index files. They all
         # should exist.
-        if os.path.isfile(bowtie2_index_file_prefix + ".1.bt2") and \
-           os.path.isfile(bowtie2_index_file_prefix + ".2.bt2") and \
-           os.path.isfile(bowtie2_index_file_prefix + ".3.bt2") and \
-           os.path.isfile(bowtie2_index_file_prefix + ".4.bt2") and \
-           os.path.isfile(bowtie2_index_file_prefix + ".rev.1.bt2") and \
-           os.path.isfile(bowtie2_index_file_prefix + ".rev.2.bt2") and \
+        if all(os.path.isfile(bowtie2_index_file_prefix + extension)
+               for extension in Bowtie2IndexStep.BOWTIE2_INDEX_FILE_EXTENSIONS) and \
            os.path.isfile(log_file_path):
 
             #Read last line in log file
@@ -290,12 +337,48 @@ class Bowtie2IndexStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by Bowtie2IndexStep for a specific
+        job/execution, given a job's data directory, log directory, sample ID, and
+        genome suffix. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, corresponding sample_id, and
+            genome_suffix used when creating the Bowtie2 index.
+
+        Returns
+        -------
+        list
+            Paths to the six Bowtie2 index files and the log file.
+
+        """
+
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_suffix = validation_attributes['genome_suffix']
+
+        bowtie2_index_file_prefix = os.path.join(data_directory_path, f'sample{sample_id}',
+                                                 Bowtie2IndexStep.BOWTIE2_INDEX_DIR_PATTERN.format(genome_name=genome_suffix),
+                                                 Bowtie2IndexStep.BOWTIE2_INDEX_PREFIX_PATTERN.format(genome_name=genome_suffix))
+        output_file_paths = [bowtie2_index_file_prefix + extension
+                             for extension in Bowtie2IndexStep.BOWTIE2_INDEX_FILE_EXTENSIONS]
+        output_file_paths.append(os.path.join(log_directory_path, f'sample{sample_id}',
+                                              Bowtie2IndexStep.BOWTIE2_INDEX_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix)))
+        return output_file_paths
+
     @staticmethod
     def main(cmd_args):
         """Entry point into class. Used when script is executed/submitted via
         the command line with the 'index' subcommand.
         """
         parameters = json.loads(cmd_args.bowtie2_parameters)
+        parameters['index_cache_directory_path'] = cmd_args.index_cache_directory_path
         bowtie2_index = Bowtie2IndexStep(log_directory_path=cmd_args.log_directory_path,
                                          data_directory_path=cmd_args.data_directory_path,
                                          parameters=parameters)
@@ -307,23 +390,37 @@ class Bowtie2IndexStep(AbstractCampareeStep):
 class Bowtie2AlignStep(AbstractCampareeStep):
     """Wrapper around aligning reads with Bowtie2
 
+    Bowtie2 reports alignments in the same order as the input reads (using its
+    --reorder option), and its SAM output is streamed straight into a compressed
+    BAM file, so no SAM intermediate is written. Since both parental
+    transcriptomes are aligned from the same FASTQ files, the alignments to
+    parent 1 and parent 2 list the reads in the same order and can be read in
+    lockstep by the AllelicImbalanceQuantificationStep.
+
+    A sample's reads may be paired (two FASTQ files), single-end (one FASTQ
+    file), or interleaved pairs (one FASTQ file, with the "interleaved_fastq"
+    parameter set). Gzipped FASTQ files are decompressed by a parallel
+    decompressor, when one is installed, and streamed to bowtie2 through named
+    pipes (see FastqStreamer).
+
     """
 
     BOWTIE2_ALIGN_FILENAME_PATTERN = CAMPAREE_CONSTANTS.BOWTIE2_ALIGN_FILENAME_PATTERN
     BOWTIE2_ALIGN_LOG_FILENAME_PATTERN = CAMPAREE_CONSTANTS.BOWTIE2_ALIGN_LOG_FILENAME_PATTERN
 
-    # TODO: Update this script to gracefully handle both one and two FASTQ files
-    #       for input (currently only works with two FASTQ files).
-
     #The basic Bowtie2 command used to generate indexes from a given FASTA.
+    #SAM output is written to stdout, where it is converted to BAM.
     BASE_BOWTIE2_ALIGN_COMMAND = ('{bowtie2_bin_dir}/bowtie2'
                                   ' --very-sensitive'
+                                  ' --reorder'
                                   ' --threads {num_bowtie2_threads}'
                                   ' {bowtie2_cmd_options}'
                                   ' -x {bowtie2_index_prefix}'
-                                  ' -1 {first_read_fastq}'
-                                  ' -2 {second_read_fastq}'
-                                  ' -S {output_sam_file}')
+                                  ' {read_arguments}')
+
+    # Bowtie2 options that change the number of alignments reported per read,
+    # which would break the one-pair-per-read order the alignments rely on.
+    INVALID_REPORTING_PARAMETERS = ["-k", "-a", "--all", "--no-unal"]
 
     def __init__(self, log_directory_path, data_directory_path, parameters=dict()):
         """Constructor for Bowtie2AlignStep object.
@@ -337,25 +434,34 @@ class Bowtie2AlignStep(AbstractCampareeStep):
         parameters : dict
             [Optional] Dictionary of Bowtie2 parameters specified by the config
             file (Note, the "num_bowtie_threads" entry in the config file maps
-            to the bowtie2 "--threads" command line parameter).
+            to the bowtie2 "--threads" command line parameter, and the
+            "interleaved_fastq" entry indicates that a sample with a single
+            FASTQ file holds interleaved read pairs rather than unpaired reads).
 
         """
         self.data_directory_path = data_directory_path
         self.log_directory_path = log_directory_path
         self.num_bowtie2_threads = parameters.pop('num_bowtie_threads', 1)
-        # Remaining parameters (if any) aside from  "num_bowtie_threads"
+        # A single FASTQ file holds either unpaired reads, or pairs of reads
+        # interleaved one after another.
+        self.interleaved_fastq = parameters.pop('interleaved_fastq', False)
+        # Remaining parameters (if any) aside from "num_bowtie_threads" and "interleaved_fastq"
         self.bowtie2_cmd_options = parameters
 
     def validate(self):
         """Check all given Bowtie2 parameters are correctly formed (i.e. start
         with single or double dash), and do not conflict with any that are
-        explicitly specified by this script (--very-sensitive, -x, -1, -2, -S),
-        or elsewhere in the config file (--threads).
+        explicitly specified by this script (--very-sensitive, --reorder, -x,
+        -1, -2, -U, -S), or elsewhere in the config file (--threads, and
+        --interleaved through interleaved_fastq). Options that
+        change the number of alignments reported per read (-k, -a, --no-unal)
+        are also rejected.
 
         """
         # These are parameters this script specifies directly. Most of these are
-        # for specifying the index, input fastq(s), and output SAM filename.
-        invalid_bowtie2_parameters = ["--very-sensitive", "-x", "-1", "-2", "-S", "--threads"]
+        # for specifying the index, input fastq(s), and output filename.
+        invalid_bowtie2_parameters = ["--very-sensitive", "--reorder", "-x", "-1", "-2", "-U",
+                                      "--interleaved", "-S", "--threads"]
         for key, value in self.bowtie2_cmd_options.items():
             if not key.startswith("-"):
                 print(f"Bowtie2 align parameter {key} with value {value} needs"
@@ -369,6 +475,13 @@ class Bowtie2AlignStep(AbstractCampareeStep):
                       f" hard-coded by this script, or explicitly specfied"
                       f" elsewhere in the config file.")
                 return False
+            if key in Bowtie2AlignStep.INVALID_REPORTING_PARAMETERS:
+                print(f"Bowtie2 align parameter {key} cannot be used since it"
+                      f" changes the number of alignments reported per read."
+                      f" Allelic imbalance quantification requires exactly"
+                      f" one alignment (or non-alignment) per read pair.",
+                      file=sys.stderr)
+                return False
 
         return True
 
@@ -396,9 +509,15 @@ class Bowtie2AlignStep(AbstractCampareeStep):
         log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
                                      Bowtie2AlignStep.BOWTIE2_ALIGN_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix))
 
-        fastq_file_1, fastq_file_2 = sample.fastq_file_paths
+        sample_data_directory_path = os.path.join(self.data_directory_path, f'sample{sample.sample_id}')
+        fastq_file_paths = list(sample.fastq_file_paths)
+        # Gzipped FASTQ files are decompressed by a parallel decompressor, if one
+        # is installed, and streamed to bowtie2 through named pipes. Otherwise
+        # bowtie2 reads them directly.
+        decompressor = FastqStreamer.find_parallel_decompressor()
 
-        with open(log_file_path, 'w') as log_file:
+        with open(log_file_path, 'w') as log_file, \
+             tempfile.TemporaryDirectory(dir=sample_data_directory_path) as fifo_directory_path:
 
             print(f"Running Bowtie2 alignment to transcriptome {genome_suffix} "
                   f"of sample{sample.sample_id}")
@@ -408,46 +527,161 @@ class Bowtie2AlignStep(AbstractCampareeStep):
             log_file.write(f"Parameters:\n"
                            f"    Bowtie2 binary directory: {bowtie2_bin_dir}\n"
                            f"    Bowtie2 index file prefix: {bowtie2_index_file_prefix}\n"
-                           f"    Bowtie2 output SAM file: {bowtie2_output_file_path}\n"
-                           f"    Read 1 FASTQ: {fastq_file_1}\n"
-                           f"    Read 2 FASTQ: {fastq_file_2}\n"
+                           f"    Bowtie2 output BAM file: {bowtie2_output_file_path}\n"
+                           f"    FASTQ files: {', '.join(fastq_file_paths)}\n"
+                           f"    FASTQ reads: {self.get_read_type(fastq_file_paths)}\n"
+                           f"    FASTQ decompressor: {decompressor or 'bowtie2'}\n"
                            f"    Number of Bowtie2 threads: {self.num_bowtie2_threads}\n")
 
-            bwt2_cmd_options = ' '.join( f"{key} {value}" for key,value in self.bowtie2_cmd_options.items() )
-
-            bowtie2_command = Bowtie2AlignStep.BASE_BOWTIE2_ALIGN_COMMAND.format(bowtie2_bin_dir=bowtie2_bin_dir,
-                                                                                 num_bowtie2_threads=self.num_bowtie2_threads,
-                                                                                 bowtie2_cmd_options=bwt2_cmd_options,
-                                                                                 bowtie2_index_prefix=bowtie2_index_file_prefix,
-                                                                                 first_read_fastq=fastq_file_1,
-                                                                                 second_read_fastq=fastq_file_2,
-                                                                                 output_sam_file=bowtie2_output_file_path)
+            bowtie2_finished = threading.Event()
+            bowtie2_input_paths = []
+            fastq_streamers = []
+            for read_number, fastq_file_path in enumerate(fastq_file_paths, start=1):
+                if decompressor and FastqStreamer.is_compressed(fastq_file_path):
+                    fifo_path = os.path.join(fifo_directory_path, f"read{read_number}.fastq")
+                    os.mkfifo(fifo_path)
+                    fastq_streamers.append(FastqStreamer(fastq_file_path,
+                                                         [(fifo_path, lambda: not bowtie2_finished.is_set())]))
+                    bowtie2_input_paths.append(fifo_path)
+                else:
+                    bowtie2_input_paths.append(fastq_file_path)
+
+            bowtie2_command = self.get_bowtie2_command(bowtie2_bin_dir, bowtie2_index_file_prefix,
+                                                       bowtie2_input_paths)
 
             print(f"Running Bowtie2 with command: {bowtie2_command}")
             print(f"For full Bowtie2 alignment output see {log_file_path}")
             log_file.write(f"Running Bowtie2 with command: {bowtie2_command}.\n\n")
             log_file.write("Bowtie2 alignment output follows:\n")
-
-            try:
-                bowtie2_result = subprocess.run(bowtie2_command, shell=True, check=True,
-                                                stdout=subprocess.PIPE,
-                                                stderr=subprocess.STDOUT, # Redirect stderr to stdout.
-                                                encoding="ascii")
-            except subprocess.CalledProcessError as bowtie2_align_exception:
-                log_file.write("\n*****ERROR: Bowtie2 alignment command failed:\n")
-                log_file.write(f"\tExit code: {bowtie2_align_exception.returncode}\n")
-                log_file.write("\n*****STDOUT:\n")
-                log_file.write(f"{bowtie2_align_exception.stdout}\n")
-                log_file.write("\n*****STDERR:\n")
-                log_file.write(f"{bowtie2_align_exception.stderr}\n")
+            # Bowtie2 writes its messages directly to the log file, so anything
+            # written above must be flushed first.
+            log_file.flush()
+
+            for fastq_streamer in fastq_streamers:
+                fastq_streamer.start()
+            num_alignments = Bowtie2AlignStep.write_bam_from_sam_stream(bowtie2_command, bowtie2_output_file_path,
+                                                                        stderr_file=log_file)
+            bowtie2_finished.set()
+            for fastq_streamer in fastq_streamers:
+                fastq_streamer.join()
+
+            if num_alignments is None:
+                log_file.write("\n*****ERROR: Bowtie2 alignment command failed.\n")
                 raise CampareeException(f"\nBowtie2 alignment process failed. "
                                         f"For full details see {log_file_path}\n")
+            for fastq_streamer in fastq_streamers:
+                if fastq_streamer.error is not None:
+                    log_file.write(f"\n*****ERROR: {fastq_streamer.error}\n")
+                    raise CampareeException(f"\nFailed to stream {fastq_streamer.fastq_file_path} to Bowtie2. "
+                                            f"For full details see {log_file_path}\n")
 
             print("Finished Bowtie2 alignment.\n")
-            log_file.write(f"{bowtie2_result.stdout}\n")
+            log_file.write(f"\nWrote {num_alignments} alignments to {bowtie2_output_file_path}\n")
             log_file.write("\nFinished Bowtie2 alignment.\n")
             log_file.write("ALL DONE!\n")
 
+    def get_read_type(self, fastq_file_paths):
+        """Determine how reads are arranged in a sample's FASTQ files.
+
+        Parameters
+        ----------
+        fastq_file_paths : list
+            Paths to the sample's FASTQ files.
+
+        Returns
+        -------
+        string
+            "paired" for two FASTQ files with the first and second read of each
+            pair, "interleaved" for a single FASTQ file of read pairs (if the
+            interleaved_fastq parameter is set), or "single" for a single FASTQ
+            file of unpaired reads.
+
+        """
+        if len(fastq_file_paths) == 2:
+            return "paired"
+        if len(fastq_file_paths) == 1:
+            return "interleaved" if self.interleaved_fastq else "single"
+        raise CampareeException(f"Bowtie2 alignment requires one or two FASTQ files, "
+                                f"not {len(fastq_file_paths)}.")
+
+    def get_bowtie2_command(self, bowtie2_bin_dir, bowtie2_index_prefix, fastq_file_paths):
+        """Prepare the bowtie2 command aligning a sample's FASTQ files to a
+        transcriptome index, writing SAM output to stdout.
+
+        Parameters
+        ----------
+        bowtie2_bin_dir : string
+            Path to the directory containing the bowtie2 exectuable.
+        bowtie2_index_prefix : string
+            Prefix of the Bowtie2 transcriptome index files.
+        fastq_file_paths : list
+            FASTQ files (or named pipes) of the sample's reads. See get_read_type()
+            for the supported arrangements of reads.
+
+        Returns
+        -------
+        string
+            Bowtie2 command line.
+
+        """
+        bwt2_cmd_options = ' '.join( f"{key} {value}" for key,value in self.bowtie2_cmd_options.items() )
+
+        read_type = self.get_read_type(fastq_file_paths)
+        if read_type == "paired":
+            read_arguments = f"-1 {fastq_file_paths[0]} -2 {fastq_file_paths[1]}"
+        elif read_type == "interleaved":
+            read_arguments = f"--interleaved {fastq_file_paths[0]}"
+        else:
+            read_arguments = f"-U {fastq_file_paths[0]}"
+
+        return Bowtie2AlignStep.BASE_BOWTIE2_ALIGN_COMMAND.format(bowtie2_bin_dir=bowtie2_bin_dir,
+                                                                  num_bowtie2_threads=self.num_bowtie2_threads,
+                                                                  bowtie2_cmd_options=bwt2_cmd_options,
+                                                                  bowtie2_index_prefix=bowtie2_index_prefix,
+                                                                  read_arguments=read_arguments)
+
+    @staticmethod
+    def write_bam_from_sam_stream(command, bam_file_path, stderr_file=None):
+        """Run a command that writes SAM to stdout, and stream its output into
+        a BAM file, keeping the records in the order they were written.
+
+        Parameters
+        ----------
+        command : string
+            Shell command writing SAM output (including the header) to stdout.
+        bam_file_path : string
+            Path of the BAM file to create.
+        stderr_file : file object
+            [Optional] File receiving the command's stderr. If omitted, stderr
+            is inherited from this process.
+
+        Returns
+        -------
+        int
+            Number of alignments written, or None if the command failed.
+
+        """
+        num_alignments = 0
+        with subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=stderr_file) as process:
+            try:
+                with pysam.AlignmentFile(process.stdout, "r") as sam_input:
+                    header = sam_input.header.to_dict()
+                    # Records are grouped by read, in the order of the input reads.
+                    header['HD'] = {'VN': header.get('HD', {}).get('VN', '1.0'), 'SO': 'unsorted', 'GO': 'query'}
+                    with pysam.AlignmentFile(bam_file_path, "wb", header=header) as bam_output:
+                        for alignment in sam_input:
+                            bam_output.write(alignment)
+                            num_alignments += 1
+            except (OSError, ValueError):
+                # The command produced no (or malformed) output. Its exit code,
+                # checked below, reports the failure.
+                process.kill()
+                process.wait()
+                return None
+        if process.returncode != 0:
+            return None
+        return num_alignments
+
     def get_commandline_call(self, sample, genome_suffix, bowtie2_bin_dir):
         """Prepare command to execute the Bowtie2AlignStep from the command line,
         given all of the arugments used to run the execute() function.
@@ -488,6 +722,8 @@ class Bowtie2AlignStep(AbstractCampareeStep):
                    f" --bowtie2_bin_dir {bowtie2_bin_dir}"
                    f" --num_bowtie2_threads {self.num_bowtie2_threads}"
                    f" --bowtie2_parameters '{json.dumps(self.bowtie2_cmd_options)}'")
+        if self.interleaved_fastq:
+            command += " --interleaved_fastq"
 
         return command
 
@@ -572,6 +808,37 @@ class Bowtie2AlignStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by Bowtie2AlignStep for a specific
+        job/execution, given a job's data directory, log directory, sample ID, and
+        genome suffix. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, corresponding sample_id, and
+            genome_suffix used when aligning reads with Bowtie2.
+
+        Returns
+        -------
+        list
+            Paths to the Bowtie2 alignment file and log file.
+
+        """
+
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_suffix = validation_attributes['genome_suffix']
+
+        return [os.path.join(data_directory_path, f'sample{sample_id}',
+                             Bowtie2AlignStep.BOWTIE2_ALIGN_FILENAME_PATTERN.format(genome_name=genome_suffix)),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             Bowtie2AlignStep.BOWTIE2_ALIGN_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix))]
+
     @staticmethod
     def main(cmd_args):
         """Entry point into class. Used when script is executed/submitted via
@@ -580,6 +847,7 @@ class Bowtie2AlignStep(AbstractCampareeStep):
         sample = eval(cmd_args.sample) # Requires Sample function from BEERS_UTILS.sample
         parameters = json.loads(cmd_args.bowtie2_parameters)
         parameters['num_bowtie_threads'] = cmd_args.num_bowtie2_threads
+        parameters['interleaved_fastq'] = cmd_args.interleaved_fastq
         bowtie2_align = Bowtie2AlignStep(log_directory_path=cmd_args.log_directory_path,
                                          data_directory_path=cmd_args.data_directory_path,
                                          parameters=parameters)
@@ -587,6 +855,179 @@ class Bowtie2AlignStep(AbstractCampareeStep):
                               genome_suffix=cmd_args.genome_suffix,
                               bowtie2_bin_dir=cmd_args.bowtie2_bin_dir)
 
+class FastqStreamer:
+    """Copies a FASTQ file to one or more named pipes, decompressing it on the
+    way if it is gzipped, so that other processes (e.g. bowtie2) read the
+    uncompressed reads from the pipes.
+
+    Gzipped files are decompressed with the fastest parallel decompressor found
+    on the PATH (igzip, then pigz), falling back to Python's gzip module. One
+    thread reads the file, passing each chunk to a separate writer thread for
+    each named pipe through a bounded queue. A process that reads its pipe more
+    slowly than the others therefore only holds them up once its queue is full,
+    rather than after every chunk, which keeps processes that read two pipes in
+    lockstep (e.g. bowtie2 reading the two mates of paired-end reads) from
+    deadlocking. The threads are started with start(). Once join() returns, the
+    first exception raised while copying is stored in the error attribute.
+
+    """
+
+    # Commands of the supported parallel decompressors, in order of preference,
+    # which write the decompressed contents of a file to stdout.
+    PARALLEL_DECOMPRESSOR_COMMANDS = {'igzip': ['-d', '-c'],
+                                      'pigz': ['-d', '-c']}
+    # Number of bytes of decompressed FASTQ copied to the named pipes at a time.
+    CHUNK_SIZE = 1024 * 1024
+    # Maximum number of chunks waiting to be written to each named pipe.
+    MAX_QUEUED_CHUNKS = 16
+    # Number of seconds between checks for a reader to open a named pipe.
+    FIFO_POLL_INTERVAL = 0.1
+
+    def __init__(self, fastq_file_path, outputs):
+        """Constructor for FastqStreamer object.
+
+        Parameters
+        ----------
+        fastq_file_path : string
+            FASTQ file, optionally gzip compressed.
+        outputs : list
+            (named pipe path, function) tuple for each named pipe to write. The
+            function returns False once the process reading the pipe has
+            stopped, so the FastqStreamer does not wait forever for a reader
+            that will never open the pipe.
+
+        """
+        self.fastq_file_path = fastq_file_path
+        self.outputs = outputs
+        self.error = None
+        # Set once copying fails, so the reader thread stops early.
+        self.stopped = threading.Event()
+        self.chunk_queues = [queue.Queue(maxsize=FastqStreamer.MAX_QUEUED_CHUNKS) for _ in outputs]
+        self.threads = [threading.Thread(target=self._read, daemon=True)]
+        for (fifo_path, is_reader_running), chunk_queue in zip(outputs, self.chunk_queues):
+            self.threads.append(threading.Thread(target=self._write, daemon=True,
+                                                 args=(fifo_path, is_reader_running, chunk_queue)))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    @staticmethod
+    def is_compressed(fastq_file_path):
+        return fastq_file_path.endswith('.gz')
+
+    @staticmethod
+    def find_parallel_decompressor():
+        """Return the name of the preferred parallel decompressor found on the
+        PATH, or None if none are installed.
+        """
+        for decompressor in FastqStreamer.PARALLEL_DECOMPRESSOR_COMMANDS:
+            if shutil.which(decompressor):
+                return decompressor
+        return None
+
+    def _stop(self, error):
+        """Record the first error raised while copying and stop the reader thread.
+        """
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def _read(self):
+        """Read the FASTQ file, passing each chunk to the queue of every named
+        pipe. A None in the queues marks the end of the chunks.
+        """
+        decompressor_process = None
+        try:
+            decompressor = FastqStreamer.find_parallel_decompressor()
+            if FastqStreamer.is_compressed(self.fastq_file_path) and decompressor:
+                decompressor_process = subprocess.Popen([decompressor,
+                                                         *FastqStreamer.PARALLEL_DECOMPRESSOR_COMMANDS[decompressor],
+                                                         self.fastq_file_path],
+                                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                fastq_file = decompressor_process.stdout
+            elif FastqStreamer.is_compressed(self.fastq_file_path):
+                fastq_file = gzip.open(self.fastq_file_path, 'rb')
+            else:
+                fastq_file = open(self.fastq_file_path, 'rb')
+
+            with fastq_file:
+                for chunk in iter(lambda: fastq_file.read(FastqStreamer.CHUNK_SIZE), b''):
+                    if self.stopped.is_set():
+                        break
+                    for chunk_queue in self.chunk_queues:
+                        chunk_queue.put(chunk)
+
+            if not self.stopped.is_set() and decompressor_process is not None and decompressor_process.wait() != 0:
+                raise CampareeException(f"{decompressor} failed to decompress {self.fastq_file_path}: "
+                                        f"{decompressor_process.stderr.read().decode().strip()}")
+        except Exception as error:
+            self._stop(error)
+        finally:
+            if decompressor_process is not None and decompressor_process.poll() is None:
+                decompressor_process.kill()
+                decompressor_process.wait()
+            for chunk_queue in self.chunk_queues:
+                chunk_queue.put(None)
+
+    def _write(self, fifo_path, is_reader_running, chunk_queue):
+        """Write the chunks from a queue to a named pipe, closing it when done.
+        """
+        output_file = None
+        try:
+            output_file = FastqStreamer.open_fifo(fifo_path, is_reader_running)
+            for chunk in iter(chunk_queue.get, None):
+                output_file.write(chunk)
+        except Exception as error:
+            self._stop(error)
+            # Keep emptying the queue, so the reader thread is not blocked
+            # waiting for room in it.
+            for _ in iter(chunk_queue.get, None):
+                pass
+        finally:
+            # Closing the pipe signals the end of the input to its reader.
+            if output_file is not None:
+                try:
+                    output_file.close()
+                except OSError:
+                    pass
+
+    @staticmethod
+    def open_fifo(fifo_path, is_reader_running):
+        """Open a named pipe for writing once a reader has opened it. Unlike a
+        blocking open, this does not wait forever if the reader stops first.
+
+        Parameters
+        ----------
+        fifo_path : string
+            Path to the named pipe.
+        is_reader_running : function
+            Returns False once the process that should read the pipe has stopped.
+
+        Returns
+        -------
+        file object
+            Named pipe opened for (blocking) binary writes.
+
+        """
+        while True:
+            try:
+                fifo_fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as error:
+                # ENXIO means the pipe has no reader yet.
+                if error.errno != errno.ENXIO:
+                    raise
+                if not is_reader_running():
+                    raise CampareeException(f"No process read from {fifo_path}.")
+                time.sleep(FastqStreamer.FIFO_POLL_INTERVAL)
+                continue
+            os.set_blocking(fifo_fd, True)
+            return os.fdopen(fifo_fd, 'wb')
+
 if __name__ == '__main__':
     """
     Prepare and process command line arguments. The setup below allows for entry
@@ -625,6 +1066,9 @@ if __name__ == '__main__':
     required_named_bowtie2_index_subparser.add_argument('--bowtie2_parameters', required=False,
                                                         help="Jsonified Bowtie2 index parameters (excluding "
                                                              "--threads).")
+    bowtie2_index_subparser.add_argument('--index_cache_directory_path', required=False, default=None,
+                                         help='Directory where Bowtie2 indexes are cached and shared '
+                                              'across samples and runs.')
 
     #Setup arguments from the alignment subcommand
     bowtie2_align_subparser = subparsers.add_parser('align', help="Run Bowtie2 alignment to transcriptome.",
@@ -648,6 +1092,9 @@ if __name__ == '__main__':
     required_named_bowtie2_align_subparser.add_argument('--bowtie2_parameters', required=False,
                                                         help="Jsonified Bowtie2 index parameters (excluding "
                                                              "--threads).")
+    bowtie2_align_subparser.add_argument('--interleaved_fastq', action='store_true',
+                                         help='A single FASTQ file holds interleaved read pairs, rather '
+                                              'than unpaired reads.')
 
     args = parser.parse_args()
     args.func(args)
@@ -0,0 +1,376 @@
+import os
+import sys
+import argparse
+import subprocess
+import tempfile
+import json
+
+import pysam
+
+from beers_utils.sample import Sample
+from camparee.abstract_camparee_step import AbstractCampareeStep
+from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeException
+from camparee.bowtie2 import Bowtie2IndexStep, Bowtie2AlignStep, FastqStreamer
+from camparee.allelic_imbalance_quant import AllelicImbalanceQuantificationStep
+
+class Bowtie2AllelicImbalanceStep(AbstractCampareeStep):
+    """Aligns a sample's reads to both parental transcriptomes and quantifies
+    allelic imbalance in a single job.
+
+    Separately, each of the two Bowtie2AlignStep jobs reads and decompresses the
+    sample's FASTQ files and writes a BAM file of alignments, which the
+    AllelicImbalanceQuantificationStep then reads back. This step decompresses
+    each gzipped FASTQ file once (see FastqStreamer), copying it through named
+    pipes to two concurrent bowtie2 processes (one per parental index, each
+    using the number of threads given to the Bowtie2AlignStep). The SAM output
+    of both processes is read by separate threads and matched up by the
+    AllelicImbalanceQuantificationStep, so no transcriptome alignment files are
+    written.
+
+    The allelic imbalance quantifications are identical to those of the
+    separate steps. The bowtie2 messages for each parent are written to the
+    Bowtie2AlignStep log files.
+
+    """
+
+    def __init__(self, log_directory_path, data_directory_path, parameters=None):
+        """Constructor for Bowtie2AllelicImbalanceStep object.
+
+        Parameters
+        ----------
+        log_directory_path : string
+            Full path to log directory.
+        data_directory_path : string
+            Full path to data directory.
+        parameters : dict
+            Dictionary of other parameters specified by the config file. This
+            parameter is not used by this class, since the parameters of the
+            Bowtie2AlignStep are passed to execute(). It is retained for
+            uniformity with all other CAMPAREE steps.
+
+        """
+        self.log_directory_path = log_directory_path
+        self.data_directory_path = data_directory_path
+
+    def validate(self):
+        return True
+
+    def execute(self, sample, bowtie2_bin_dir, genome_alignment_file_path, parent1_annot_file_path,
+                parent2_annot_file_path, bowtie2_parameters=None, multimapper_read_hashes_file_path=None):
+        """Align the sample's reads to both parental transcriptomes and quantify
+        allelic imbalance from the streamed alignments.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample containing paths for FASTQ files for alignment.
+        bowtie2_bin_dir : string
+            Path to the directory containing the bowtie2 exectuable.
+        genome_alignment_file_path : string
+            Input BAM file of reads aligned to the original reference genome,
+            used to identify multimappers.
+        parent1_annot_file_path : string
+            Input transcript annotation file for parent 1. This is generally
+            prepared by UpdateAnnotationForGenomeStep.
+        parent2_annot_file_path : string
+            Input transcript annotation file for parent 2. This is generally
+            prepared by UpdateAnnotationForGenomeStep.
+        bowtie2_parameters : dict
+            Config file parameters for the Bowtie2AlignStep, used for each of
+            the bowtie2 processes.
+        multimapper_read_hashes_file_path : string
+            [Optional] Numpy .npy file of the sorted hashes of the names of reads
+            with multiple genome alignments, generally prepared by BamScanStep.
+
+        """
+        sample_data_directory_path = os.path.join(self.data_directory_path, f'sample{sample.sample_id}')
+        log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
+                                     CAMPAREE_CONSTANTS.BOWTIE2_ALLELIC_IMBALANCE_LOG_FILENAME)
+        genome_suffixes = ['1', '2']
+
+        bowtie2_align = Bowtie2AlignStep(self.log_directory_path, self.data_directory_path,
+                                         dict(bowtie2_parameters or {}))
+        if not bowtie2_align.validate():
+            raise Bowtie2AllelicImbalanceException("Invalid Bowtie2AlignStep parameters.")
+        allelic_imbalance = AllelicImbalanceQuantificationStep(self.log_directory_path, self.data_directory_path)
+        allelic_imbalance.prepare_quantification(sample.sample_id, genome_alignment_file_path,
+                                                 parent1_annot_file_path, parent2_annot_file_path,
+                                                 multimapper_read_hashes_file_path)
+
+        with open(log_file_path, 'w') as log_file, \
+             tempfile.TemporaryDirectory(dir=sample_data_directory_path) as fifo_directory_path:
+
+            print(f"Aligning and quantifying allelic imbalance for reads from sample{sample.sample_id}.")
+            log_file.write(f"Aligning and quantifying allelic imbalance for reads from sample{sample.sample_id}.\n")
+            log_file.write(f"Parameters:\n"
+                           f"    Reference genome align path: {genome_alignment_file_path}\n"
+                           f"    Parent 1 annotation path:    {parent1_annot_file_path}\n"
+                           f"    Parent 2 annotation path:    {parent2_annot_file_path}\n"
+                           f"    FASTQ files:                 {', '.join(sample.fastq_file_paths)}\n"
+                           f"    FASTQ reads:                 {bowtie2_align.get_read_type(sample.fastq_file_paths)}\n"
+                           f"    FASTQ decompressor:          {FastqStreamer.find_parallel_decompressor() or 'python'}\n"
+                           f"    Number of Bowtie2 threads:   {bowtie2_align.num_bowtie2_threads} per parent\n")
+
+            # Each bowtie2 process reads each gzipped FASTQ file from its own
+            # named pipe. Uncompressed FASTQ files are read directly.
+            input_paths = {suffix: [] for suffix in genome_suffixes}
+            for read_number, fastq_file_path in enumerate(sample.fastq_file_paths, start=1):
+                for suffix in genome_suffixes:
+                    if FastqStreamer.is_compressed(fastq_file_path):
+                        fifo_path = os.path.join(fifo_directory_path, f"parent{suffix}_read{read_number}.fastq")
+                        os.mkfifo(fifo_path)
+                        input_paths[suffix].append(fifo_path)
+                    else:
+                        input_paths[suffix].append(fastq_file_path)
+
+            processes = {}
+            bowtie2_log_files = []
+            for suffix in genome_suffixes:
+                bowtie2_index_prefix = os.path.join(sample_data_directory_path,
+                                                    Bowtie2IndexStep.BOWTIE2_INDEX_DIR_PATTERN.format(genome_name=suffix),
+                                                    Bowtie2IndexStep.BOWTIE2_INDEX_PREFIX_PATTERN.format(genome_name=suffix))
+                bowtie2_command = bowtie2_align.get_bowtie2_command(bowtie2_bin_dir, bowtie2_index_prefix,
+                                                                    input_paths[suffix])
+                bowtie2_log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
+                                                     Bowtie2AlignStep.BOWTIE2_ALIGN_LOG_FILENAME_PATTERN.format(genome_name=suffix))
+                log_file.write(f"Running Bowtie2 for parent {suffix} with command: {bowtie2_command}\n"
+                               f"    Bowtie2 output logged to {bowtie2_log_file_path}\n")
+                bowtie2_log_files.append(open(bowtie2_log_file_path, 'w'))
+                processes[suffix] = subprocess.Popen(bowtie2_command, shell=True, stdout=subprocess.PIPE,
+                                                     stderr=bowtie2_log_files[-1])
+            log_file.flush()
+
+            # Decompress each FASTQ file once, copying it to both bowtie2 processes.
+            fastq_streamers = [FastqStreamer(fastq_file_path,
+                                             [(input_paths[suffix][index],
+                                               lambda process=processes[suffix]: process.poll() is None)
+                                              for suffix in genome_suffixes])
+                               for index, fastq_file_path in enumerate(sample.fastq_file_paths)
+                               if FastqStreamer.is_compressed(fastq_file_path)]
+            for fastq_streamer in fastq_streamers:
+                fastq_streamer.start()
+
+            try:
+                with pysam.AlignmentFile(processes['1'].stdout) as alignments_1, \
+                     pysam.AlignmentFile(processes['2'].stdout) as alignments_2:
+                    allelic_imbalance.quantify_alignments(alignments_1, alignments_2, log_file,
+                                                          read_in_background=True)
+            except Exception as error:
+                # A failed bowtie2 process ends its stream early, which shows up
+                # as malformed or mismatched alignments. Stop both processes so
+                # the job does not wait on them.
+                failed_suffixes = [suffix for suffix, process in processes.items()
+                                   if process.poll() not in (None, 0)]
+                for process in processes.values():
+                    process.kill()
+                if failed_suffixes:
+                    log_file.write("\n*****ERROR: Bowtie2 alignment failed.\n")
+                    raise Bowtie2AllelicImbalanceException(
+                        f"Bowtie2 alignment to parent {' and '.join(failed_suffixes)} failed. For full"
+                        f" details see the Bowtie2AlignStep logs for sample{sample.sample_id}.") from error
+                raise
+            finally:
+                for process in processes.values():
+                    process.wait()
+                for bowtie2_log_file in bowtie2_log_files:
+                    bowtie2_log_file.close()
+
+            failed_suffixes = [suffix for suffix, process in processes.items() if process.returncode != 0]
+            if failed_suffixes:
+                log_file.write("\n*****ERROR: Bowtie2 alignment failed.\n")
+                raise Bowtie2AllelicImbalanceException(
+                    f"Bowtie2 alignment to parent {' and '.join(failed_suffixes)} failed. For full"
+                    f" details see the Bowtie2AlignStep logs for sample{sample.sample_id}.")
+            # Both bowtie2 processes read their input to the end, so the FASTQ
+            # copies are complete.
+            for fastq_streamer in fastq_streamers:
+                fastq_streamer.join()
+                if fastq_streamer.error is not None:
+                    log_file.write(f"\n*****ERROR: {fastq_streamer.error}\n")
+                    raise Bowtie2AllelicImbalanceException(f"Failed to stream {fastq_streamer.fastq_file_path}"
+                                                           f" to Bowtie2.") from fastq_streamer.error
+
+            log_file.write("ALL DONE!\n")
+
+    def get_commandline_call(self, sample, bowtie2_bin_dir, genome_alignment_file_path,
+                             parent1_annot_file_path, parent2_annot_file_path,
+                             bowtie2_parameters=None, multimapper_read_hashes_file_path=None):
+        """Prepare command to execute the Bowtie2AllelicImbalanceStep from the
+        command line, given all of the arguments used to run the execute()
+        function.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample containing paths for FASTQ files for alignment.
+        bowtie2_bin_dir : string
+            Path to the directory containing the bowtie2 exectuable.
+        genome_alignment_file_path : string
+            Input BAM file of reads aligned to the original reference genome.
+        parent1_annot_file_path : string
+            Input transcript annotation file for parent 1.
+        parent2_annot_file_path : string
+            Input transcript annotation file for parent 2.
+        bowtie2_parameters : dict
+            Config file parameters for the Bowtie2AlignStep.
+        multimapper_read_hashes_file_path : string
+            [Optional] Numpy .npy file of the sorted hashes of the names of reads
+            with multiple genome alignments.
+
+        Returns
+        -------
+        string
+            Command to execute on the command line. It will perform the same
+            operations as a call to execute() with the same parameters.
+
+        """
+        #Retrieve path to the bowtie2_allelic_imbalance.py script.
+        step_path = os.path.realpath(__file__)
+        #If the above command returns a string with a "pyc" extension, instead
+        #of "py", strip off "c" so it points to this script.
+        step_path = step_path.rstrip('c')
+
+        command = (f" python {step_path}"
+                   f" --log_directory_path {self.log_directory_path}"
+                   f" --data_directory_path {self.data_directory_path}"
+                   f" --sample '{repr(sample)}'"
+                   f" --bowtie2_bin_dir {bowtie2_bin_dir}"
+                   f" --genome_alignment_path {genome_alignment_file_path}"
+                   f" --parent1_annot_path {parent1_annot_file_path}"
+                   f" --parent2_annot_path {parent2_annot_file_path}"
+                   f" --bowtie2_parameters '{json.dumps(bowtie2_parameters or {})}'")
+        if multimapper_read_hashes_file_path is not None:
+            command += f" --multimapper_read_hashes_path {multimapper_read_hashes_file_path}"
+
+        return command
+
+    def get_validation_attributes(self, sample, bowtie2_bin_dir, genome_alignment_file_path,
+                                  parent1_annot_file_path, parent2_annot_file_path,
+                                  bowtie2_parameters=None, multimapper_read_hashes_file_path=None):
+        """Prepare attributes required by is_output_valid() function to validate
+        output generated by the Bowtie2AllelicImbalanceStep job. Only the sample
+        is used. The other parameters are captured just so
+        get_validation_attributes() accepts the same arguments as
+        get_commandline_call().
+
+        Returns
+        -------
+        dict
+            A Bowtie2AllelicImbalanceStep job's data_directory, log_directory,
+            and corresponding sample ID.
+
+        """
+        validation_attributes = {}
+        validation_attributes['data_directory'] = self.data_directory_path
+        validation_attributes['log_directory'] = self.log_directory_path
+        validation_attributes['sample_id'] = sample.sample_id
+        return validation_attributes
+
+    @staticmethod
+    def main():
+        """
+        Entry point into script. Allows script to be executed/submitted via the
+        command line.
+        """
+
+        parser = argparse.ArgumentParser(description='Align reads to both parental transcriptomes'
+                                                     ' and quantify allelic imbalance')
+        parser.add_argument('-l', '--log_directory_path', required=True,
+                            help="Path to log directory.")
+        parser.add_argument('-d', '--data_directory_path', required=True,
+                            help='Path to data directory')
+        parser.add_argument('--sample', required=True,
+                            help='Sample containing the FASTQ files to align.')
+        parser.add_argument('--bowtie2_bin_dir', required=True,
+                            help='Full path to directory containing bowtie2 executable.')
+        parser.add_argument('--genome_alignment_path', required=True,
+                            help='BAM file of reads aligned to reference.')
+        parser.add_argument('--parent1_annot_path', required=True,
+                            help='Annotation file from genome for parent 1.')
+        parser.add_argument('--parent2_annot_path', required=True,
+                            help='Annotation file from genome for parent 2.')
+        parser.add_argument('--bowtie2_parameters', default='{}',
+                            help="Jsonified Bowtie2AlignStep parameters.")
+        parser.add_argument('--multimapper_read_hashes_path', default=None,
+                            help='[Optional] Numpy .npy file of hashes of multimapping read names.'
+                                 ' If omitted, multimappers are found from the genome alignment.')
+        args = parser.parse_args()
+
+        sample = eval(args.sample) # Requires Sample function from BEERS_UTILS.sample
+        step = Bowtie2AllelicImbalanceStep(args.log_directory_path, args.data_directory_path)
+        step.execute(sample=sample,
+                     bowtie2_bin_dir=args.bowtie2_bin_dir,
+                     genome_alignment_file_path=args.genome_alignment_path,
+                     parent1_annot_file_path=args.parent1_annot_path,
+                     parent2_annot_file_path=args.parent2_annot_path,
+                     bowtie2_parameters=json.loads(args.bowtie2_parameters),
+                     multimapper_read_hashes_file_path=args.multimapper_read_hashes_path)
+
+    @staticmethod
+    def is_output_valid(validation_attributes):
+        """
+        Check if output of Bowtie2AllelicImbalanceStep for a specific job/execution
+        is correctly formed and valid, given a job's data directory, log directory,
+        and sample id. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, and corresponding sample_id.
+
+        Returns
+        -------
+        boolean
+            True  - The allelic imbalance quantifications and log file were
+                    created and are well formed.
+            False - The output files do not exist or are missing data.
+
+        """
+        output_file_paths = Bowtie2AllelicImbalanceStep.get_output_file_paths(validation_attributes)
+        if not all(os.path.isfile(output_file_path) for output_file_path in output_file_paths):
+            return False
+
+        #Read last line in log file
+        line = ""
+        with open(output_file_paths[-1], "r") as log_file:
+            for line in log_file:
+                line = line.rstrip()
+        return line == "ALL DONE!"
+
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by Bowtie2AllelicImbalanceStep for a
+        specific job/execution, given a job's data directory, log directory, and
+        sample id. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, and corresponding sample_id.
+
+        Returns
+        -------
+        list
+            Paths to the allelic imbalance distribution file and log file.
+
+        """
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+
+        return [os.path.join(data_directory_path, f'sample{sample_id}',
+                             CAMPAREE_CONSTANTS.ALLELIC_IMBALANCE_OUTPUT_FILENAME),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             CAMPAREE_CONSTANTS.BOWTIE2_ALLELIC_IMBALANCE_LOG_FILENAME)]
+
+
+class Bowtie2AllelicImbalanceException(CampareeException):
+    pass
+
+
+if __name__ == "__main__":
+    sys.exit(Bowtie2AllelicImbalanceStep.main())
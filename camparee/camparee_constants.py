@@ -8,9 +8,12 @@ CampareeConstants = namedtuple('Constants',
                                 'DEFAULT_STAR_BAM_FILENAME',
                                 'INTRON_OUTPUT_FILENAME',
                                 'INTRON_OUTPUT_ANTISENSE_FILENAME',
+                                'INTRON_OUTPUT_NPZ_FILENAME',
                                 'INTERGENIC_OUTPUT_FILENAME',
                                 'VARIANTS_FINDER_OUTPUT_FILENAME',
                                 'VARIANTS_FINDER_LOG_FILENAME',
+                                'BAM_SCAN_LOG_FILENAME',
+                                'MULTIMAPPER_READ_HASHES_FILENAME',
                                 'VARIANTS_COMPILATION_OUTPUT_FILENAME',
                                 'VARIANTS_COMPILATION_LOG_FILENAME',
                                 'BEAGLE_OUTPUT_PREFIX',
@@ -20,6 +23,7 @@ CampareeConstants = namedtuple('Constants',
                                 'GENOMEBUILDER_INDEL_FILENAME_PATTERN',
                                 'GENOMEBUILDER_LOG_FILENAME',
                                 'UPDATEANNOT_OUTPUT_FILENAME_PATTERN',
+                                'UPDATEANNOT_TABLE_FILENAME_PATTERN',
                                 'UPDATEANNOT_LOG_FILENAME_PATTERN',
                                 'TRANSCRIPTOME_FASTA_OUTPUT_FILENAME_PATTERN',
                                 'TRANSCRIPTOME_FASTA_LOG_FILENAME_PATTERN',
@@ -40,6 +44,7 @@ CampareeConstants = namedtuple('Constants',
                                 'BOWTIE2_ALIGN_LOG_FILENAME_PATTERN',
                                 'ALLELIC_IMBALANCE_OUTPUT_FILENAME',
                                 'ALLELIC_IMBALANCE_LOG_FILENAME',
+                                'BOWTIE2_ALLELIC_IMBALANCE_LOG_FILENAME',
                                 'MOLECULE_MAKER_OUTPUT_OPTIONS_W_EXTENSIONS',
                                 'MOLECULE_MAKER_OUTPUT_FILENAME_PATTERN',
                                 'MOLECULE_MAKER_DEFAULT_NUM_MOLECULES_PER_PACKET',
@@ -70,11 +75,19 @@ CAMPAREE_CONSTANTS = \
                       DEFAULT_STAR_BAM_FILENAME=_DEFAULT_STAR_OUTPUT_PREFIX + "Aligned.sortedByCoord.out.bam",
                       INTRON_OUTPUT_FILENAME="intron_quantifications.txt",
                       INTRON_OUTPUT_ANTISENSE_FILENAME="intron_antisense_quantifications.txt",
+                      # Binary (numpy .npz) copy of the intron quantifications, loaded by MoleculeMakerStep.
+                      INTRON_OUTPUT_NPZ_FILENAME="intron_quantifications.npz",
                       INTERGENIC_OUTPUT_FILENAME="intergenic_quantifications.txt",
                       # Name of file where VariantsFinderStep output is stored.
                       VARIANTS_FINDER_OUTPUT_FILENAME="variants.txt",
                       # Name of file where VariantsFinderStep logging is stored.
                       VARIANTS_FINDER_LOG_FILENAME="VariantsFinderStep.log",
+                      # Name of file where BamScanStep logging is stored.
+                      BAM_SCAN_LOG_FILENAME="BamScanStep.log",
+                      # Name of file storing the sorted 64-bit hashes (numpy .npy) of the names of reads
+                      # with multiple genome alignments, generated by BamScanStep and used by
+                      # AllelicImbalanceQuantificationStep.
+                      MULTIMAPPER_READ_HASHES_FILENAME="multimapper_read_hashes.npy",
                       # Name of file where VariantsCompilationStep output is stored.
                       VARIANTS_COMPILATION_OUTPUT_FILENAME="all_variants.vcf",
                       # Name of file where VariantsCompilationStep logging is stored.
@@ -94,6 +107,9 @@ CAMPAREE_CONSTANTS = \
                       GENOMEBUILDER_LOG_FILENAME="GenomeBuilderStep.log",
                       # Name of updated annotation file generated by UpdateAnnotationForGenomeStep
                       UPDATEANNOT_OUTPUT_FILENAME_PATTERN='updated_annotation_{genome_name}.txt',
+                      # Name of transcript/gene table generated by UpdateAnnotationForGenomeStep
+                      # (see TranscriptGeneTable.get_file_path()).
+                      UPDATEANNOT_TABLE_FILENAME_PATTERN='updated_annotation_{genome_name}.npz',
                       # Name of file where UpdateAnnotationForGenomeStep logging is stored
                       UPDATEANNOT_LOG_FILENAME_PATTERN='UpdateAnnotationForGenomeStep_{genome_name}.log',
                       # Name of transcriptome FASTA file generated by TranscriptomeFastaPreparationStep
@@ -127,13 +143,15 @@ CAMPAREE_CONSTANTS = \
                       # Name of file where Bowtie2IndexStep logging is stored
                       BOWTIE2_INDEX_LOG_FILENAME_PATTERN='Bowtie2IndexStep_{genome_name}.log',
                       # Name of file where Bowtie2 alignment results are stored
-                      BOWTIE2_ALIGN_FILENAME_PATTERN='Bowtie2_transcriptome_alignment_{genome_name}.sam',
+                      BOWTIE2_ALIGN_FILENAME_PATTERN='Bowtie2_transcriptome_alignment_{genome_name}.bam',
                       # Name of file where Bowtie2AlignStep logging is stored
                       BOWTIE2_ALIGN_LOG_FILENAME_PATTERN='Bowtie2AlignStep_{genome_name}.log',
                       # Name of file where allelic imbalance distribution stored
                       ALLELIC_IMBALANCE_OUTPUT_FILENAME="allelic_imbalance_quantifications.txt",
                       # Name of file where AllelicImbalanceQuantificationStep logging is stored
                       ALLELIC_IMBALANCE_LOG_FILENAME="AllelicImbalanceQuantificationStep.log",
+                      # Name of file where Bowtie2AllelicImbalanceStep logging is stored
+                      BOWTIE2_ALLELIC_IMBALANCE_LOG_FILENAME="Bowtie2AllelicImbalanceStep.log",
                       # Dictionary mapping the options for molecule output type, to the
                       # extension of the output file. Note: the keys are used to validate
                       # the output type entered in the config file.
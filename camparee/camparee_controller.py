@@ -12,6 +12,7 @@ from camparee.camparee_constants import CAMPAREE_CONSTANTS,CAMPAREE_VERSION
 from beers_utils.constants import CONSTANTS,SUPPORTED_SCHEDULER_MODES
 from beers_utils.general_utils import GeneralUtils
 from camparee.expression_pipeline import ExpressionPipeline,CampareeValidationException
+from camparee.local_job_monitor import LocalJobMonitor
 from beers_utils.sample import Sample
 
 
@@ -61,9 +62,10 @@ class CampareeController:
             scheduler_mode = self.configuration['setup']['scheduler_mode']
         else:
             scheduler_mode = args.scheduler_mode
-        if scheduler_mode not in SUPPORTED_SCHEDULER_MODES:
+        supported_scheduler_modes = SUPPORTED_SCHEDULER_MODES + [LocalJobMonitor.SCHEDULER_NAME]
+        if scheduler_mode not in supported_scheduler_modes:
             raise CampareeValidationException(f'{scheduler_mode} is not a supported mode.\n'
-                                              f'Please select one of {",".join(SUPPORTED_SCHEDULER_MODES)}.\n')
+                                              f'Please select one of {",".join(supported_scheduler_modes)}.\n')
         self.assemble_input_samples()
         ExpressionPipeline.main(self.configuration, scheduler_mode,
                                 os.path.join(self.output_directory_path,stage_name),
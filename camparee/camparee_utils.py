@@ -1,7 +1,11 @@
 import re
 import os
 import gzip
+import fcntl
+import shutil
+import hashlib
 import itertools
+import numpy
 import pandas as pd
 
 class CampareeUtils:
@@ -9,6 +13,10 @@ class CampareeUtils:
     Utilities for steps in the CAMPAREE expression pipeline.
     """
 
+    # ioctl request that makes a file share the data blocks of another file (a
+    # reflink), on Linux file systems that support it (e.g. Btrfs, XFS).
+    FICLONE = 0x40049409
+
     # Line format definition for annotation file
     annot_output_format = '{chrom}\t{strand}\t{txStart}\t{txEnd}\t{exonCount}\t{exonStarts}\t{exonEnds}\t{transcriptID}\t{geneID}\t{geneSymbol}\t{biotype}\n'
 
@@ -333,6 +341,107 @@ class CampareeUtils:
 
         return chromosomes
 
+    @staticmethod
+    def compute_file_digest(filename, chunk_size=1024 * 1024):
+        """Helper method to compute the SHA-256 digest of a file's contents. The
+        file is read in fixed size chunks, so large files are never loaded into
+        memory in their entirety.
+
+        Parameters
+        ----------
+        filename : string
+            Path to the file to digest. The file is read in binary mode, as is,
+            so gzipped files are digested by their compressed contents.
+        chunk_size : int
+            Number of bytes to read from the file at a time. [DEFAULT: 1MB]
+
+        Returns
+        -------
+        string
+            Hexadecimal SHA-256 digest of the file's contents.
+
+        """
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as file_to_digest:
+            for chunk in iter(lambda: file_to_digest.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def copy_file(source_path, destination_path):
+        """Helper method to copy a file, as a reflink where the file system
+        supports it, so even large files are copied almost instantly. Unlike a
+        hard link, the copy is a separate file, so writing to one of the files
+        never changes the other.
+
+        Parameters
+        ----------
+        source_path : string
+            Path to the file to copy.
+        destination_path : string
+            Path to the copy. Overwritten if it already exists.
+
+        """
+        with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+            try:
+                fcntl.ioctl(destination_file.fileno(), CampareeUtils.FICLONE, source_file.fileno())
+                return
+            except OSError:
+                # Reflinks are not supported, or the files are on different
+                # file systems.
+                pass
+        shutil.copyfile(source_path, destination_path)
+
+    @staticmethod
+    def hash_read_names(read_names):
+        """Helper method to compute a 64-bit hash of each read name. Unlike the
+        built-in hash() function, these hashes are the same in every process, so
+        they can be saved by one step and compared against by another.
+
+        Parameters
+        ----------
+        read_names : iterable
+            Read names (query names) to hash.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of uint64 hashes, in the same order as the read names.
+
+        """
+        return numpy.fromiter((int.from_bytes(hashlib.blake2b(read_name.encode(), digest_size=8).digest(), 'little')
+                               for read_name in read_names),
+                              dtype=numpy.uint64)
+
+    @staticmethod
+    def find_hashed_read_names(read_names, sorted_read_name_hashes):
+        """Helper method to test which read names are in a set of read names
+        stored as the sorted array of their hashes (see hash_read_names()).
+
+        Since only hashes are compared, a read name may be reported as present
+        when its hash collides with one in the set. With 64-bit hashes this is
+        expected for roughly one read in 10^19 / (size of set).
+
+        Parameters
+        ----------
+        read_names : list
+            Read names to test.
+        sorted_read_name_hashes : numpy.ndarray
+            Sorted array of uint64 read name hashes.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array, True for each read name whose hash is in the set.
+
+        """
+        read_name_hashes = CampareeUtils.hash_read_names(read_names)
+        if len(sorted_read_name_hashes) == 0:
+            return numpy.zeros(len(read_name_hashes), dtype=bool)
+        indices = numpy.searchsorted(sorted_read_name_hashes, read_name_hashes)
+        indices[indices == len(sorted_read_name_hashes)] = 0
+        return sorted_read_name_hashes[indices] == read_name_hashes
+
     @staticmethod
     def open_file(filename, mode='r'):
         """Helper method which can open gzipped files by checking the filename
@@ -3,12 +3,15 @@ import os
 import importlib
 import shutil
 import inspect
+import copy
 import numpy
 
 from beers_utils.constants import CONSTANTS,MAX_SEED
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
 from beers_utils.job_monitor import JobMonitor
 from camparee.camparee_utils import CampareeUtils, CampareeException
+from camparee.step_cache import StepCache
+from camparee.local_job_monitor import LocalJobMonitor
 
 class ExpressionPipeline:
     """
@@ -44,6 +47,16 @@ class ExpressionPipeline:
         # Individual steps can provide scheduler parameters that override
         # the default values.
         self.__step_scheduler_param_overrides = {}
+        # Config file parameters for each step, used as part of the step cache
+        # key. Copied before the steps are instantiated, since some steps modify
+        # the parameters they are given.
+        self.__step_parameters = {}
+        # Cache keys of all jobs submitted (or restored from the step cache),
+        # the IDs of jobs restored from the cache, and the jobs whose output
+        # should be stored in the cache once they complete.
+        self.__job_cache_keys = {}
+        self.__cached_job_ids = set()
+        self.__jobs_to_cache = {}
 
         # Validate the resources and set file and directory paths as needed.
         if not self.validate_and_set_resources(configuration['resources']):
@@ -98,11 +111,33 @@ class ExpressionPipeline:
                                               "Consult the standard error file for details.")
         print(f"And a maximum job resubmission limit of {self.max_resub_limit}.")
 
-        self.expression_pipeline_monitor = JobMonitor(output_directory_path=self.output_directory_path,
-                                                      scheduler_name=self.scheduler_mode,
-                                                      default_num_processors=self.scheduler_default_params['default_num_processors'],
-                                                      default_memory_in_mb=self.scheduler_default_params['default_memory_in_mb'],
-                                                      max_resub_limit=self.max_resub_limit)
+        # Set up the step cache (if requested)
+        self.step_cache = None
+        step_cache_directory_path = configuration['setup'].get('step_cache_directory_path')
+        if step_cache_directory_path:
+            self.step_cache = StepCache(cache_directory_path=step_cache_directory_path,
+                                        output_directory_path=self.output_directory_path)
+            print(f"Using step cache in {step_cache_directory_path}.", file=sys.stderr)
+
+        if self.scheduler_mode == LocalJobMonitor.SCHEDULER_NAME:
+            # Local mode runs jobs concurrently on this machine, rather than
+            # submitting them to a job scheduler.
+            local_scheduler_params = configuration['setup'].get('local_scheduler_parameters') or {}
+            self.expression_pipeline_monitor = LocalJobMonitor(output_directory_path=self.output_directory_path,
+                                                               max_processors=local_scheduler_params.get('max_processors', None),
+                                                               max_memory_in_mb=local_scheduler_params.get('max_memory_in_mb', None),
+                                                               default_num_processors=self.scheduler_default_params['default_num_processors'],
+                                                               default_memory_in_mb=self.scheduler_default_params['default_memory_in_mb'],
+                                                               max_resub_limit=self.max_resub_limit,
+                                                               job_completed_callback=self.store_completed_job_in_step_cache)
+            print(f"Running local jobs on up to {self.expression_pipeline_monitor.max_processors} processors.",
+                  file=sys.stderr)
+        else:
+            self.expression_pipeline_monitor = JobMonitor(output_directory_path=self.output_directory_path,
+                                                          scheduler_name=self.scheduler_mode,
+                                                          default_num_processors=self.scheduler_default_params['default_num_processors'],
+                                                          default_memory_in_mb=self.scheduler_default_params['default_memory_in_mb'],
+                                                          max_resub_limit=self.max_resub_limit)
 
         # Load instances of each pipeline step into the dictionary of pipeline
         # steps tracked by the job monitor.
@@ -112,6 +147,7 @@ class ExpressionPipeline:
             scheduler_parameters = props["scheduler_parameters"] if props and "scheduler_parameters" in props else None
             module = importlib.import_module(f'.{module_name}', package="camparee")
             step_class = getattr(module, step_name)
+            self.__step_parameters[step_name] = copy.deepcopy(parameters)
             self.steps[step_name] = step_class(log_directory_path, data_directory_path, parameters)
             self.__step_paths[step_name] = inspect.getfile(module)
             self.__step_scheduler_param_overrides[step_name] = scheduler_parameters
@@ -129,6 +165,7 @@ class ExpressionPipeline:
         scheduler_parameters = configuration["output"]["scheduler_parameters"] if "scheduler_parameters" in configuration["output"] else None
         module = importlib.import_module(f'.{module_name}', package="camparee")
         step_class = getattr(module, step_name)
+        self.__step_parameters[step_name] = copy.deepcopy(parameters)
         self.steps[step_name] = step_class(log_directory_path, data_directory_path, parameters)
         self.__step_paths[step_name] = inspect.getfile(module)
         self.__step_scheduler_param_overrides[step_name] = scheduler_parameters
@@ -431,23 +468,45 @@ class ExpressionPipeline:
                           cmd_line_args=[sample, bam_filename],
                           dependency_list=[f"GenomeAlignmentStep_{sample.sample_id}"])
 
+        # If the BamScanStep is configured, it replaces the VariantsFinderStep,
+        # IntronQuantificationStep, and the AllelicImbalanceQuantificationStep's
+        # search for multimappers with a single pass over each BAM file.
+        fused_bam_scan = 'BamScanStep' in self.steps
+        # Jobs generating the variants and intron quantifications of each sample
+        variants_job_ids = {}
+        intron_quant_job_ids = {}
         for sample in self.samples:
             bam_filename = bam_files[sample.sample_id]
             seed = seeds[f"VariantsFinderStep_{sample.sample_id}"]
+            quantify_introns = self.sample_optional_inputs[sample.sample_id]['intron_quant'] is None
+            if fused_bam_scan:
+                intron_quant_parameters = self.__step_parameters['IntronQuantificationStep'] \
+                                          if quantify_introns else None
+                self.run_step(step_name='BamScanStep',
+                              sample=sample,
+                              cmd_line_args=[sample, bam_filename, self.chr_ploidy_file_path,
+                                             self.reference_genome_file_path, self.annotation_file_path,
+                                             seed, self.__step_parameters['VariantsFinderStep'],
+                                             intron_quant_parameters],
+                              dependency_list=[f"GenomeBamIndexStep_{sample.sample_id}"])
+                variants_job_ids[sample.sample_id] = f"BamScanStep_{sample.sample_id}"
+                intron_quant_job_ids[sample.sample_id] = f"BamScanStep_{sample.sample_id}"
+                continue
+
             self.run_step(step_name='VariantsFinderStep',
                           sample=sample,
                           cmd_line_args=[sample, bam_filename, self.chr_ploidy_file_path,
                                          self.reference_genome_file_path, seed],
                           dependency_list=[f"GenomeBamIndexStep_{sample.sample_id}"])
+            variants_job_ids[sample.sample_id] = f"VariantsFinderStep_{sample.sample_id}"
 
-        for sample in self.samples:
-            if self.sample_optional_inputs[sample.sample_id]['intron_quant'] is None:
+            if quantify_introns:
                 output_directory = os.path.join(self.data_directory_path, f"sample{sample.sample_id}")
-                bam_filename = bam_files[sample.sample_id]
                 self.run_step(step_name='IntronQuantificationStep',
                               sample=sample,
                               cmd_line_args=[bam_filename, output_directory, self.annotation_file_path],
                               dependency_list=[f"GenomeBamIndexStep_{sample.sample_id}"])
+                intron_quant_job_ids[sample.sample_id] = f"IntronQuantificationStep_{sample.sample_id}"
             #TODO: do we need to depend upon the index being done? or just the alignment?
             #      I'm hypothesizing that some failures are being caused by indexing and quantification happening
             #      on the same BAM file at the same time, though I don't know why this would be a problem.
@@ -466,40 +525,44 @@ class ExpressionPipeline:
                                      self.reference_genome_file_path,
                                      phased_output,
                                      seed],
-                      dependency_list=[f"VariantsFinderStep_{sample.sample_id}" for sample in self.samples])
+                      dependency_list=[variants_job_ids[sample.sample_id] for sample in self.samples])
 
         phased_vcf_file = self.optional_inputs['phased_vcf_file']
+        # Jobs the GenomeBuilderStep must wait on before reading the phased VCF.
+        # None if the user provided the phased VCF file.
+        phased_vcf_dep_list = None
         # If user did not provide phased vcf file
         if phased_vcf_file is None:
             # Can't phase variants with only one sample
             if len(self.samples) == 1:
                 phased_vcf_file = os.path.join(self.data_directory_path,
                                                CAMPAREE_CONSTANTS.VARIANTS_COMPILATION_OUTPUT_FILENAME)
+                phased_vcf_dep_list = ["VariantsCompilationStep"]
             else:
                 seed = seeds["BeagleStep"]
                 self.run_step(step_name='BeagleStep',
                               sample=None,
                               cmd_line_args=[self.beagle_file_path, seed],
                               dependency_list=["VariantsCompilationStep"])
-
-        #TODO: We could load all of the steps in the entire pipeline into the queue
-        #      and then just have the queue keep running until everything finishes.
-        #      The only advantage of explicitly waiting here is that the user gets
-        #      stdout indicating which stage is running for the pipeline.
-        self.expression_pipeline_monitor.monitor_until_all_jobs_completed(queue_update_interval=10)
-
-        for sample in self.samples:
-            print(f"Processing sample{sample.sample_id} ({sample.sample_name})...")
-            dep_list = None
-            if phased_vcf_file is None:
                 phased_vcf_file = os.path.join(self.data_directory_path,
                                                CAMPAREE_CONSTANTS.BEAGLE_OUTPUT_FILENAME)
-                dep_list = ["BeagleStep"]
+                phased_vcf_dep_list = ["BeagleStep"]
+
+        # All remaining steps are submitted immediately, as part of the same
+        # dependency graph, rather than waiting for the steps above to finish.
+        # This way, each sample's steps start as soon as that sample's own
+        # dependencies complete.
+        # If the Bowtie2AllelicImbalanceStep is configured, it replaces the
+        # Bowtie2AlignStep for each parent and the AllelicImbalanceQuantificationStep
+        # with a single job that streams the alignments into the quantification.
+        combined_bowtie2_alignment = 'Bowtie2AllelicImbalanceStep' in self.steps
+        for sample in self.samples:
+            print(f"Submitting jobs for sample{sample.sample_id} ({sample.sample_name})...")
             self.run_step(step_name='GenomeBuilderStep',
                           sample=sample,
                           cmd_line_args=[sample, phased_vcf_file, self.chr_ploidy_file_path,
                                          self.reference_genome_file_path],
-                          dependency_list=dep_list)
+                          dependency_list=phased_vcf_dep_list)
 
             for suffix in [1, 2]:
                 self.run_step(step_name='UpdateAnnotationForGenomeStep',
@@ -549,11 +612,12 @@ class ExpressionPipeline:
                                   dependency_list=[f"TranscriptomeFastaPreparationStep_{sample.sample_id}-{suffix}"],
                                   jobname_suffix=suffix)
 
-                    self.run_step(step_name='Bowtie2AlignStep',
-                                  sample=sample,
-                                  cmd_line_args=[sample, suffix, self.bowtie2_dir_path],
-                                  dependency_list=[f"Bowtie2IndexStep_{sample.sample_id}-{suffix}"],
-                                  jobname_suffix=suffix)
+                    if not combined_bowtie2_alignment:
+                        self.run_step(step_name='Bowtie2AlignStep',
+                                      sample=sample,
+                                      cmd_line_args=[sample, suffix, self.bowtie2_dir_path],
+                                      dependency_list=[f"Bowtie2IndexStep_{sample.sample_id}-{suffix}"],
+                                      jobname_suffix=suffix)
 
             # Necessary for both gene and PSI quantification. Do not skip if
             # user provides optional input for only one of these distributions.
@@ -578,16 +642,33 @@ class ExpressionPipeline:
                                                    CAMPAREE_CONSTANTS.UPDATEANNOT_OUTPUT_FILENAME_PATTERN.format(genome_name='1'))
                 update_annot_path_2 = os.path.join(self.data_directory_path, f"sample{sample.sample_id}",
                                                    CAMPAREE_CONSTANTS.UPDATEANNOT_OUTPUT_FILENAME_PATTERN.format(genome_name='2'))
-                tx_align_path_1 = os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
-                                               CAMPAREE_CONSTANTS.BOWTIE2_ALIGN_FILENAME_PATTERN.format(genome_name='1'))
-                tx_align_path_2 = os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
-                                               CAMPAREE_CONSTANTS.BOWTIE2_ALIGN_FILENAME_PATTERN.format(genome_name='2'))
-                self.run_step(step_name='AllelicImbalanceQuantificationStep',
+                if combined_bowtie2_alignment:
+                    allelic_imbalance_step = 'Bowtie2AllelicImbalanceStep'
+                    allelic_imbalance_args = [sample, self.bowtie2_dir_path, genome_alignment_path,
+                                              update_annot_path_1, update_annot_path_2,
+                                              self.__step_parameters['Bowtie2AlignStep']]
+                    allelic_imbalance_dep_list = [f"GenomeAlignmentStep_{sample.sample_id}",
+                                                  f"Bowtie2IndexStep_{sample.sample_id}-1",
+                                                  f"Bowtie2IndexStep_{sample.sample_id}-2"]
+                else:
+                    allelic_imbalance_step = 'AllelicImbalanceQuantificationStep'
+                    tx_align_path_1 = os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
+                                                   CAMPAREE_CONSTANTS.BOWTIE2_ALIGN_FILENAME_PATTERN.format(genome_name='1'))
+                    tx_align_path_2 = os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
+                                                   CAMPAREE_CONSTANTS.BOWTIE2_ALIGN_FILENAME_PATTERN.format(genome_name='2'))
+                    allelic_imbalance_args = [sample.sample_id, genome_alignment_path, update_annot_path_1,
+                                              update_annot_path_2, tx_align_path_1, tx_align_path_2]
+                    allelic_imbalance_dep_list = [f"GenomeAlignmentStep_{sample.sample_id}",
+                                                  f"Bowtie2AlignStep_{sample.sample_id}-1",
+                                                  f"Bowtie2AlignStep_{sample.sample_id}-2"]
+                if fused_bam_scan:
+                    allelic_imbalance_args.append(os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
+                                                               CAMPAREE_CONSTANTS.MULTIMAPPER_READ_HASHES_FILENAME))
+                    allelic_imbalance_dep_list.append(f"BamScanStep_{sample.sample_id}")
+                self.run_step(step_name=allelic_imbalance_step,
                               sample=sample,
-                              cmd_line_args=[sample.sample_id, genome_alignment_path, update_annot_path_1,
-                                             update_annot_path_2, tx_align_path_1, tx_align_path_2],
-                              dependency_list=[f"Bowtie2AlignStep_{sample.sample_id}-1",
-                                               f"Bowtie2AlignStep_{sample.sample_id}-2"])
+                              cmd_line_args=allelic_imbalance_args,
+                              dependency_list=allelic_imbalance_dep_list)
 
             seed = seeds[f"MoleculeMakerStep_{sample.sample_id}"]
             num_molecules_to_generate = sample.molecule_count
@@ -613,9 +694,10 @@ class ExpressionPipeline:
                         f"TranscriptomeFastaPreparationStep_{sample.sample_id}-2"]
 
             intron_quant_path = os.path.join(sample_data_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME)
-            if user_intron_quant_path is not None:
+            if user_intron_quant_path is None:
+                dep_list.append(intron_quant_job_ids[sample.sample_id])
+            else:
                 shutil.copy(user_intron_quant_path, intron_quant_path)
-                # TODO: if user_intron_quant_path is None, don't we need to add a dependency?
 
             gene_quant_path = os.path.join(sample_data_directory, CAMPAREE_CONSTANTS.TXQUANT_OUTPUT_GENE_FILENAME)
             if user_gene_quant_path is None:
@@ -633,7 +715,7 @@ class ExpressionPipeline:
 
             allele_quant_path = os.path.join(sample_data_directory, CAMPAREE_CONSTANTS.ALLELIC_IMBALANCE_OUTPUT_FILENAME)
             if user_allele_quant_path is None:
-                dep_list.append(f"AllelicImbalanceQuantificationStep_{sample.sample_id}")
+                dep_list.append(f"{allelic_imbalance_step}_{sample.sample_id}")
             else:
                 shutil.copy(user_allele_quant_path, allele_quant_path)
 
@@ -644,9 +726,16 @@ class ExpressionPipeline:
                           sample=sample,
                           cmd_line_args=[sample,  sample_data_directory,
                                          self.output_type, num_molecules_to_generate, seed],
-                          dependency_list=dep_list)
+                          dependency_list=dep_list,
+                          cache_key_inputs=[user_intron_quant_path, user_gene_quant_path,
+                                            user_psi_quant_path, user_allele_quant_path])
 
-        self.expression_pipeline_monitor.monitor_until_all_jobs_completed(queue_update_interval=10)
+        try:
+            self.expression_pipeline_monitor.monitor_until_all_jobs_completed(queue_update_interval=10)
+        finally:
+            # Cache the jobs that completed, even if the run failed partway, so
+            # they are not repeated when the run is restarted.
+            self.store_completed_jobs_in_step_cache()
 
         print("Execution of the Expression Pipeline Ended")
 
@@ -670,10 +759,13 @@ class ExpressionPipeline:
         return seeds
 
     def run_step(self, step_name, sample, cmd_line_args, dependency_list=None,
-                 jobname_suffix=None):
+                 jobname_suffix=None, cache_key_inputs=None):
         """
         Helper function that runs the given step, with the given parameters. It
-        wraps submission of the step to the scheduler/job monitor.
+        wraps submission of the step to the scheduler/job monitor. If a step cache
+        is configured and it contains the output of an identical job (same step,
+        parameters, inputs, and upstream jobs), the output is restored from the
+        cache and the job is not submitted.
 
         Parameters
         ----------
@@ -690,6 +782,9 @@ class ExpressionPipeline:
             List of job names (if any) the current step depends on. Default: None.
         jobname_suffix : string
             Suffix to add to job submission ID. Default: None.
+        cache_key_inputs : list
+            Additional input files, not passed on the command line, that affect
+            the output of the step. Only used for the step cache key. Default: None.
 
         """
         if step_name not in list(self.steps.keys()):
@@ -727,8 +822,33 @@ class ExpressionPipeline:
         validation_attributes = step_class.get_validation_attributes(*cmd_line_args)
         output_directory = os.path.join(step_class.data_directory_path,
                                         f"sample{sample.sample_id}" if sample else "")
-        self.expression_pipeline_monitor.submit_new_job(job_id=f"{step_name}{f'_{sample.sample_id}' if sample else ''}"
-                                                               f"{f'-{jobname_suffix}' if jobname_suffix else ''}",
+        job_id = (f"{step_name}{f'_{sample.sample_id}' if sample else ''}"
+                  f"{f'-{jobname_suffix}' if jobname_suffix else ''}")
+
+        if self.step_cache:
+            dependency_list = dependency_list if dependency_list else []
+            # A job can only be cached if the cache keys of all of its upstream
+            # jobs are known.
+            if all(job in self.__job_cache_keys for job in dependency_list):
+                job_key = self.step_cache.get_job_key(step_name=step_name,
+                                                      step_parameters=self.__step_parameters[step_name],
+                                                      cmd_line_args=[cmd_line_args, cache_key_inputs],
+                                                      dependency_keys=[self.__job_cache_keys[job]
+                                                                       for job in dependency_list])
+                self.__job_cache_keys[job_id] = job_key
+                output_file_paths = step_class.get_output_file_paths(validation_attributes)
+                if self.step_cache.is_cacheable(output_file_paths):
+                    if self.step_cache.fetch(job_key, output_file_paths):
+                        print(f"Restored {job_id} from the step cache.")
+                        self.__cached_job_ids.add(job_id)
+                        return
+                    self.__jobs_to_cache[job_id] = (step_class, validation_attributes)
+            # Jobs restored from the cache were never submitted to the job monitor.
+            dependency_list = [job for job in dependency_list if job not in self.__cached_job_ids]
+            if not dependency_list:
+                dependency_list = None
+
+        self.expression_pipeline_monitor.submit_new_job(job_id=job_id,
                                                         job_command=command,
                                                         sample=sample,
                                                         step_name=step_name,
@@ -738,6 +858,36 @@ class ExpressionPipeline:
                                                         system_id=None,
                                                         dependency_list=dependency_list)
 
+    def store_completed_job_in_step_cache(self, job_id):
+        """
+        Store the output of the given job in the step cache, provided the job is
+        waiting to be cached and its output is valid. The local job monitor calls
+        this method as soon as each job completes.
+
+        Parameters
+        ----------
+        job_id : string
+            ID of the job, as submitted to the job monitor.
+
+        """
+        if not self.step_cache or job_id not in self.__jobs_to_cache:
+            return
+        step_class, validation_attributes = self.__jobs_to_cache[job_id]
+        if step_class.is_output_valid(validation_attributes):
+            self.step_cache.store(self.__job_cache_keys[job_id],
+                                  step_class.get_output_file_paths(validation_attributes))
+            del self.__jobs_to_cache[job_id]
+
+    def store_completed_jobs_in_step_cache(self):
+        """
+        Store the output of every job still waiting to be cached in the step
+        cache, provided the job's output is valid. Called once monitoring ends,
+        whether or not all jobs completed, to cache any jobs the job monitor did
+        not report individually.
+        """
+        for job_id in list(self.__jobs_to_cache):
+            self.store_completed_job_in_step_cache(job_id)
+
     @staticmethod
     def main(configuration, scheduler_mode, output_directory_path, input_samples):
         pipeline = ExpressionPipeline(configuration, scheduler_mode, output_directory_path, input_samples)
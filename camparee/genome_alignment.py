@@ -257,6 +257,45 @@ class GenomeAlignmentStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by GenomeAlignmentStep for a specific
+        job/execution, given a job's data directory, sample id, BAM file path, and
+        pre-aligned flag. BAM files provided by the user are not cached. Prepare
+        these attributes for a given job using the get_validation_attributes()
+        method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, sample_id, path to the BAM file, and a flag
+            indicating whether or not the user provided a pre-aligned BAM.
+
+        Returns
+        -------
+        list
+            Paths to the BAM file and STAR log files, or None if the user provided
+            a pre-aligned BAM file.
+
+        """
+
+        data_directory = validation_attributes['data_directory']
+        sample_id = validation_attributes['sample_id']
+        bam_path = validation_attributes['bam_path']
+        bam_prealigned = validation_attributes['bam_prealigned']
+
+        if bam_prealigned:
+            return None
+
+        star_output_prefix = os.path.join(data_directory, f"sample{sample_id}",
+                                          CAMPAREE_CONSTANTS.DEFAULT_STAR_OUTPUT_PREFIX)
+        return [bam_path,
+                f"{star_output_prefix}Log.progress.out",
+                f"{star_output_prefix}Log.final.out",
+                f"{star_output_prefix}Log.out",
+                f"{star_output_prefix}SJ.out.tab"]
+
 
 class GenomeBamIndexStep(AbstractCampareeStep):
 
@@ -386,6 +425,27 @@ class GenomeBamIndexStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by GenomeBamIndexStep for a specific
+        job/execution, given the job's BAM file path. Prepare these attributes for a
+        given job using the get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            The path to a job's BAM file.
+
+        Returns
+        -------
+        list
+            Path to the BAM index file.
+
+        """
+
+        return [validation_attributes['bam_file_path'] + ".bai"]
+
 
 if __name__ == '__main__':
     """
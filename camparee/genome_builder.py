@@ -572,6 +572,43 @@ class GenomeBuilderStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by GenomeBuilderStep for a specific
+        job/execution, given a job's data directory, log directory, sample id, and
+        genome names. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, sample_id, and the list of
+            genome names used by the GenomeBuilderStep to refer to each of the
+            parental genomes.
+
+        Returns
+        -------
+        list
+            Paths to the genome and indel files for each parental genome, and
+            the log file.
+
+        """
+
+        data_directory = validation_attributes['data_directory']
+        log_directory = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_names = validation_attributes['genome_names']
+
+        output_file_paths = [os.path.join(log_directory, f"sample{sample_id}",
+                                          CAMPAREE_CONSTANTS.GENOMEBUILDER_LOG_FILENAME)]
+        for name in genome_names:
+            output_file_paths.append(os.path.join(data_directory, f"sample{sample_id}",
+                                                  Genome.GENOME_OUTPUT_FILENAME_PATTERN.format(genome_name=name)))
+            output_file_paths.append(os.path.join(data_directory, f"sample{sample_id}",
+                                                  Genome.INDEL_OUTPUT_FILENAME_PATTERN.format(genome_name=name)))
+        return output_file_paths
+
     @staticmethod
     def main():
         """
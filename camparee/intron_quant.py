@@ -4,6 +4,8 @@ import os
 import sys
 import argparse
 import json
+import heapq
+import multiprocessing
 
 import numpy
 import pysam
@@ -11,8 +13,241 @@ import pysam
 from camparee.annotation_info import AnnotationInfo
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeUtils
+
+class RegionOverlapCounter:
+    """Counts the number of fragments overlapping each mintron and intergenic
+    region, resolving overlaps for batches of fragments at a time.
+
+    Aligned blocks of each fragment are buffered by chromosome and strand. Once
+    the buffer holds batch_size fragments, the regions touched by every block are
+    found with a single vectorized binary search per region type, duplicate hits
+    from blocks of the same fragment are removed, and the number of fragments
+    touching each region is accumulated in a count array.
+
+    The regions of each contig are indexed once (see index_regions()), so they
+    may be given in any order and may overlap. Intergenic regions do both when
+    genes on opposite strands overlap.
+
+    Attributes
+    ----------
+    sense_mintron_counts : dict
+        (chrom, strand) -> array of the number of fragments from that strand
+        overlapping each mintron on the same strand.
+    antisense_mintron_counts : dict
+        (chrom, strand) -> array of the number of fragments from the opposite
+        strand overlapping each mintron on this strand.
+    intergenic_counts : dict
+        chrom -> array of the number of fragments overlapping each intergenic
+        region.
+
+    """
+
+    DEFAULT_BATCH_SIZE = 100_000
+
+    def __init__(self, info, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Parameters
+        ----------
+        info : AnnotationInfo
+            Annotation providing the mintron and intergenic extents.
+        batch_size : int
+            Number of fragments to buffer before resolving their overlaps.
+
+        """
+        self.mintron_extents_by_chrom = info.mintron_extents_by_chrom
+        self.intergenic_extents_by_chrom = info.intergenic_extents_by_chrom
+        self.batch_size = batch_size
+        self.mintron_indexes = {contig: RegionOverlapCounter.index_regions(starts, ends)
+                                for contig, (starts, ends) in self.mintron_extents_by_chrom.items()}
+        self.intergenic_indexes = {chrom: RegionOverlapCounter.index_regions(starts, ends)
+                                   for chrom, (starts, ends) in self.intergenic_extents_by_chrom.items()}
+        self.sense_mintron_counts = {contig: numpy.zeros(len(starts), dtype=numpy.int64)
+                                     for contig, (starts, ends) in self.mintron_extents_by_chrom.items()}
+        self.antisense_mintron_counts = {contig: numpy.zeros(len(starts), dtype=numpy.int64)
+                                         for contig, (starts, ends) in self.mintron_extents_by_chrom.items()}
+        self.intergenic_counts = {chrom: numpy.zeros(len(starts), dtype=numpy.int64)
+                                  for chrom, (starts, ends) in self.intergenic_extents_by_chrom.items()}
+        # (chrom, strand) -> ([block starts], [block ends], [fragment number])
+        self.buffered_blocks = collections.defaultdict(lambda: ([], [], []))
+        self.buffered_fragment_count = 0
+
+    def add_fragment(self, chrom, strand, blocks):
+        """Buffer the aligned blocks of one fragment.
+
+        Parameters
+        ----------
+        chrom : string
+            Chromosome the fragment aligned to.
+        strand : string
+            Strand (+/-) the fragment originated from.
+        blocks : iterable
+            (start, end) of each aligned block, in pysam's 0-based, half-open
+            coordinates.
+
+        """
+        block_starts, block_ends, block_fragments = self.buffered_blocks[chrom, strand]
+        for start, end in blocks:
+            block_starts.append(start)
+            block_ends.append(end)
+            block_fragments.append(self.buffered_fragment_count)
+        self.buffered_fragment_count += 1
+        if self.buffered_fragment_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Resolve the overlaps of all buffered fragments and add them to the
+        region counts.
+        """
+        for (chrom, strand), (block_starts, block_ends, block_fragments) in self.buffered_blocks.items():
+            antisense_strand = "-" if strand == "+" else "+"
+            # NOTE: pysam is working in 0-based, half-open coordinates! We are using 1-based
+            block_starts = numpy.array(block_starts, dtype=numpy.int64) + 1
+            block_ends = numpy.array(block_ends, dtype=numpy.int64)
+            block_fragments = numpy.array(block_fragments, dtype=numpy.int64)
+
+            # Use get() since any of these can be missing for small chromosomes
+            # and non-standard contigs.
+            if (chrom, strand) in self.mintron_indexes:
+                self.sense_mintron_counts[chrom, strand] += \
+                    RegionOverlapCounter.count_fragments_by_region(self.mintron_indexes[chrom, strand],
+                                                                   block_starts, block_ends, block_fragments)
+            if (chrom, antisense_strand) in self.mintron_indexes:
+                self.antisense_mintron_counts[chrom, antisense_strand] += \
+                    RegionOverlapCounter.count_fragments_by_region(self.mintron_indexes[chrom, antisense_strand],
+                                                                   block_starts, block_ends, block_fragments)
+            if chrom in self.intergenic_indexes:
+                self.intergenic_counts[chrom] += \
+                    RegionOverlapCounter.count_fragments_by_region(self.intergenic_indexes[chrom],
+                                                                   block_starts, block_ends, block_fragments)
+        self.buffered_blocks.clear()
+        self.buffered_fragment_count = 0
+
+    def get_counts(self, chrom):
+        """Return the region counts for a single chromosome.
+
+        Parameters
+        ----------
+        chrom : string
+            Chromosome whose counts to return.
+
+        Returns
+        -------
+        tuple
+            Sense mintron, antisense mintron, and intergenic counts, each a dict
+            in the same format as the corresponding attribute, but restricted to
+            the given chromosome.
+
+        """
+        return ({contig: counts for contig, counts in self.sense_mintron_counts.items() if contig[0] == chrom},
+                {contig: counts for contig, counts in self.antisense_mintron_counts.items() if contig[0] == chrom},
+                {contig: counts for contig, counts in self.intergenic_counts.items() if contig == chrom})
+
+    def add_counts(self, counts):
+        """Add region counts produced by another counter (e.g. in a worker
+        process) to this counter.
+
+        Parameters
+        ----------
+        counts : tuple
+            Sense mintron, antisense mintron, and intergenic counts, as returned
+            by get_counts().
+
+        """
+        sense_mintron_counts, antisense_mintron_counts, intergenic_counts = counts
+        for contig, region_counts in sense_mintron_counts.items():
+            self.sense_mintron_counts[contig] += region_counts
+        for contig, region_counts in antisense_mintron_counts.items():
+            self.antisense_mintron_counts[contig] += region_counts
+        for contig, region_counts in intergenic_counts.items():
+            self.intergenic_counts[contig] += region_counts
+
+    @staticmethod
+    def index_regions(region_starts, region_ends):
+        """Prepare regions for count_fragments_by_region().
+
+        Parameters
+        ----------
+        region_starts : numpy.array
+            Start coordinates of the regions (1-based, inclusive), in any order.
+        region_ends : numpy.array
+            End coordinates of the regions (1-based, inclusive).
+
+        Returns
+        -------
+        tuple
+            The order that sorts the regions by start (None if they are already
+            sorted), the sorted region starts and ends, and the running maximum of
+            the sorted region ends.
+
+        """
+        if numpy.all(region_starts[1:] >= region_starts[:-1]):
+            region_order = None
+        else:
+            region_order = numpy.argsort(region_starts, kind="stable")
+            region_starts = region_starts[region_order]
+            region_ends = region_ends[region_order]
+        return region_order, region_starts, region_ends, numpy.maximum.accumulate(region_ends)
+
+    @staticmethod
+    def count_fragments_by_region(region_index, block_starts, block_ends, block_fragments):
+        """Count the number of distinct fragments with at least one block
+        overlapping each region.
+
+        Parameters
+        ----------
+        region_index : tuple
+            Regions to count, as returned by index_regions().
+        block_starts : numpy.array
+            Start coordinates of the aligned blocks (1-based, inclusive).
+        block_ends : numpy.array
+            End coordinates of the aligned blocks (1-based, inclusive).
+        block_fragments : numpy.array
+            Number of the fragment each block belongs to.
+
+        Returns
+        -------
+        numpy.array
+            Number of fragments overlapping each region, in the order the
+            regions were given to index_regions().
+
+        """
+        region_order, region_starts, region_ends, region_max_ends = region_index
+        num_regions = len(region_starts)
+        # Regions before the first one whose running maximum end reaches the
+        # block start all end before the block. Regions from there up to the
+        # first region to start after the block end may overlap the block. For
+        # non-overlapping regions, they all do.
+        first_region_touched = numpy.searchsorted(region_max_ends, block_starts, side="left")
+        first_region_after = numpy.searchsorted(region_starts, block_ends, side="right")
+        num_regions_touched = numpy.maximum(first_region_after - first_region_touched, 0)
+
+        # Expand each block into one entry per region it may touch.
+        total_touched = num_regions_touched.sum()
+        if total_touched == 0:
+            return numpy.zeros(num_regions, dtype=numpy.int64)
+        block_offsets = numpy.cumsum(num_regions_touched) - num_regions_touched
+        regions_touched = numpy.repeat(first_region_touched - block_offsets, num_regions_touched) + \
+                          numpy.arange(total_touched)
+        fragments = numpy.repeat(block_fragments, num_regions_touched)
+        # Drop regions nested inside an earlier, longer region that end before the block.
+        touched = region_ends[regions_touched] >= numpy.repeat(block_starts, num_regions_touched)
+        if not touched.all():
+            regions_touched = regions_touched[touched]
+            fragments = fragments[touched]
+        if region_order is not None:
+            regions_touched = region_order[regions_touched]
+
+        # A fragment counts once per region, even if several of its blocks touch it.
+        fragment_region_pairs = numpy.unique(fragments * num_regions + regions_touched)
+        return numpy.bincount(fragment_region_pairs % num_regions, minlength=num_regions)
+
 
 class IntronQuantificationStep(AbstractCampareeStep):
+
+    # Number of transcripts whose output lines are written at once.
+    OUTPUT_CHUNK_SIZE = 10_000
+
     def __init__(self, log_directory_path, data_directory_path, parameters):
         #TODO: I dont thing the data directory or the log directory are ever
         #      used in the code below. Should we remove them? Or adapt the code
@@ -20,252 +255,237 @@ class IntronQuantificationStep(AbstractCampareeStep):
         self.log_directory_path = log_directory_path
         self.data_directory_path = data_directory_path
         self.info = None
-        self.intron_normalized_antisense_counts = collections.Counter()
-        self.intron_normalized_counts = collections.Counter()
-        self.transcript_intron_antisense_counts = collections.Counter()
-        self.transcript_intron_counts = collections.Counter()
+        # Normalized counts (FPK) of each intron, indexed by intron ID
+        self.intron_normalized_antisense_counts = None
+        self.intron_normalized_counts = None
+        # Normalized counts (FPK) of all introns in each transcript, in the order of info.transcripts
+        self.transcript_intron_antisense_counts = None
+        self.transcript_intron_counts = None
         self.flank_size = parameters["flank_size"]
-        self.intergenic_read_counts = collections.defaultdict(collections.Counter)
+        # chrom -> array of read counts of each intergenic region
+        self.intergenic_read_counts = None
         self.forward_read_is_sense = parameters["forward_read_is_sense"]
+        # Number of worker processes used to count reads from separate chromosomes
+        # in parallel. Requires an indexed BAM file.
+        self.num_processes = parameters.get("num_processes", 1)
+        # Directory where the processed annotation is cached, so it is only built
+        # once per annotation file.
+        self.annotation_cache_directory_path = parameters.get("annotation_cache_directory_path", None)
 
     def validate(self):
         # TODO: do we need proper validation?
         return True
 
     def execute(self, aligned_file_path, output_directory, geneinfo_file_path):
-        # (chrom, strand) -> {(transcriptID, intron_number) -> read_count}
-        intron_read_counts = collections.Counter()
-        intron_antisense_read_counts = collections.Counter()
-        # chrom -> {intron -> read count}
-
         # Open BAM file with pysam
         # NOTE: use the check_sq=False flag since sometimes pysam complains erroneously about BAM headers
         # even though the header appears fine in samtools
         print(f"Opening alignment file {aligned_file_path}")
         with pysam.AlignmentFile(aligned_file_path, "rb") as alignments:
 
-            chrom_lengths = dict(zip(alignments.references, alignments.lengths))
-
-            #  Read in the annotation information
-            self.info = AnnotationInfo(geneinfo_file_path, chrom_lengths)
-            print(f"Read in annotation info file {geneinfo_file_path}")
-
-            unpaired_reads = dict()
-
-            # Go through all reads, and compare
-            skipped_chromosomes = []
-            for read in alignments.fetch(until_eof=True):
-                # Use only uniquely mapped reads with both pairs mapped
-                if read.is_unmapped or not read.is_proper_pair or not read.get_tag("NH") == 1:
-                    continue
-
-                try:
-                    mate = unpaired_reads[read.query_name]
-                except KeyError:
-                    # mate not cached for processing, so cache this one
-                    unpaired_reads[read.query_name] = read
-                    continue
-
-                # Read is paired to 'mate', so we process both together now
-                # So remove the mate from the cache since we're done with it
-                del unpaired_reads[read.query_name]
-
-                chrom = read.reference_name
-                # Check annotations are available for that chromosome
-                if chrom not in self.info.intergenics:
-                    if chrom not in skipped_chromosomes:
-                        print(f"Alignment from chromosome {chrom} skipped")
-                        skipped_chromosomes.append(chrom)
-                    continue
-
-                # According to the SAM file specification, this CAN fail but I don't understand why it would
-                # so just throw this assert in to verify that it doesn't, at least for now
-                assert read.is_reverse != mate.is_reverse
-
-                # Figure out the fragment's strand - depends on whether the forward or reverse reads are 'sense'
-                read1_reverse_aligned = (read.is_reverse and read.is_read1) or (not read.is_reverse and read.is_read2)
-                if self.forward_read_is_sense:
-                    strand = "-" if read1_reverse_aligned else "+"
-                else:
-                    strand = "+" if read1_reverse_aligned else "-"
-                antisense_strand = "-" if strand is "+" else "+"
-
-                # Use get() method to prevent KeyError if any of these data structures
-                # are empty. This can occur for small chromosomes and non-standard
-                # contigs.
-                mintron_starts, mintron_ends = self.info.mintron_extents_by_chrom.get((chrom, strand), [None, None])
-                antisense_mintron_starts, antisense_mintron_ends = self.info.mintron_extents_by_chrom.get((chrom, antisense_strand), [None, None])
-                intergenic_starts, intergenic_ends = self.info.intergenic_extents_by_chrom.get(chrom, [None, None])
-
-                mintrons_touched = set()
-                antisense_mintrons_touched = set()
-                intergenics_touched = set()
-
-                # check what regions our blocks touch
-                for start, end in itertools.chain(read.get_blocks(), mate.get_blocks()):
-                    # NOTE: pysam is working in 0-based, half-open coordinates! We are using 1-based
-                    start = start + 1
-
-                    # If any mintrons were found in the current chromosome/strand
-                    if mintron_starts is not None and mintron_ends is not None:
-                        # We may intersect this mintron, depending on where its end lies
-                        # or this could be -1 if we start before all mintrons
-                        last_mintron_before = numpy.searchsorted(mintron_starts, start, side="right") - 1
-
-                        # We definitely do not intersect this mintron, it starts after our end
-                        first_mintron_after = numpy.searchsorted(mintron_starts, end, side="right")
-                        # but all between the two, we do intersect
-
-                        if last_mintron_before == -1:
-                            # No introns start before us
-                            mintrons_touched.update(range(0, first_mintron_after))
-                        elif mintron_ends[last_mintron_before] >= start:
-                            # We do intersect the last one to start before us
-                            mintrons_touched.update(range(last_mintron_before, first_mintron_after))
-                        else:
-                            # We only start intersecting the first one after that
-                            mintrons_touched.update(range(last_mintron_before + 1, first_mintron_after))
-
-                    # If any antisense mintrons were found in the current chromosome/strand
-                    if antisense_mintron_starts is not None and antisense_mintron_ends is not None:
-                        # Now do the same thing as above for antisense regions
-                        last_antisense_mintron_before = numpy.searchsorted(antisense_mintron_starts, start, side="right") - 1
-                        first_antisense_mintron_after = numpy.searchsorted(antisense_mintron_starts, end, side="right")
-                        if last_antisense_mintron_before == -1:
-                            antisense_mintrons_touched.update(range(0, first_antisense_mintron_after))
-                        elif antisense_mintron_ends[last_antisense_mintron_before] >= start:
-                            antisense_mintrons_touched.update(range(last_antisense_mintron_before, first_antisense_mintron_after))
-                        else:
-                            antisense_mintrons_touched.update(range(last_antisense_mintron_before + 1, first_antisense_mintron_after))
-
-                    # If any intergenic regions were found in the current chromosome
-                    # (should only be an issue for small contigs, some prokaryotic
-                    # genomes, and other less common cases)
-                    if intergenic_starts is not None and intergenic_ends is not None:
-                        # Now do the same thing as above for intergenic regions
-                        last_intergenic_before = numpy.searchsorted(intergenic_starts, start, side="right") - 1
-                        first_intergenic_after = numpy.searchsorted(intergenic_starts, end, side="right")
-                        if last_intergenic_before == -1:
-                            intergenics_touched.update(range(0, first_intergenic_after))
-                        elif intergenic_ends[last_intergenic_before] >= start:
-                            intergenics_touched.update(range(last_intergenic_before, first_intergenic_after))
-                        else:
-                            intergenics_touched.update(range(last_intergenic_before + 1, first_intergenic_after))
-
-                # Accumulate the reads
-                for mintron_index in mintrons_touched:
-                    for intron in self.info.mintrons_by_chrom[chrom, strand][mintron_index].primary_introns:
-                        intron_read_counts[intron] += 1
-
-                for antisense_mintron_index in antisense_mintrons_touched:
-                    for intron in self.info.mintrons_by_chrom[chrom, antisense_strand][antisense_mintron_index].primary_antisense_introns:
-                        intron_antisense_read_counts[intron] += 1
-
-                for intergenic in intergenics_touched:
-                    self.intergenic_read_counts[chrom][intergenic] += 1
+            self.load_annotation(alignments, geneinfo_file_path)
+
+            overlap_counter = RegionOverlapCounter(self.info)
+            # Only chromosomes with annotations are read in parallel mode. Any
+            # alignments to other chromosomes are skipped.
+            annotated_chromosomes = [chrom for chrom in alignments.references if chrom in self.info.intergenics]
+
+            # Counts from each chromosome are independent, so they can be gathered
+            # by separate worker processes, each reading its chromosome's reads
+            # from the BAM index. Only pairs with both mates on the same
+            # chromosome are counted, which includes all properly paired reads.
+            if self.num_processes > 1 and alignments.has_index():
+                print(f"Counting reads from {len(annotated_chromosomes)} chromosomes "
+                      f"using {self.num_processes} processes")
+                # The fork context lets workers share the annotation with this
+                # process, rather than receiving a pickled copy.
+                with multiprocessing.get_context("fork").Pool(self.num_processes,
+                                                              initializer=_initialize_worker,
+                                                              initargs=(self, aligned_file_path)) as pool:
+                    for chrom_counts in pool.imap_unordered(_count_chromosome_reads, annotated_chromosomes):
+                        overlap_counter.add_counts(chrom_counts)
+            else:
+                if self.num_processes > 1:
+                    print(f"{aligned_file_path} is not indexed. Counting reads using a single process.")
+                coordinate_sorted = alignments.header.to_dict().get('HD', {}).get('SO') == "coordinate"
+                self.count_reads(alignments.fetch(until_eof=True), overlap_counter,
+                                 coordinate_sorted=coordinate_sorted)
+
+        self.quantify(overlap_counter, output_directory)
 
+    def load_annotation(self, alignments, geneinfo_file_path):
+        """
+        Read in the annotation information, using the chromosome lengths from the
+        header of the alignment file.
+
+        Parameters
+        ----------
+        alignments : pysam.AlignmentFile
+            Open alignment file the reads will be counted from.
+        geneinfo_file_path : string
+            Geneinfo file in BED format with 1-based, inclusive coordinates.
+
+        """
+        chrom_lengths = dict(zip(alignments.references, alignments.lengths))
+        self.info = AnnotationInfo.load_or_build(geneinfo_file_path, chrom_lengths, self.flank_size,
+                                                 cache_directory_path=self.annotation_cache_directory_path)
+        print(f"Read in annotation info file {geneinfo_file_path}")
+
+    def quantify(self, overlap_counter, output_directory):
+        """
+        Normalize the counts gathered by the overlap counter and write the intron,
+        antisense intron, and intergenic quantification files.
+
+        Parameters
+        ----------
+        overlap_counter : RegionOverlapCounter
+            Counter holding the fragments overlapping each region, after all
+            reads have been counted.
+        output_directory : string
+            Directory where the output files are saved.
+
+        """
+        # Accumulate the reads. Each fragment overlapping a mintron counts toward
+        # all of that mintron's primary introns.
+        num_introns = len(self.info.introns)
+        intron_read_counts = numpy.zeros(num_introns)
+        for contig, mintron_counts in overlap_counter.sense_mintron_counts.items():
+            indptr, intron_ids = self.info.mintron_primary_introns[contig]
+            intron_read_counts += numpy.bincount(intron_ids, weights=numpy.repeat(mintron_counts, numpy.diff(indptr)),
+                                                 minlength=num_introns)
+        intron_antisense_read_counts = numpy.zeros(num_introns)
+        for contig, mintron_counts in overlap_counter.antisense_mintron_counts.items():
+            indptr, intron_ids = self.info.mintron_primary_antisense_introns[contig]
+            intron_antisense_read_counts += numpy.bincount(intron_ids,
+                                                           weights=numpy.repeat(mintron_counts, numpy.diff(indptr)),
+                                                           minlength=num_introns)
+        self.intergenic_read_counts = overlap_counter.intergenic_counts
 
         # Normalize reads by effective transcript lengths
-        for intron, count in intron_read_counts.items():
-            effective_count = count / intron.effective_length * 1000 # FPK (fragments per kilo-base)
-            self.intron_normalized_counts[intron] = effective_count
-            # TODO: is this the right normalization factor for antisense reads?
-            #  currently use the total length of all antisense mintrons, but this seems wrong....
-            antisense_count = intron_antisense_read_counts[intron]
-            if antisense_count > 0:
-                self.intron_normalized_antisense_counts[intron] = antisense_count / intron.antisense_effective_length * 1000
+        # FPK (fragments per kilo-base)
+        has_reads = intron_read_counts > 0
+        self.intron_normalized_counts = numpy.zeros(num_introns)
+        self.intron_normalized_counts[has_reads] = \
+            intron_read_counts[has_reads] / self.info.intron_effective_lengths[has_reads] * 1000
+        # TODO: is this the right normalization factor for antisense reads?
+        #  currently use the total length of all antisense mintrons, but this seems wrong....
+        has_antisense_reads = has_reads & (intron_antisense_read_counts > 0)
+        self.intron_normalized_antisense_counts = numpy.zeros(num_introns)
+        self.intron_normalized_antisense_counts[has_antisense_reads] = \
+            intron_antisense_read_counts[has_antisense_reads] / \
+            self.info.intron_antisense_effective_lengths[has_antisense_reads] * 1000
 
         # Now remove counts from non-primary introns from mintrons, under the assumption that
         # if two introns overlap, we want to "subtract out" one of them from the overlap
         # We process introns in order of their transcript start: the idea being that we are modifying their
         # intron counts, so we had better be consistent as we process, going from 5' to 3' ends
-        for contig, transcripts in self.info.transcripts_by_chrom.items():
+        for (chrom, strand), transcripts in self.info.transcripts_by_chrom.items():
+            antisense_strand = "+" if strand == "-" else "-"
+            indptr, primary_intron_ids = self.info.mintron_primary_introns[chrom, strand]
+            antisense_indptr, primary_antisense_intron_ids = \
+                self.info.mintron_primary_antisense_introns.get((chrom, antisense_strand), (None, None))
             for transcript in transcripts:
                 for intron in transcript.introns:
-                    count = self.intron_normalized_counts.get(intron, 0)
+                    intron_id = intron.intron_id
+                    count = self.intron_normalized_counts[intron_id]
                     if count == 0:
                         continue
 
-                    for mintron in intron.mintrons:
-                        if intron not in mintron.primary_introns:
-                            for other_intron in mintron.primary_introns:
-                                other_counts = self.intron_normalized_counts[other_intron]
+                    first, stop = self.info.intron_mintron_ranges[intron_id]
+                    for mintron_index in range(first, stop):
+                        other_intron_ids = primary_intron_ids[indptr[mintron_index]:indptr[mintron_index + 1]]
+                        if intron_id not in other_intron_ids:
+                            for other_intron_id in other_intron_ids:
+                                other_counts = self.intron_normalized_counts[other_intron_id]
                                 # Remove the double-counts but never give negative expression
-                                self.intron_normalized_counts[other_intron] = min(other_counts - count, 0)
+                                self.intron_normalized_counts[other_intron_id] = min(other_counts - count, 0)
 
                     # Same for anti-sense
-                    antisense_count = self.intron_normalized_counts.get(intron, 0)
-                    for antisense_mintron in intron.antisense_mintrons:
-                        if intron not in antisense_mintron.primary_antisense_introns:
-                            for other_intron in antisense_mintron.primary_antisense_introns:
-                                other_counts = self.intron_normalized_antisense_counts[other_intron]
+                    antisense_count = self.intron_normalized_counts[intron_id]
+                    first, stop = self.info.intron_antisense_mintron_ranges[intron_id]
+                    for mintron_index in range(first, stop):
+                        other_intron_ids = primary_antisense_intron_ids[antisense_indptr[mintron_index]:
+                                                                        antisense_indptr[mintron_index + 1]]
+                        if intron_id not in other_intron_ids:
+                            for other_intron_id in other_intron_ids:
+                                other_counts = self.intron_normalized_antisense_counts[other_intron_id]
                                 # Remove the double-counts but never give negative expression
-                                self.intron_normalized_antisense_counts[other_intron] = min(other_counts - antisense_count, 0)
+                                self.intron_normalized_antisense_counts[other_intron_id] = \
+                                    min(other_counts - antisense_count, 0)
 
         # Transcript-level intron quantifications
-        for transcript_id, transcript in self.info.transcripts.items():
-            # flanks are first-and-last introns
-            # But for now we do not use them to quantify the total transcript-level
-            # intron counts since they are not really introns but are very long and so
-            # throw off the intron length normalization
-            non_flank_introns = transcript.introns[1:-1]
-            sense_counts = 0
-            antisense_counts = 0
-            total_length = 0
-            for intron in non_flank_introns:
-                # We use normalized_counts here and then "unnormalize" them by effective length since we have
-                # already performed the correction of the above section (removing non-primary intron counts)
-                sense_counts  += self.intron_normalized_counts[intron] * intron.effective_length
-                antisense_counts  += self.intron_normalized_antisense_counts[intron] * intron.effective_length
-                total_length += intron.effective_length
-
-            if total_length == 0:
-                self.transcript_intron_counts[transcript_id] = 0
-                self.transcript_intron_antisense_counts[transcript_id] = 0
-            else:
-                self.transcript_intron_counts[transcript_id] = sense_counts / total_length
-                self.transcript_intron_antisense_counts[transcript_id] = antisense_counts / total_length
-
-        # Write out the results to output file
+        # Introns of every transcript, as a flat array of intron IDs with the introns of the transcript
+        # at index i in transcript_intron_ids[transcript_intron_offsets[i]:transcript_intron_offsets[i+1]]
+        transcripts = list(self.info.transcripts.values())
+        intron_counts_per_transcript = numpy.array([len(transcript.introns) for transcript in transcripts],
+                                                   dtype=numpy.int64)
+        transcript_intron_offsets = numpy.zeros(len(transcripts) + 1, dtype=numpy.int64)
+        numpy.cumsum(intron_counts_per_transcript, out=transcript_intron_offsets[1:])
+        transcript_intron_ids = numpy.fromiter((intron.intron_id for transcript in transcripts
+                                                for intron in transcript.introns),
+                                               dtype=numpy.int64, count=transcript_intron_offsets[-1])
+        # flanks are first-and-last introns
+        # But for now we do not use them to quantify the total transcript-level
+        # intron counts since they are not really introns but are very long and so
+        # throw off the intron length normalization
+        intron_transcript_indices = numpy.repeat(numpy.arange(len(transcripts)), intron_counts_per_transcript)
+        is_flank = numpy.zeros(len(transcript_intron_ids), dtype=bool)
+        is_flank[transcript_intron_offsets[:-1]] = True
+        is_flank[transcript_intron_offsets[1:] - 1] = True
+        non_flank_intron_ids = transcript_intron_ids[~is_flank]
+        non_flank_transcript_indices = intron_transcript_indices[~is_flank]
+        effective_lengths = self.info.intron_effective_lengths[non_flank_intron_ids]
+        total_lengths = numpy.bincount(non_flank_transcript_indices, weights=effective_lengths,
+                                       minlength=len(transcripts))
+        # We use normalized_counts here and then "unnormalize" them by effective length since we have
+        # already performed the correction of the above section (removing non-primary intron counts)
+        sense_counts = numpy.bincount(non_flank_transcript_indices,
+                                      weights=self.intron_normalized_counts[non_flank_intron_ids] * effective_lengths,
+                                      minlength=len(transcripts))
+        antisense_counts = numpy.bincount(non_flank_transcript_indices,
+                                          weights=self.intron_normalized_antisense_counts[non_flank_intron_ids]
+                                                  * effective_lengths,
+                                          minlength=len(transcripts))
+        has_length = total_lengths > 0
+        self.transcript_intron_counts = numpy.zeros(len(transcripts))
+        self.transcript_intron_counts[has_length] = sense_counts[has_length] / total_lengths[has_length]
+        self.transcript_intron_antisense_counts = numpy.zeros(len(transcripts))
+        self.transcript_intron_antisense_counts[has_length] = \
+            antisense_counts[has_length] / total_lengths[has_length]
+
+        # Write out the results to output files
+        # take transcripts from all chromosomes and combine them, sorting by gene id and then transcript id
+        transcript_order = sorted(range(len(transcripts)),
+                                  key=lambda index: (transcripts[index].gene_id, transcripts[index].transcript_id))
         # SENSE INTRON OUTPUT
-        output_file_path = os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME)
-        with open(output_file_path, "w") as output_file:
-            output_file.write("#gene_id\ttranscript_id\tchr\tstrand\ttranscript_intron_reads_FPK\tintron_reads_FPK\n")
-            # take transcripts from all chromosomes and combine them, sorting by gene id and then transcript id
-            transcript_ids = sorted((transcript.gene.gene_id, id, transcript) for id, transcript in self.info.transcripts.items())
-            for (gene_id, transcript_id, transcript) in transcript_ids:
-
-                total_count = self.transcript_intron_counts[transcript_id]
-                intron_counts = [str(self.intron_normalized_counts[intron]) for intron in transcript.introns]
-
-
-                output_file.write('\t'.join([gene_id,
-                                             transcript_id,
-                                             transcript.chrom,
-                                             transcript.strand,
-                                             str(total_count),
-                                             ','.join(intron_counts),
-                                            ]) + '\n')
-
+        self.write_intron_output(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME),
+                                 transcripts, transcript_order, has_length, self.transcript_intron_counts,
+                                 transcript_intron_offsets, transcript_intron_ids, self.intron_normalized_counts)
         # ANTISENSE INTRON OUTPUT
-        output_file_path = os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME)
-        with open(output_file_path, "w") as output_file:
-            output_file.write("#gene_id\ttranscript_id\tchr\tstrand\ttranscript_intron_reads_FPK\tintron_reads_FPK\n")
-            # take transcripts from all chromosomes and combine them, sorting by gene id and then transcript id
-            transcript_ids = sorted((transcript.gene.gene_id, id, transcript) for id, transcript in self.info.transcripts.items())
-            for (gene_id, transcript_id, transcript) in transcript_ids:
-
-                total_count = self.transcript_intron_antisense_counts[transcript_id]
-                intron_counts = [str(self.intron_normalized_antisense_counts[intron]) for intron in transcript.introns]
-
-
-                output_file.write('\t'.join([gene_id,
-                                             transcript_id,
-                                             transcript.chrom,
-                                             transcript.strand,
-                                             str(total_count),
-                                             ','.join(intron_counts),
-                                            ]) + '\n')
+        self.write_intron_output(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME),
+                                 transcripts, transcript_order, has_length, self.transcript_intron_antisense_counts,
+                                 transcript_intron_offsets, transcript_intron_ids,
+                                 self.intron_normalized_antisense_counts)
+
+        # Binary copy of the sense intron output, which the MoleculeMakerStep
+        # loads without parsing the text file. It records the digest of the text
+        # file, so it is only used alongside the text file it was written with.
+        transcript_order = numpy.array(transcript_order, dtype=numpy.int64)
+        sorted_intron_offsets = numpy.zeros(len(transcripts) + 1, dtype=numpy.int64)
+        numpy.cumsum(intron_counts_per_transcript[transcript_order], out=sorted_intron_offsets[1:])
+        sorted_intron_ids = transcript_intron_ids[
+            numpy.repeat(transcript_intron_offsets[transcript_order] - sorted_intron_offsets[:-1],
+                         intron_counts_per_transcript[transcript_order])
+            + numpy.arange(sorted_intron_offsets[-1])]
+        numpy.savez(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_NPZ_FILENAME),
+                    gene_ids=numpy.array([transcripts[index].gene_id for index in transcript_order], dtype=str),
+                    transcript_ids=numpy.array([transcripts[index].transcript_id for index in transcript_order],
+                                               dtype=str),
+                    transcript_intron_reads_FPK=self.transcript_intron_counts[transcript_order],
+                    intron_offsets=sorted_intron_offsets,
+                    intron_reads_FPK=self.intron_normalized_counts[sorted_intron_ids],
+                    text_file_digest=CampareeUtils.compute_file_digest(
+                        os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME)))
 
         # TODO: do we need to normalize intergenic regions?
         #   Not clear that just dividing by their length is right since usually you have just
@@ -273,19 +493,182 @@ class IntronQuantificationStep(AbstractCampareeStep):
         output_intergenic_file_path = os.path.join(output_directory, CAMPAREE_CONSTANTS.INTERGENIC_OUTPUT_FILENAME)
         with open(output_intergenic_file_path, "w") as output_file:
             output_file.write("#chromosome\tintergenic_region_number\tstart\tend\treads_FPK\n")
-            # take transcripts from all chromosomes and combine them, sorting by gene id and then transcript id
             chroms_sorted = sorted(self.info.intergenics.keys())
             for chrom in chroms_sorted:
-                intergenics = self.info.intergenics[chrom]
-                for i, intergenic in enumerate(intergenics):
-                    count = self.intergenic_read_counts[chrom][i]
+                intergenic_starts, intergenic_ends = self.info.intergenic_extents_by_chrom[chrom]
+                output_file.writelines(f"{chrom}\t{i}\t{start}\t{end}\t{count}\n"
+                                       for i, (start, end, count) in enumerate(zip(intergenic_starts.tolist(),
+                                                                                   intergenic_ends.tolist(),
+                                                                                   self.intergenic_read_counts[chrom].tolist())))
+
+    @staticmethod
+    def write_intron_output(output_file_path, transcripts, transcript_order, has_length, transcript_counts,
+                            transcript_intron_offsets, transcript_intron_ids, intron_counts):
+        """
+        Write the transcript- and intron-level counts of every transcript to an
+        intron quantification file. Counts for all introns are formatted at once,
+        and lines are written in blocks of OUTPUT_CHUNK_SIZE transcripts.
+
+        Parameters
+        ----------
+        output_file_path : string
+            Path to the output file.
+        transcripts : list
+            All transcripts in the annotation.
+        transcript_order : list
+            Indices into transcripts, in the order they are written.
+        has_length : numpy.array
+            Whether each transcript has any (non-flank) intronic sequence. The
+            transcript-level count of transcripts without is written as 0.
+        transcript_counts : numpy.array
+            Normalized count of all introns in each transcript.
+        transcript_intron_offsets : numpy.array
+            Offsets of each transcript's introns within transcript_intron_ids.
+        transcript_intron_ids : numpy.array
+            IDs of the introns of all transcripts, in transcript order.
+        intron_counts : numpy.array
+            Normalized count of each intron, indexed by intron ID.
+
+        """
+        # Introns without reads are written as 0, as are transcripts without introns
+        formatted_intron_counts = [str(count) if count else "0" for count in intron_counts.tolist()]
+        formatted_transcript_counts = [str(count) if length else "0"
+                                       for count, length in zip(transcript_counts.tolist(), has_length.tolist())]
+        transcript_intron_offsets = transcript_intron_offsets.tolist()
+        transcript_intron_ids = transcript_intron_ids.tolist()
+        with open(output_file_path, "w") as output_file:
+            output_file.write("#gene_id\ttranscript_id\tchr\tstrand\ttranscript_intron_reads_FPK\tintron_reads_FPK\n")
+            for chunk_start in range(0, len(transcript_order), IntronQuantificationStep.OUTPUT_CHUNK_SIZE):
+                lines = []
+                for index in transcript_order[chunk_start:chunk_start + IntronQuantificationStep.OUTPUT_CHUNK_SIZE]:
+                    transcript = transcripts[index]
+                    intron_ids = transcript_intron_ids[transcript_intron_offsets[index]:
+                                                       transcript_intron_offsets[index + 1]]
+                    intron_counts_field = ','.join([formatted_intron_counts[intron_id] for intron_id in intron_ids])
+                    lines.append(f"{transcript.gene_id}\t{transcript.transcript_id}\t{transcript.chrom}\t"
+                                 f"{transcript.strand}\t{formatted_transcript_counts[index]}\t{intron_counts_field}\n")
+                output_file.write(''.join(lines))
+
+    def count_reads(self, reads, overlap_counter, coordinate_sorted=True):
+        """
+        Pair up uniquely-mapped, properly-paired reads and add the aligned blocks
+        of each fragment to the given overlap counter.
+
+        Until its mate is found, only the blocks and orientation of each read are
+        kept. For coordinate-sorted reads, a read is dropped once the scan passes
+        the position of its mate without finding it (e.g. the mate was not
+        uniquely mapped), so memory use is bounded by the span of the longest
+        inserts rather than the total number of unmatched reads.
+
+        Parameters
+        ----------
+        reads : iterable
+            Aligned reads (pysam AlignedSegments), with mates from the same
+            chromosome.
+        overlap_counter : RegionOverlapCounter
+            Counter accumulating the fragments overlapping each region.
+        coordinate_sorted : boolean
+            Whether the reads are sorted by coordinate. If False, reads whose
+            mates are never found are kept until the end of the scan.
+
+        """
+        self.start_counting(overlap_counter, coordinate_sorted)
+        for read in reads:
+            self.add_read(read)
+        self.finish_counting()
+
+    def start_counting(self, overlap_counter, coordinate_sorted=True):
+        """
+        Prepare to receive reads, one at a time, through add_read(). Used by
+        count_reads(), and by steps that feed reads from a scan they share with
+        other consumers.
+
+        Parameters
+        ----------
+        overlap_counter : RegionOverlapCounter
+            Counter accumulating the fragments overlapping each region.
+        coordinate_sorted : boolean
+            Whether the reads are sorted by coordinate.
 
-                    output_file.write('\t'.join([chrom,
-                                                 str(i),
-                                                 str(intergenic.start),
-                                                 str(intergenic.end),
-                                                 str(count),
-                                                ]) + '\n')
+        """
+        self.overlap_counter = overlap_counter
+        self.coordinate_sorted = coordinate_sorted
+        # query_name -> (aligned blocks, is_reverse) of the first mate seen
+        self.unpaired_reads = dict()
+        # (mate position, query_name) of each unpaired read, for eviction
+        self.unpaired_mate_positions = []
+        self.current_chrom = None
+        self.skipped_chromosomes = []
+
+    def add_read(self, read):
+        """
+        Count one aligned read, pairing it with its mate if the mate was already
+        seen.
+
+        Parameters
+        ----------
+        read : pysam.AlignedSegment
+            Aligned read.
+
+        """
+        # Use only uniquely mapped reads with both pairs mapped
+        if read.is_unmapped or not read.is_proper_pair or not read.get_tag("NH") == 1:
+            return
+
+        unpaired_reads = self.unpaired_reads
+        unpaired_mate_positions = self.unpaired_mate_positions
+        if self.coordinate_sorted:
+            # Proper pairs have both mates on the same chromosome, so unpaired
+            # reads from earlier chromosomes will never be paired.
+            if read.reference_name != self.current_chrom:
+                unpaired_reads.clear()
+                unpaired_mate_positions.clear()
+                self.current_chrom = read.reference_name
+            # Drop reads whose mates should have been seen by now.
+            while unpaired_mate_positions and unpaired_mate_positions[0][0] < read.reference_start:
+                unpaired_reads.pop(heapq.heappop(unpaired_mate_positions)[1], None)
+
+        try:
+            mate_blocks, mate_is_reverse = unpaired_reads.pop(read.query_name)
+        except KeyError:
+            # mate not cached for processing, so cache this one
+            unpaired_reads[read.query_name] = (read.get_blocks(), read.is_reverse)
+            if self.coordinate_sorted:
+                heapq.heappush(unpaired_mate_positions, (read.next_reference_start, read.query_name))
+            return
+
+        # Read is paired to its mate (now removed from the cache), so we
+        # process both together now
+
+        chrom = read.reference_name
+        # Check annotations are available for that chromosome
+        if chrom not in self.info.intergenics:
+            if chrom not in self.skipped_chromosomes:
+                print(f"Alignment from chromosome {chrom} skipped")
+                self.skipped_chromosomes.append(chrom)
+            return
+
+        # According to the SAM file specification, this CAN fail but I don't understand why it would
+        # so just throw this assert in to verify that it doesn't, at least for now
+        assert read.is_reverse != mate_is_reverse
+
+        # Figure out the fragment's strand - depends on whether the forward or reverse reads are 'sense'
+        read1_reverse_aligned = (read.is_reverse and read.is_read1) or (not read.is_reverse and read.is_read2)
+        if self.forward_read_is_sense:
+            strand = "-" if read1_reverse_aligned else "+"
+        else:
+            strand = "+" if read1_reverse_aligned else "-"
+        self.overlap_counter.add_fragment(chrom, strand,
+                                          itertools.chain(read.get_blocks(), mate_blocks))
+
+    def finish_counting(self):
+        """
+        Count any fragments still buffered by the overlap counter, once all reads
+        have been given to add_read().
+        """
+        self.overlap_counter.flush()
+        self.unpaired_reads = dict()
+        self.unpaired_mate_positions = []
 
     def get_commandline_call(self, aligned_file_path, output_directory, geneinfo_file_path):
         """
@@ -300,6 +683,7 @@ class IntronQuantificationStep(AbstractCampareeStep):
             Directory where the following output files will be saved:
             {CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME},
             {CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME},
+            {CAMPAREE_CONSTANTS.INTRON_OUTPUT_NPZ_FILENAME},
             {CAMPAREE_CONSTANTS.INTERGENIC_OUTPUT_FILENAME}.
         geneinfo_file_path : string
             Geneinfo file in BED format with 1-based, inclusive coordinates.
@@ -321,6 +705,8 @@ class IntronQuantificationStep(AbstractCampareeStep):
         intron_quant_params = {}
         intron_quant_params['forward_read_is_sense'] = self.forward_read_is_sense
         intron_quant_params['flank_size'] = self.flank_size
+        intron_quant_params['num_processes'] = self.num_processes
+        intron_quant_params['annotation_cache_directory_path'] = self.annotation_cache_directory_path
 
         command = (f"python {intron_quant_path}"
                    f" --log_directory_path {self.log_directory_path}"
@@ -347,6 +733,7 @@ class IntronQuantificationStep(AbstractCampareeStep):
             Directory where the following output files are saved:
             {CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME},
             {CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME},
+            {CAMPAREE_CONSTANTS.INTRON_OUTPUT_NPZ_FILENAME},
             {CAMPAREE_CONSTANTS.INTERGENIC_OUTPUT_FILENAME}.
         geneinfo_file_path : string
             Geneinfo file in BED format with 1-based, inclusive coordinates.
@@ -396,14 +783,61 @@ class IntronQuantificationStep(AbstractCampareeStep):
 
         output_directory = validation_attributes['output_directory']
 
-        #Check for the existence of the 3 output files.
+        #Check for the existence of the 4 output files.
         if os.path.isfile(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME)) and \
            os.path.isfile(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME)) and \
+           os.path.isfile(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_NPZ_FILENAME)) and \
            os.path.isfile(os.path.join(output_directory, CAMPAREE_CONSTANTS.INTERGENIC_OUTPUT_FILENAME)):
             valid_output = True
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by IntronQuantificationStep for a specific
+        job/execution, given the job's output directory. Prepare these attributes
+        for a given job using the get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            The job's output_directory.
+
+        Returns
+        -------
+        list
+            Paths to the intron (text and binary), antisense intron, and
+            intergenic quantification files.
+
+        """
+
+        output_directory = validation_attributes['output_directory']
+
+        return [os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME),
+                os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME),
+                os.path.join(output_directory, CAMPAREE_CONSTANTS.INTRON_OUTPUT_NPZ_FILENAME),
+                os.path.join(output_directory, CAMPAREE_CONSTANTS.INTERGENIC_OUTPUT_FILENAME)]
+
+
+def _initialize_worker(intron_quant, aligned_file_path):
+    """Store the step and BAM file used by _count_chromosome_reads() in each
+    worker process.
+    """
+    global _worker_intron_quant, _worker_aligned_file_path
+    _worker_intron_quant = intron_quant
+    _worker_aligned_file_path = aligned_file_path
+
+def _count_chromosome_reads(chrom):
+    """Count the fragments overlapping each region of the given chromosome, in
+    a worker process. Returns the counts in the format given by
+    RegionOverlapCounter.get_counts().
+    """
+    overlap_counter = RegionOverlapCounter(_worker_intron_quant.info)
+    with pysam.AlignmentFile(_worker_aligned_file_path, "rb") as alignments:
+        _worker_intron_quant.count_reads(alignments.fetch(chrom), overlap_counter)
+    return overlap_counter.get_counts(chrom)
+
 
 if __name__ == '__main__':
     sys.exit(IntronQuantificationStep.main())
@@ -5,6 +5,7 @@ import subprocess
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_utils import CampareeException
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.transcriptome_index_cache import TranscriptomeIndexCache
 from beers_utils.sample import Sample
 
 # TODO: Add support for additional command line arguments to pass to kallisto commands.
@@ -17,6 +18,8 @@ class KallistoIndexStep(AbstractCampareeStep):
     KALLISTO_INDEX_DIR_PATTERN = CAMPAREE_CONSTANTS.KALLISTO_INDEX_DIR_PATTERN
     KALLISTO_INDEX_FILENAME_PATTERN = CAMPAREE_CONSTANTS.KALLISTO_INDEX_FILENAME_PATTERN
     KALLISTO_INDEX_LOG_FILENAME_PATTERN = CAMPAREE_CONSTANTS.KALLISTO_INDEX_LOG_FILENAME_PATTERN
+    # Name under which the kallisto index file is stored in the index cache.
+    KALLISTO_INDEX_CACHE_FILENAME = "kallisto.index"
 
     #The basic kallisto command used to generate transcriptome indexes.
     BASE_KALLISTO_INDEX_COMMAND = ('{kallisto_bin_path} index'
@@ -33,13 +36,16 @@ class KallistoIndexStep(AbstractCampareeStep):
         log_directory_path : string
             Full path to log directory.
         parameters : dict
-            Dictionary of other parameters specified by the config file. This
-            parameter is not used by this class and is retained for uniformity
-            with all other CAMPAREE steps.
+            [Optional] Dictionary of other parameters specified by the config
+            file. The "index_cache_directory_path" entry points to a directory
+            where kallisto indexes are cached and shared across samples and
+            runs, keyed by the contents of the transcriptome FASTA. If omitted,
+            every index is built from scratch.
 
         """
         self.data_directory_path = data_directory_path
         self.log_directory_path = log_directory_path
+        self.index_cache_directory_path = parameters.get('index_cache_directory_path', None) if parameters else None
 
     def validate(self):
         return True
@@ -82,7 +88,8 @@ class KallistoIndexStep(AbstractCampareeStep):
                            f"    kallisto binary path: {kallisto_bin_path}\n"
                            f"    kallisto index directory: {kallisto_index_dir_path}\n"
                            f"    kallisto index file: {kallisto_index_file_path}\n"
-                           f"    input transcriptome FASTA: {transcriptome_fasta_path}\n")
+                           f"    input transcriptome FASTA: {transcriptome_fasta_path}\n"
+                           f"    kallisto index cache directory: {self.index_cache_directory_path}\n")
 
             log_file.write("Create kallisto index directory.\n")
             if os.path.isdir(kallisto_index_dir_path):
@@ -90,6 +97,22 @@ class KallistoIndexStep(AbstractCampareeStep):
             else:
                 os.mkdir(kallisto_index_dir_path)
 
+            # Reuse a previously built index if an identical transcriptome was
+            # already indexed by another sample, parental genome, or run.
+            index_cache = None
+            if self.index_cache_directory_path:
+                index_tool_version = TranscriptomeIndexCache.get_tool_version(kallisto_bin_path, "version")
+                index_cache = TranscriptomeIndexCache(self.index_cache_directory_path, index_type="kallisto",
+                                                      index_tool_version=index_tool_version)
+                cache_key = index_cache.get_cache_key(transcriptome_fasta_path)
+                cached_index_paths = {KallistoIndexStep.KALLISTO_INDEX_CACHE_FILENAME: kallisto_index_file_path}
+                log_file.write(f"kallisto index cache key: {cache_key}\n")
+                if index_cache.fetch(cache_key, cached_index_paths):
+                    print("Found matching kallisto index in the index cache.\n")
+                    log_file.write("Copied matching kallisto index from the index cache.\n")
+                    log_file.write("ALL DONE!\n")
+                    return
+
             kallisto_command = KallistoIndexStep.BASE_KALLISTO_INDEX_COMMAND.format(kallisto_bin_path=kallisto_bin_path,
                                                                                     kallisto_index_file=kallisto_index_file_path,
                                                                                     transcriptome_fasta=transcriptome_fasta_path)
@@ -117,6 +140,11 @@ class KallistoIndexStep(AbstractCampareeStep):
             print("Finished generating kallisto index.\n")
             log_file.write(f"{kallisto_result.stdout}\n")
             log_file.write("Finished generating kallisto index.\n")
+
+            if index_cache:
+                index_cache.store(cache_key, cached_index_paths)
+                log_file.write("Stored kallisto index in the index cache.\n")
+
             log_file.write("ALL DONE!\n")
 
     def get_commandline_call(self, sample_id, genome_suffix, kallisto_bin_path, transcriptome_fasta_path):
@@ -161,6 +189,9 @@ class KallistoIndexStep(AbstractCampareeStep):
                    f" --kallisto_bin_path {kallisto_bin_path}"
                    f" --transcriptome_fasta_file_path {transcriptome_fasta_path}")
 
+        if self.index_cache_directory_path:
+            command += f" --index_cache_directory_path {self.index_cache_directory_path}"
+
         return command
 
     def get_validation_attributes(self, sample_id, genome_suffix, kallisto_bin_path, transcriptome_fasta_path):
@@ -249,14 +280,48 @@ class KallistoIndexStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by KallistoIndexStep for a specific
+        job/execution, given a job's data directory, log directory, sample ID, and
+        genome suffix. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, corresponding sample_id, and
+            genome_suffix used when creating the kallisto index.
+
+        Returns
+        -------
+        list
+            Paths to the kallisto index file and log file.
+
+        """
+
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_suffix = validation_attributes['genome_suffix']
+
+        return [os.path.join(data_directory_path, f'sample{sample_id}',
+                             KallistoIndexStep.KALLISTO_INDEX_DIR_PATTERN.format(genome_name=genome_suffix),
+                             KallistoIndexStep.KALLISTO_INDEX_FILENAME_PATTERN.format(genome_name=genome_suffix)),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             KallistoIndexStep.KALLISTO_INDEX_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix))]
+
     @staticmethod
     def main(cmd_args):
         """
         Entry point into class. Used when script is executed/submitted via the
         command line with the 'index' subcommand.
         """
+        parameters = {'index_cache_directory_path': cmd_args.index_cache_directory_path}
         kallisto_index = KallistoIndexStep(log_directory_path=cmd_args.log_directory_path,
-                                           data_directory_path=cmd_args.data_directory_path)
+                                           data_directory_path=cmd_args.data_directory_path,
+                                           parameters=parameters)
         kallisto_index.execute(sample_id=cmd_args.sample_id,
                                genome_suffix=cmd_args.genome_suffix,
                                kallisto_bin_path=cmd_args.kallisto_bin_path,
@@ -487,6 +552,38 @@ class KallistoQuantStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by KallistoQuantStep for a specific
+        job/execution, given a job's data directory, log directory, sample ID, and
+        genome suffix. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, corresponding sample_id, and
+            genome_suffix used when generating transcript-level quantifications.
+
+        Returns
+        -------
+        list
+            Paths to the kallisto abundance file and log file.
+
+        """
+
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_suffix = validation_attributes['genome_suffix']
+
+        return [os.path.join(data_directory_path, f'sample{sample_id}',
+                             KallistoQuantStep.KALLISTO_QUANT_DIR_PATTERN.format(genome_name=genome_suffix),
+                             KallistoQuantStep.KALLISTO_ABUNDANCE_FILENAME),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             KallistoQuantStep.KALLISTO_QUANT_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix))]
+
     @staticmethod
     def main(cmd_args):
         """
@@ -532,6 +629,9 @@ if __name__ == '__main__':
                                                          help='Full path to kallisto executable binary')
     required_named_kallisto_index_subparser.add_argument('--transcriptome_fasta_file_path', required=True,
                                                          help='Input transcriptome in FASTA format.')
+    kallisto_index_subparser.add_argument('--index_cache_directory_path', required=False, default=None,
+                                          help='Directory where kallisto indexes are cached and shared '
+                                               'across samples and runs.')
 
     #Setup arguments from the quantification subcommand
     kallisto_quant_subparser = subparsers.add_parser('quant', help="Run kallisto transcript-level quantification.",
@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import subprocess
+
+from camparee.camparee_utils import CampareeException
+
+class LocalJobMonitor:
+    """Runs pipeline jobs concurrently on the local machine, using a bounded pool
+    of processors and memory.
+
+    Provides the subset of the JobMonitor interface used by the ExpressionPipeline,
+    so it can be used in its place when CAMPAREE runs in the "local" scheduler
+    mode. Jobs are started as soon as all of the jobs they depend on have
+    completed and enough processors and memory are free to satisfy the job's
+    resource request. Each job's num_processors and memory_in_mb (either the
+    step-specific overrides or the defaults from the config file) are treated as
+    tokens drawn from the pool for as long as the job runs. Jobs requesting more
+    than the entire pool are capped at the size of the pool, so they run on their
+    own rather than never starting.
+
+    Once a job exits, its output is checked with the step's is_output_valid()
+    method. Failed jobs are resubmitted up to the given limit, after which all
+    running jobs are stopped and the run is halted.
+
+    """
+
+    SCHEDULER_NAME = "local"
+
+    # Number of seconds between checks of the running jobs.
+    POLL_INTERVAL = 1
+
+    def __init__(self, output_directory_path, max_processors=None, max_memory_in_mb=None,
+                 default_num_processors=None, default_memory_in_mb=None, max_resub_limit=3,
+                 job_completed_callback=None):
+        """Constructor for LocalJobMonitor object.
+
+        Parameters
+        ----------
+        output_directory_path : string
+            Path to the output directory of the CAMPAREE run.
+        max_processors : int
+            [Optional] Number of processors jobs may use at once. [DEFAULT: number
+            of processors on this machine]
+        max_memory_in_mb : int
+            [Optional] Amount of memory (in Mb) jobs may use at once. If not given,
+            jobs are only limited by the number of processors.
+        default_num_processors : int
+            [Optional] Number of processors reserved for jobs that do not specify
+            their own. [DEFAULT: 1]
+        default_memory_in_mb : int
+            [Optional] Amount of memory (in Mb) reserved for jobs that do not
+            specify their own. [DEFAULT: 0]
+        max_resub_limit : int
+            Maximum number of times a failed job is resubmitted before the run
+            halts.
+        job_completed_callback : function
+            [Optional] Called with the job ID of each job as soon as it completes
+            with valid output.
+
+        """
+        self.output_directory_path = output_directory_path
+        self.max_processors = max_processors if max_processors else os.cpu_count()
+        self.max_memory_in_mb = max_memory_in_mb
+        self.default_num_processors = default_num_processors if default_num_processors else 1
+        self.default_memory_in_mb = default_memory_in_mb if default_memory_in_mb else 0
+        self.max_resub_limit = max_resub_limit
+        self.job_completed_callback = job_completed_callback
+        self.pipeline_steps = {}
+        # Jobs in the order they were submitted. Completed jobs are kept, so later
+        # jobs may depend on them.
+        self.jobs = {}
+        self.pending_job_ids = []
+        self.running_jobs = {}
+        self.completed_job_ids = set()
+        self.available_processors = self.max_processors
+        self.available_memory_in_mb = self.max_memory_in_mb
+
+    def add_pipeline_step(self, step_name, step_class):
+        """Register the class of a pipeline step, used to validate job output.
+
+        Parameters
+        ----------
+        step_name : string
+            Name of the pipeline step.
+        step_class : class
+            Class implementing the step. Must provide a static is_output_valid()
+            method.
+
+        """
+        self.pipeline_steps[step_name] = step_class
+
+    def submit_new_job(self, job_id, job_command, sample, step_name, scheduler_arguments,
+                       validation_attributes, output_directory_path, system_id=None,
+                       dependency_list=None):
+        """Add a job to the queue. The job starts once its dependencies have
+        completed and resources are available. The parameters match those of the
+        JobMonitor's submit_new_job() method.
+
+        Parameters
+        ----------
+        job_id : string
+            Unique identifier for the job.
+        job_command : string
+            Command line call that runs the job.
+        sample : Sample
+            Sample associated with the job, or None.
+        step_name : string
+            Name of the pipeline step run by the job.
+        scheduler_arguments : dict
+            Names of the stdout/stderr log files, and the number of processors
+            and memory (in Mb) requested by the job.
+        validation_attributes : dict
+            Attributes passed to the step's is_output_valid() method.
+        output_directory_path : string
+            Directory where the job writes its output.
+        system_id : string
+            Unused. Accepted for compatibility with the JobMonitor.
+        dependency_list : list
+            IDs of jobs that must complete before this job starts.
+
+        """
+        if step_name not in self.pipeline_steps:
+            raise LocalJobMonitorException(f"{step_name} is not a registered pipeline step.")
+        if job_id in self.jobs:
+            raise LocalJobMonitorException(f"A job with the ID {job_id} was already submitted.")
+        dependency_list = dependency_list if dependency_list else []
+        for dependency in dependency_list:
+            if dependency not in self.jobs:
+                raise LocalJobMonitorException(f"{job_id} depends on {dependency}, which was never submitted.")
+
+        num_processors = scheduler_arguments.get('num_processors') or self.default_num_processors
+        memory_in_mb = scheduler_arguments.get('memory_in_mb') or self.default_memory_in_mb
+        self.jobs[job_id] = {'job_command': job_command,
+                             'step_name': step_name,
+                             'stdout_logfile': scheduler_arguments['stdout_logfile'],
+                             'stderr_logfile': scheduler_arguments['stderr_logfile'],
+                             'num_processors': min(num_processors, self.max_processors),
+                             'memory_in_mb': min(memory_in_mb, self.max_memory_in_mb)
+                                             if self.max_memory_in_mb else memory_in_mb,
+                             'validation_attributes': validation_attributes,
+                             'dependency_list': dependency_list,
+                             'resubmission_count': 0}
+        self.pending_job_ids.append(job_id)
+
+    def monitor_until_all_jobs_completed(self, queue_update_interval=10):
+        """Start and monitor jobs until every submitted job has completed. If
+        monitoring stops early (e.g. on a KeyboardInterrupt, or because a job
+        failed too many times), all running jobs are stopped.
+
+        Parameters
+        ----------
+        queue_update_interval : int
+            Number of seconds between reports of the number of pending, running,
+            and completed jobs.
+
+        """
+        last_update_time = 0
+        try:
+            while self.pending_job_ids or self.running_jobs:
+                self._check_running_jobs()
+                self._start_ready_jobs()
+                if not self.running_jobs and self.pending_job_ids:
+                    # Every resource is free, so the remaining jobs are waiting
+                    # on dependencies that will never complete.
+                    waiting_jobs = [f"{job_id} (waiting on {', '.join(self._get_unmet_dependencies(job_id))})"
+                                    for job_id in self.pending_job_ids]
+                    raise LocalJobMonitorException(f"The following jobs can never start, since they depend "
+                                                   f"on jobs that will never complete: {', '.join(waiting_jobs)}")
+                if time.time() - last_update_time >= queue_update_interval:
+                    print(f"Jobs pending: {len(self.pending_job_ids)}, running: {len(self.running_jobs)}, "
+                          f"completed: {len(self.completed_job_ids)} "
+                          f"({self.max_processors - self.available_processors}/{self.max_processors} processors in use)",
+                          file=sys.stderr)
+                    last_update_time = time.time()
+                if self.pending_job_ids or self.running_jobs:
+                    time.sleep(LocalJobMonitor.POLL_INTERVAL)
+        except BaseException:
+            self._terminate_running_jobs()
+            raise
+
+    def _get_unmet_dependencies(self, job_id):
+        """Return the IDs of the jobs the given job depends on that have not
+        completed.
+        """
+        return [dependency for dependency in self.jobs[job_id]['dependency_list']
+                if dependency not in self.completed_job_ids]
+
+    def _start_ready_jobs(self):
+        """Start pending jobs, in the order they were submitted, whose dependencies
+        have completed and whose resource requests fit in the available pool.
+        """
+        for job_id in list(self.pending_job_ids):
+            job = self.jobs[job_id]
+            if self._get_unmet_dependencies(job_id):
+                continue
+            if job['num_processors'] > self.available_processors:
+                continue
+            if self.max_memory_in_mb and job['memory_in_mb'] > self.available_memory_in_mb:
+                continue
+            self.pending_job_ids.remove(job_id)
+            self.available_processors -= job['num_processors']
+            if self.max_memory_in_mb:
+                self.available_memory_in_mb -= job['memory_in_mb']
+            with open(job['stdout_logfile'], 'w') as stdout_log, open(job['stderr_logfile'], 'w') as stderr_log:
+                self.running_jobs[job_id] = subprocess.Popen(job['job_command'], shell=True,
+                                                             stdout=stdout_log, stderr=stderr_log)
+            print(f"Started {job_id}.", file=sys.stderr)
+
+    def _check_running_jobs(self):
+        """Release the resources of jobs that exited, and either mark them as
+        completed or resubmit them if their output is invalid.
+        """
+        for job_id, process in list(self.running_jobs.items()):
+            if process.poll() is None:
+                continue
+            del self.running_jobs[job_id]
+            job = self.jobs[job_id]
+            self.available_processors += job['num_processors']
+            if self.max_memory_in_mb:
+                self.available_memory_in_mb += job['memory_in_mb']
+
+            step_class = self.pipeline_steps[job['step_name']]
+            if process.returncode == 0 and step_class.is_output_valid(job['validation_attributes']):
+                self.completed_job_ids.add(job_id)
+                print(f"Completed {job_id}.", file=sys.stderr)
+                if self.job_completed_callback:
+                    self.job_completed_callback(job_id)
+            elif job['resubmission_count'] < self.max_resub_limit:
+                job['resubmission_count'] += 1
+                print(f"{job_id} failed (exit code {process.returncode}). Resubmitting "
+                      f"({job['resubmission_count']} of {self.max_resub_limit}).", file=sys.stderr)
+                self.pending_job_ids.insert(0, job_id)
+            else:
+                self._terminate_running_jobs()
+                raise LocalJobMonitorException(f"{job_id} failed and exceeded the resubmission limit "
+                                               f"of {self.max_resub_limit}. See {job['stderr_logfile']} "
+                                               f"for details.")
+
+    def _terminate_running_jobs(self):
+        """Stop all running jobs and wait for them to exit.
+        """
+        for process in self.running_jobs.values():
+            process.terminate()
+        for process in self.running_jobs.values():
+            process.wait()
+        self.running_jobs = {}
+
+
+class LocalJobMonitorException(CampareeException):
+    pass
@@ -4,11 +4,14 @@ import pathlib
 import sys
 import collections
 import argparse
+import bisect
+import multiprocessing
 import numpy
 import pickle
 
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeUtils, CampareeException
 
 from beers_utils.molecule_packet import MoleculePacket
 from beers_utils.molecule import Molecule
@@ -17,6 +20,100 @@ from beers_utils.cigar import chain_from_splits, split_cigar, query_seq_length
 from beers_utils.general_utils import GeneralUtils
 from beers_utils.read_fasta import read_fasta
 
+class MoleculeSampler:
+    """
+    Draws the transcript, allele, pre-mRNA status and polyA tail length of
+    batches of molecules from the gene, isoform, allelic imbalance and intron
+    distributions.
+
+    The distributions are converted to cumulative arrays once, so a batch of
+    molecules takes a few vectorized draws (uniform values mapped through
+    numpy.searchsorted) rather than several rng.choice() calls per molecule.
+    """
+
+    def __init__(self, genes, gene_quants, isoform_quants, allelic_quant, transcript_intron_quants,
+                 min_polyA_tail_length, max_polyA_tail_length):
+        """
+        :param genes: list of gene IDs
+        :param gene_quants: array of the read quantification of each gene
+        :param isoform_quants: dictionary gene -> (list of transcript IDs, list of psi values)
+        :param allelic_quant: dictionary gene -> (allele 1 probability, allele 2 probability)
+        :param transcript_intron_quants: dictionary transcript ID -> FPK of all introns in the transcript
+        :param min_polyA_tail_length: minimum length of the polyA tails
+        :param max_polyA_tail_length: maximum length of the polyA tails
+        """
+        self.min_polyA_tail_length = min_polyA_tail_length
+        self.max_polyA_tail_length = max_polyA_tail_length
+        self.gene_cumulative_probabilities = MoleculeSampler.get_cumulative_probabilities(gene_quants)
+
+        # Isoforms of all genes, listed gene by gene. The cumulative probability
+        # of each isoform within its gene is offset by the gene's index, so the
+        # isoforms of all genes can be searched at once.
+        self.transcripts = []
+        isoform_cumulative_probabilities = []
+        self.gene_isoform_ends = numpy.zeros(len(genes), dtype=numpy.int64)
+        self.allele1_probabilities = numpy.full(len(genes), 0.5)
+        fractions_pre_mRNA = []
+        for gene_index, (gene, gene_quant) in enumerate(zip(genes, gene_quants.tolist())):
+            # Genes with no expression are never drawn, and may be missing from
+            # the other distributions.
+            if gene_quant > 0:
+                transcripts, psis = isoform_quants[gene]
+                if sum(psis) <= 0:
+                    raise MoleculeMakerException(f"Gene {gene} is expressed, but none of its isoforms are.")
+                allele1_quant, allele2_quant = allelic_quant[gene]
+                self.allele1_probabilities[gene_index] = allele1_quant / (allele1_quant + allele2_quant)
+                self.transcripts.extend(transcripts)
+                isoform_cumulative_probabilities.append(
+                    gene_index + MoleculeSampler.get_cumulative_probabilities(numpy.array(psis)))
+                # TODO: check that this gives the appropriate fraction as pre_mRNA
+                #       previously was using intron_quant / (intron_quant + gene_quant)
+                #       but if assuming everything is either full pre_mRNA or mature mRNA then this should be
+                #       the right fraction, which could happen to be greater than one (!)
+                # Transcripts without quantified introns are always mature mRNA.
+                fractions_pre_mRNA.extend(min(transcript_intron_quants.get(transcript, 0.0) / gene_quant, 1)
+                                          for transcript in transcripts)
+            self.gene_isoform_ends[gene_index] = len(self.transcripts)
+        self.isoform_cumulative_probabilities = numpy.concatenate(isoform_cumulative_probabilities + [[]])
+        self.fractions_pre_mRNA = numpy.array(fractions_pre_mRNA)
+
+    @staticmethod
+    def get_cumulative_probabilities(weights):
+        """
+        Cumulative probabilities of drawing each index of the given non-negative
+        weights, ending at exactly 1. An index is drawn by finding a uniform
+        value from [0, 1) with numpy.searchsorted(..., side="right"), which never
+        returns indices with zero weight.
+        """
+        cumulative_probabilities = numpy.cumsum(weights, dtype=float)
+        cumulative_probabilities /= cumulative_probabilities[-1]
+        # Rounding may leave the final sums slightly off from 1.
+        cumulative_probabilities[numpy.flatnonzero(weights)[-1]:] = 1.0
+        return cumulative_probabilities
+
+    def sample(self, rng, N):
+        """
+        Draw a batch of molecules.
+
+        :param rng: numpy Generator used for all random draws
+        :param N: number of molecules to draw
+        :return: tuple of arrays giving, for each molecule, the index of its
+                 transcript in self.transcripts, its allele number (1 or 2),
+                 whether it is pre-mRNA, and the length of its polyA tail
+        """
+        gene_draws, isoform_draws, allele_draws, pre_mRNA_draws = rng.random((4, N))
+        gene_indices = numpy.searchsorted(self.gene_cumulative_probabilities, gene_draws, side="right")
+        transcript_indices = numpy.searchsorted(self.isoform_cumulative_probabilities, gene_indices + isoform_draws,
+                                                side="right")
+        # Adding a draw close to 1 to a large gene index may round up to the
+        # next gene.
+        transcript_indices = numpy.minimum(transcript_indices, self.gene_isoform_ends[gene_indices] - 1)
+        allele_numbers = numpy.where(allele_draws < self.allele1_probabilities[gene_indices], 1, 2)
+        pre_mRNA = pre_mRNA_draws < self.fractions_pre_mRNA[transcript_indices]
+        polyA_lengths = rng.integers(self.min_polyA_tail_length, self.max_polyA_tail_length + 1, size=N)
+        return transcript_indices, allele_numbers, pre_mRNA, polyA_lengths
+
+
 class MoleculeMakerStep(AbstractCampareeStep):
     """
     MoleculeMaker generates molecules based off of gene, intron, and allelic
@@ -37,6 +134,13 @@ class MoleculeMakerStep(AbstractCampareeStep):
     _PARENTAL_GENOME_FASTA_FILENAME_PATTERN=CAMPAREE_CONSTANTS.GENOMEBUILDER_SEQUENCE_FILENAME_PATTERN
     _PARENTAL_GENOME_INDEL_FILENAME_PATTERN=CAMPAREE_CONSTANTS.GENOMEBUILDER_INDEL_FILENAME_PATTERN
 
+    # Number of molecules drawn from the MoleculeSampler at a time.
+    SAMPLING_BATCH_SIZE = 100_000
+    # Default maximum number of molecule templates cached. Pre-mRNA templates
+    # can hold long sequences, so this bounds the memory used by the cache.
+    DEFAULT_TEMPLATE_CACHE_SIZE = 5_000
+    MOLECULE_FILE_HEADER = "#transcript_id\tchrom\tstart\tcigar\tref_start\tref_cigar\tstrand\tsequence\n"
+
     def __init__(self, log_directory_path, data_directory_path=None, parameters=None):
         """Constructor for MoleculeMakerStep object.
 
@@ -54,6 +158,18 @@ class MoleculeMakerStep(AbstractCampareeStep):
         self.data_directory_path = data_directory_path
         self.min_polyA_tail_length = parameters.get("min_polyA_tail_length", 50)
         self.max_polyA_tail_length = parameters.get("max_polyA_tail_length", 250)
+        # Generate the molecules of each transcript together, building each
+        # distinct molecule once and copying it. Molecules are then output
+        # grouped by transcript instead of in random order.
+        self.group_molecules_by_transcript = parameters.get("group_molecules_by_transcript", False)
+        # Maximum number of molecule templates (see get_molecule_template()) to keep.
+        self.template_cache_size = parameters.get("template_cache_size", self.DEFAULT_TEMPLATE_CACHE_SIZE)
+        self.template_cache = collections.OrderedDict()
+        self.template_cache_hits = 0
+        self.template_cache_misses = 0
+        # Number of worker processes used to generate separate packets (or
+        # chunks of the molecule file) in parallel.
+        self.num_processes = parameters.get("num_processes", 1)
         self.parameters = parameters
 
     # Nearly all of the validation for this step is already performed in the
@@ -66,6 +182,8 @@ class MoleculeMakerStep(AbstractCampareeStep):
             return False
         if (self.max_polyA_tail_length < 0):
             return False
+        if (self.num_processes < 1):
+            return False
         return True
 
     def load_annotation(self, file_path):
@@ -146,12 +264,84 @@ class MoleculeMakerStep(AbstractCampareeStep):
 
         return results
 
+    def index_genome_cigar(self, genome_cigar_split):
+        """
+        Index a chromosome's split cigar from load_indels() by the positions at
+        which each of its operations starts, so the operations overlapping a
+        region can be found by binary search.
+
+        Returns a tuple of the split cigar, the list of 1-based positions in the
+        custom genome at which each operation starts, and the list of positions
+        in the reference genome at which each operation starts.
+        """
+        genome_starts = []
+        reference_starts = []
+        genome_position = 1
+        reference_position = 1
+        for op, length in genome_cigar_split:
+            genome_starts.append(genome_position)
+            reference_starts.append(reference_position)
+            if op == 'M':
+                genome_position += length
+                reference_position += length
+            elif op == 'I':
+                genome_position += length
+            elif op == 'D':
+                reference_position += length
+        return genome_cigar_split, genome_starts, reference_starts
+
+    def lift_over(self, allele_number, chrom, start, end, cigar_split, strand):
+        """
+        Find the start and cigar string, relative to the reference genome, of a
+        molecule aligned to a custom genome. This chains the molecule's alignment
+        with only the operations of the chromosome's indel cigar that overlap
+        the molecule, rather than the whole chromosome's cigar.
+
+        :param allele_number: custom genome (1 or 2) the molecule is aligned to
+        :param chrom: chromosome the molecule is aligned to
+        :param start: start of the molecule in the custom genome
+        :param end: end of the molecule in the custom genome
+        :param cigar_split: split cigar of the molecule's alignment to the custom genome
+        :param strand: strand of the molecule
+        :return: tuple of the start and cigar string relative to the reference genome
+        """
+        genome_cigar_split, genome_starts, reference_starts = self.genome_cigar_indexes[allele_number - 1][chrom]
+        # Operations containing the molecule's start and end, extended out to the
+        # nearest matches so the indels next to the molecule are included.
+        first = bisect.bisect_right(genome_starts, start) - 1
+        while first > 0 and genome_cigar_split[first][0] != 'M':
+            first -= 1
+        last = bisect.bisect_right(genome_starts, end)
+        while last < len(genome_cigar_split) - 1 and genome_cigar_split[last][0] != 'M':
+            last += 1
+        # Chain against the slice of operations as an alignment of the custom
+        # genome starting from the first operation's position.
+        ref_start, ref_cigar, _ = chain_from_splits(
+                start - genome_starts[first] + 1, cigar_split, strand,
+                reference_starts[first], genome_cigar_split[first:last + 1], "+"
+        )
+        return ref_start, ref_cigar
+
     def load_intron_quants(self, file_path):
         """
         Load an intron quantification file as two dictionaries,
         (transcript ID -> sum FPK of all introns in transcript) and
         (transcript ID -> list of FPKs of each intron in transcript)
+
+        If the binary copy of the file written by the IntronQuantificationStep
+        is in the same directory, and was written alongside this exact file, it
+        is loaded instead, which avoids parsing the text file.
         """
+        npz_file_path = os.path.join(os.path.dirname(file_path), CAMPAREE_CONSTANTS.INTRON_OUTPUT_NPZ_FILENAME)
+        # The binary copy records the digest of its text file, so a text file
+        # replaced after the binary file was written (e.g. user-provided intron
+        # quantifications) takes precedence.
+        if os.path.isfile(npz_file_path):
+            intron_quants = self.load_intron_quants_npz(npz_file_path,
+                                                        CampareeUtils.compute_file_digest(file_path))
+            if intron_quants is not None:
+                return intron_quants
+
         transcript_intron_quants = dict() # Dictionary transcript -> FPK for all introns in the transcript, combined
         intron_quants = dict() # Dictioanry transcript -> array of FPKs for each intron in the transcript
 
@@ -168,6 +358,32 @@ class MoleculeMakerStep(AbstractCampareeStep):
 
         return transcript_intron_quants, intron_quants
 
+    def load_intron_quants_npz(self, file_path, text_file_digest):
+        """
+        Load the binary copy of an intron quantification file, written by the
+        IntronQuantificationStep, as the same two dictionaries returned by
+        load_intron_quants().
+
+        :param file_path: path to the binary (.npz) copy
+        :param text_file_digest: digest (see CampareeUtils.compute_file_digest()) of the
+                                 intron quantification file the copy should match
+        :return: the two dictionaries, or None if the binary copy was not written
+                 alongside a text file with the given digest
+        """
+        with numpy.load(file_path) as intron_quants_file:
+            if 'text_file_digest' not in intron_quants_file.files or \
+               str(intron_quants_file['text_file_digest']) != text_file_digest:
+                return None
+            transcripts = intron_quants_file['transcript_ids'].tolist()
+            transcript_intron_reads_FPK = intron_quants_file['transcript_intron_reads_FPK'].tolist()
+            intron_offsets = intron_quants_file['intron_offsets'].tolist()
+            intron_reads_FPK = intron_quants_file['intron_reads_FPK'].tolist()
+
+        transcript_intron_quants = dict(zip(transcripts, transcript_intron_reads_FPK))
+        intron_quants = {transcript: intron_reads_FPK[intron_offsets[index]:intron_offsets[index + 1]]
+                         for index, transcript in enumerate(transcripts)}
+        return transcript_intron_quants, intron_quants
+
     def load_gene_quants(self, file_path):
         """
         Read in a gene quantification file as two lists of gene IDs and of their read quantifications
@@ -228,36 +444,94 @@ class MoleculeMakerStep(AbstractCampareeStep):
                 allelic_quant[gene] = (allele1, allele2)
         return allelic_quant
 
+    def make_molecules(self, sample, rng, N):
+        """
+        Generate N molecules, drawing them from the MoleculeSampler in batches.
+        Yields the same tuples as make_molecule().
+        """
+        for batch_start in range(0, N, MoleculeMakerStep.SAMPLING_BATCH_SIZE):
+            batch_size = min(MoleculeMakerStep.SAMPLING_BATCH_SIZE, N - batch_start)
+            transcript_indices, allele_numbers, pre_mRNA, polyA_lengths = self.molecule_sampler.sample(rng, batch_size)
+            if not self.group_molecules_by_transcript:
+                for transcript_index, allele_number, is_pre_mRNA, polyA_length \
+                        in zip(transcript_indices.tolist(), allele_numbers.tolist(), pre_mRNA.tolist(),
+                               polyA_lengths.tolist()):
+                    template = self.get_molecule_template(sample, self.molecule_sampler.transcripts[transcript_index],
+                                                          allele_number, is_pre_mRNA)
+                    yield self.add_polyA_tail(template, polyA_length)
+                continue
+
+            # Tally the molecules drawn for each distinct (transcript, allele,
+            # pre_mRNA) key, which gives the key's multinomial count. Then build
+            # the molecule for each key once and emit copies of it, each with its
+            # own polyA tail.
+            keys = (transcript_indices * 2 + allele_numbers - 1) * 2 + pre_mRNA
+            key_order = numpy.argsort(keys, kind="stable")
+            unique_keys, key_starts, key_counts = numpy.unique(keys[key_order], return_index=True,
+                                                               return_counts=True)
+            polyA_lengths = polyA_lengths[key_order].tolist()
+            for key, key_start, key_count in zip(unique_keys.tolist(), key_starts.tolist(), key_counts.tolist()):
+                template = self.get_molecule_template(sample, self.molecule_sampler.transcripts[key // 4],
+                                                      key // 2 % 2 + 1, bool(key % 2))
+                for polyA_length in polyA_lengths[key_start:key_start + key_count]:
+                    yield self.add_polyA_tail(template, polyA_length)
+
     def make_molecule(self, sample, rng):
-        # Pick random gene
-        gene_index = rng.choice(len(self.genes), p=self.gene_probabilities)
-        gene = self.genes[gene_index]
-        gene_quant = self.gene_quants[gene_index]
+        """
+        Generate a single molecule. Returns its sequence, start, cigar, start and
+        cigar relative to the reference genome, strand, chromosome and transcript ID.
+        """
+        return next(self.make_molecules(sample, rng, 1))
 
-        # Pick random transcript in gene
-        transcripts, psis = self.isoform_quants[gene]
-        transcript = rng.choice(transcripts, p=psis)
+    def build_molecule(self, sample, transcript, allele_number, pre_mRNA, polyA_length):
+        """
+        Build the sequence and alignments of a molecule of the given transcript.
+
+        :param sample: sample the molecule is generated for
+        :param transcript: transcript ID
+        :param allele_number: parental genome (1 or 2) the molecule comes from
+        :param pre_mRNA: whether the molecule is pre-mRNA (i.e. unspliced)
+        :param polyA_length: length of the polyA tail added to the molecule
+        :return: tuple of the molecule's sequence, start, cigar, start and cigar
+                 relative to the reference genome, strand, chromosome and
+                 transcript ID
+        """
+        return self.add_polyA_tail(self.build_molecule_template(sample, transcript, allele_number, pre_mRNA),
+                                   polyA_length)
 
-        # Pick random allele based on the gene's allelic distribution
-        allele_number = rng.choice([1,2], p=self.allelic_quant[gene])
+    def get_molecule_template(self, sample, transcript, allele_number, pre_mRNA):
+        """
+        Return the molecule template built by build_molecule_template(), reusing
+        it from the cache of the most recently used templates if possible.
+        Counts cache hits and misses in self.template_cache_hits and
+        self.template_cache_misses.
+        """
+        key = (sample.sample_id, transcript, allele_number, pre_mRNA)
+        try:
+            template = self.template_cache[key]
+        except KeyError:
+            self.template_cache_misses += 1
+            template = self.build_molecule_template(sample, transcript, allele_number, pre_mRNA)
+            if self.template_cache_size > 0:
+                self.template_cache[key] = template
+                if len(self.template_cache) > self.template_cache_size:
+                    self.template_cache.popitem(last=False)
+            return template
+        self.template_cache_hits += 1
+        self.template_cache.move_to_end(key)
+        return template
+
+    def build_molecule_template(self, sample, transcript, allele_number, pre_mRNA):
+        """
+        Build the sequence and alignments of a molecule of the given transcript,
+        without its polyA tail. These are the same for all molecules with the
+        same transcript, allele and pre_mRNA status.
 
+        :return: tuple of the same form as build_molecule()
+        """
         # Read in annotation for the chosen transcript
         chrom,strand,tx_start,tx_end,starts,ends= self.annotations[allele_number - 1][transcript]
 
-        # Determine if pre_mRNA or mature mRNA
-        intron_quant = self.transcript_intron_quants[transcript]
-        # TODO: check that this gives the appropriate fraction as pre_mRNA
-        #       previously was using intron_quant / (intron_quant + gene_quant)
-        #       but if assuming everything is either full pre_mRNA or mature mRNA then this should be
-        #       the right fraction, which could happen to be greater than one (!)
-        try:
-            fraction_pre_mRNA = min(intron_quant / (gene_quant), 1)
-        except ZeroDivisionError:
-            # Should not ever get here since a gene with 0 gene_quant should have 0 chance of being chosen
-            # however, if we do, we will just always give pre_mRNA
-            fraction_pre_mRNA = 1.0
-
-        pre_mRNA = rng.uniform() < fraction_pre_mRNA
         if pre_mRNA:
             # If chosen to be pre_mRNA, overwrite the usual exon starts/ends with a single, big "exon"
             starts = [tx_start]
@@ -269,10 +543,7 @@ class MoleculeMakerStep(AbstractCampareeStep):
                     + f"{ends[-1] - starts[-1] + 1}M"
 
         cigar_split = split_cigar(cigar)
-        ref_start, ref_cigar, _ = chain_from_splits(
-                starts[0], cigar_split, strand,
-                1, self.genome_cigar_splits[allele_number - 1][chrom], "+"
-        )
+        ref_start, ref_cigar = self.lift_over(allele_number, chrom, starts[0], ends[-1], cigar_split, strand)
 
         transcript_id = f"{sample.sample_id}_{transcript}_{allele_number}{'_pre_mRNA' if pre_mRNA else ''}"
 
@@ -287,12 +558,22 @@ class MoleculeMakerStep(AbstractCampareeStep):
             sequence = GeneralUtils.create_complement_strand(sequence)
             # NOTE: cigar string stays the same since that is relative to the + strand
 
+        return sequence, starts[0], cigar, ref_start, ref_cigar, strand, chrom, transcript_id
+
+    def add_polyA_tail(self, template, polyA_length):
+        """
+        Add a polyA tail to a molecule built by build_molecule_template().
+
+        :param template: tuple returned by build_molecule_template()
+        :param polyA_length: length of the polyA tail
+        :return: tuple of the same form, for the molecule with the polyA tail
+        """
+        sequence, start, cigar, ref_start, ref_cigar, strand, chrom, transcript_id = template
+
         # TODO: for now, everything gets polyA but maybe shouldn't
         polyA_tail = True
         if polyA_tail:
-            # TODO: polyA tails should vary in length
             # Add polyA tail to 3' end
-            polyA_length = rng.integers(self.min_polyA_tail_length, self.max_polyA_tail_length + 1)
             sequence = sequence + "A"*polyA_length
             # Soft-clip the polyA tail at the end since it shouldn't align
             if strand == "+":
@@ -302,15 +583,21 @@ class MoleculeMakerStep(AbstractCampareeStep):
                 cigar =   f"{polyA_length}S" + cigar # Relative to + strand, the A's are going on the 5' end
                 ref_cigar = f"{polyA_length}S" + ref_cigar
 
+        return sequence, start, cigar, ref_start, ref_cigar, strand, chrom, transcript_id
 
-        return sequence, starts[0], cigar, ref_start, ref_cigar, strand, chrom, transcript_id
+    def make_packet(self, sample, rng, id="packet0", N=10_000, first_molecule_number=1):
+        """
+        Make a packet of N molecules.
 
-    def make_packet(self, sample, rng, id="packet0", N=10_000):
+        Molecule IDs are numbered consecutively from first_molecule_number,
+        rather than with Molecule.new_id(), so they do not depend on which
+        process generated the packet.
+        """
         molecules = []
-        for i in range(N):
-            sequence, start, cigar, ref_start, ref_cigar, strand, chrom, transcript_id = self.make_molecule(sample, rng)
+        for molecule_number, (sequence, start, cigar, ref_start, ref_cigar, strand, chrom, transcript_id) \
+                in enumerate(self.make_molecules(sample, rng, N), start=first_molecule_number):
             mol = Molecule(
-                    Molecule.new_id(transcript_id),
+                    f"{transcript_id}.{molecule_number}",
                     sequence,
                     start = start, # relative to the true ('parental') genome
                     cigar = cigar,
@@ -323,29 +610,111 @@ class MoleculeMakerStep(AbstractCampareeStep):
             molecules.append(mol)
         return MoleculePacket(id, sample, molecules)
 
-    def make_molecule_file(self, filepath, sample, rng, N=10_000):
+    def make_molecule_lines(self, sample, rng, N=10_000):
         """
-        Write out molecules to a tab-separated file
+        Make N molecules, formatted as lines of the molecule file written by
+        execute() (see MOLECULE_FILE_HEADER).
 
         Note: we write out a molecules start and cigar relative to the appropriate
         custom genome, either _1 or _2 as per the transcript id
         """
+        return ["\t".join([transcript_id,
+                           chrom,
+                           str(start),
+                           cigar,
+                           str(ref_start),
+                           ref_cigar,
+                           strand,
+                           sequence]
+                           ) + "\n"
+                for sequence, start, cigar, ref_start, ref_cigar, strand, chrom, transcript_id
+                in self.make_molecules(sample, rng, N)]
+
+    def make_molecule_file(self, filepath, sample, rng, N=10_000):
+        """
+        Write out molecules to a tab-separated file
+        """
         with open(filepath, "w") as molecule_file:
-            header = "#transcript_id\tchrom\tstart\tcigar\tref_start\tref_cigar\tstrand\tsequence\n"
-            molecule_file.write(header)
-            for i in range(N):
-                sequence, start, cigar, ref_start, ref_cigar, strand, chrom, transcript_id = self.make_molecule(sample, rng)
-                line = "\t".join([transcript_id,
-                                  chrom,
-                                  str(start),
-                                  cigar,
-                                  str(ref_start),
-                                  ref_cigar,
-                                  strand,
-                                  sequence]
-                                  ) + "\n"
-
-                molecule_file.write(line)
+            molecule_file.write(self.MOLECULE_FILE_HEADER)
+            molecule_file.writelines(self.make_molecule_lines(sample, rng, N))
+
+    def make_output_chunk(self, sample, sample_data_directory, output_type, chunk):
+        """
+        Generate one packet (or, for file output, one chunk of the molecule file)
+        from its own random number generator, so the result does not depend on
+        what was generated before it or on which process generates it.
+
+        Parameters
+        ----------
+        sample : Sample
+            Sample to generate molecules for.
+        sample_data_directory : string
+            Path to directory containing the data for the sample.
+        output_type : string
+            One of {', '.join(MoleculeMakerStep.OUTPUT_OPTIONS_W_EXTENSIONS.keys())}.
+        chunk : tuple
+            Packet number (starting from 1), numpy SeedSequence for the chunk's
+            random number generator, number of molecules in the chunk, and
+            number of the chunk's first molecule.
+
+        Returns
+        -------
+        tuple
+            The chunk's output, and the number of template cache hits and
+            misses while generating it. The output is the text of the molecule
+            file lines for "file" output, None for "packet" output (the packet
+            is saved here), and the MoleculePacket for "generator" output.
+
+        """
+        packet_num, seed_sequence, N, first_molecule_number = chunk
+        rng = numpy.random.default_rng(seed_sequence)
+        template_cache_hits = self.template_cache_hits
+        template_cache_misses = self.template_cache_misses
+
+        if output_type == "file":
+            output = ''.join(self.make_molecule_lines(sample, rng, N))
+        elif output_type == "packet":
+            packet = self.make_packet(sample=sample, id=f"sample{sample.sample_id}.{packet_num}", N=N, rng=rng,
+                                      first_molecule_number=first_molecule_number) #TODO: id needs to be an integer
+            output_file_extension = MoleculeMakerStep.OUTPUT_OPTIONS_W_EXTENSIONS[output_type]
+            molecule_packet_filename = os.path.join(sample_data_directory,
+                                                    self.OUTPUT_FILENAME_PATTERN.format(output_type=output_type,
+                                                                                        packet_num=packet_num,
+                                                                                        extension=output_file_extension))
+            with open(molecule_packet_filename, "wb") as out_file:
+                pickle.dump(packet, out_file)
+            output = None
+        else:
+            output = self.make_packet(sample=sample, id=packet_num, N=N, rng=rng,
+                                      first_molecule_number=first_molecule_number)
+
+        return (output,
+                self.template_cache_hits - template_cache_hits,
+                self.template_cache_misses - template_cache_misses)
+
+    def make_output_chunks(self, sample, sample_data_directory, output_type, chunks):
+        """
+        Generate the given chunks with make_output_chunk(), using a pool of
+        self.num_processes worker processes if there is more than one.
+
+        Returns
+        -------
+        iterator
+            The return value of make_output_chunk() for each chunk, in order.
+
+        """
+        if self.num_processes > 1 and len(chunks) > 1:
+            # The fork context lets workers share the loaded genomes and
+            # distributions with this process, rather than receiving a pickled
+            # copy.
+            with multiprocessing.get_context("fork").Pool(self.num_processes,
+                                                          initializer=_initialize_worker,
+                                                          initargs=(self, sample, sample_data_directory,
+                                                                    output_type)) as pool:
+                yield from pool.imap(_make_output_chunk, chunks)
+        else:
+            for chunk in chunks:
+                yield self.make_output_chunk(sample, sample_data_directory, output_type, chunk)
 
     def execute(self, sample, sample_data_directory, output_type, output_molecule_count, seed=None,
                 molecules_per_packet=None, rng=None):
@@ -376,10 +745,18 @@ class MoleculeMakerStep(AbstractCampareeStep):
         rng: numpy Generator
             [OPTIONAL] If provided, will use this for generating random numbers. Otherwise,
             uses default RNG
+
+        Each packet (or, for file output, each chunk of molecules_per_packet
+        molecules) is generated from its own random number generator, spawned
+        from the seed. The output for a given seed is therefore the same whatever
+        the number of worker processes.
         """
 
         if rng is None:
-            rng = numpy.random.default_rng(seed)
+            seed_sequence = numpy.random.SeedSequence(seed)
+            rng = numpy.random.default_rng(seed_sequence)
+        else:
+            seed_sequence = numpy.random.SeedSequence(rng.integers(2**63, size=4))
 
         sample_log_dir = pathlib.Path(self.log_directory_path) / f'sample{sample.sample_id}'
         print(sample_log_dir.resolve())
@@ -421,12 +798,20 @@ class MoleculeMakerStep(AbstractCampareeStep):
             # Read and load data from gene, intron, transcript PSI, and allelic
             # imbalance distribution files.
             self.genes, self.gene_quants = self.load_gene_quants(gene_quant_path)
-            self.gene_probabilities = self.gene_quants / numpy.sum(self.gene_quants)
 
             self.transcript_intron_quants, self.intron_quants = self.load_intron_quants(intron_quant_path)
             self.isoform_quants = self.load_isoform_quants(psi_quant_path)
             self.allelic_quant = self.load_allelic_quants(allele_quant_path)
 
+            # Templates are built from the parental genomes loaded below.
+            self.template_cache.clear()
+            self.template_cache_hits = 0
+            self.template_cache_misses = 0
+
+            self.molecule_sampler = MoleculeSampler(self.genes, self.gene_quants, self.isoform_quants,
+                                                    self.allelic_quant, self.transcript_intron_quants,
+                                                    self.min_polyA_tail_length, self.max_polyA_tail_length)
+
             print('Loading annotations, transcriptome sequences, and genome sequences'
                   ' from both parental genomes.')
             log_file.write('Loading annotations, transcriptome sequences, and genome'
@@ -457,25 +842,38 @@ class MoleculeMakerStep(AbstractCampareeStep):
                                                    self._PARENTAL_GENOME_INDEL_FILENAME_PATTERN.format(genome_name=genome_name)),
                                                self.genomes[genome_name-1])
                                             for genome_name in [1,2]]
+            self.genome_cigar_indexes = [{chrom: self.index_genome_cigar(genome_cigar_split)
+                                          for chrom, genome_cigar_split in genome_cigar_splits.items()}
+                                         for genome_cigar_splits in self.genome_cigar_splits]
 
             # Generate molecules and save/export them according to output type.
             print('Generating molecules and saving/exporting the results.')
             log_file.write('Generating molecules and saving/exporting the results.')
             print(f"Molecule maker output type {repr(output_type)}")
-            if output_type == "packet":
+            if output_type == "packet" or output_type == "generator":
                 # TODO: potentially rounds down the number of molecules to make
                 num_packets = output_molecule_count // molecules_per_packet
-                for i in range(1,num_packets+1):
-                    print(f"    Generating packet {i} of {num_packets}")
-                    log_file.write(f"    Generating packet {i} of {num_packets}\n")
-                    packet = self.make_packet(sample=sample, id=f"sample{sample.sample_id}.{i}", N=molecules_per_packet, rng=rng) #TODO: id needs to be an integer
-
-                    molecule_packet_filename = os.path.join(sample_data_directory,
-                                                            self.OUTPUT_FILENAME_PATTERN.format(output_type=output_type,
-                                                                                                packet_num=i,
-                                                                                                extension=output_file_extension))
-                    with open(molecule_packet_filename, "wb") as out_file:
-                        pickle.dump(packet, out_file)
+                chunk_sizes = [molecules_per_packet] * num_packets
+            elif output_type == "file":
+                num_packets, last_chunk_size = divmod(output_molecule_count, molecules_per_packet)
+                chunk_sizes = [molecules_per_packet] * num_packets + ([last_chunk_size] if last_chunk_size else [])
+            else:
+                raise ValueError(f"Expected output_type to be 'packet', 'file', or 'generator'. Instead got {repr(output_type)}")
+            chunks = [(packet_num, chunk_seed_sequence, N, 1 + (packet_num - 1) * molecules_per_packet)
+                      for packet_num, (chunk_seed_sequence, N)
+                      in enumerate(zip(seed_sequence.spawn(len(chunk_sizes)), chunk_sizes), start=1)]
+            log_file.write(f"Generating molecules using {self.num_processes} processes.\n")
+
+            template_cache_hits = 0
+            template_cache_misses = 0
+            if output_type == "packet":
+                for packet_num, (_, chunk_hits, chunk_misses) \
+                        in enumerate(self.make_output_chunks(sample, sample_data_directory, output_type, chunks),
+                                     start=1):
+                    print(f"    Generated packet {packet_num} of {num_packets}")
+                    log_file.write(f"    Generated packet {packet_num} of {num_packets}\n")
+                    template_cache_hits += chunk_hits
+                    template_cache_misses += chunk_misses
             elif output_type == "file":
                 molecule_output_filename = os.path.join(sample_data_directory,
                                                         self.OUTPUT_FILENAME_PATTERN.format(output_type=output_type,
@@ -483,21 +881,22 @@ class MoleculeMakerStep(AbstractCampareeStep):
                                                                                             extension=output_file_extension))
                 print(f"Generating molecule file {molecule_output_filename}.")
                 log_file.write(f"Generating molecule file {molecule_output_filename}.")
-                self.make_molecule_file(filepath=molecule_output_filename,
-                                        N = output_molecule_count,
-                                        sample = sample,
-                                        rng = rng)
-            elif output_type == "generator":
+                with open(molecule_output_filename, "w") as molecule_file:
+                    molecule_file.write(self.MOLECULE_FILE_HEADER)
+                    for lines, chunk_hits, chunk_misses \
+                            in self.make_output_chunks(sample, sample_data_directory, output_type, chunks):
+                        molecule_file.write(lines)
+                        template_cache_hits += chunk_hits
+                        template_cache_misses += chunk_misses
+            else:
                 def generator():
-                    num_packets = output_molecule_count // molecules_per_packet
                     print(f"Generating {num_packets} packets")
-                    for i in range(1, num_packets+1):
-                        packet = self.make_packet(sample=sample, id=i, N=molecules_per_packet, rng=rng)
+                    for packet, _, _ in self.make_output_chunks(sample, sample_data_directory, output_type, chunks):
                         yield packet
                 return generator()
-            else:
-                raise ValueError(f"Expected output_type to be 'packet', 'file', or 'generator'. Instead got {repr(output_type)}")
 
+            log_file.write(f"\nMolecule template cache (size {self.template_cache_size}, per process): "
+                           f"{template_cache_hits} hits, {template_cache_misses} misses.\n")
             log_file.write("\nALL DONE!\n")
 
     def get_commandline_call(self, sample, sample_data_directory,
@@ -685,6 +1084,58 @@ class MoleculeMakerStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by MoleculeMakerStep for a specific
+        job/execution, given a job's data directory, log directory, sample ID,
+        output file type, output molecule count, and the number of molecules per
+        packet (if provided). Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, corresponding sample_id,
+            output file type, output molecule count, and the number of molecules
+            per packet (if provided).
+
+        Returns
+        -------
+        list
+            Paths to the molecule files and log file, or None if the molecules
+            are not saved to files (i.e. the "generator" output type).
+
+        """
+
+        sample_data_directory = validation_attributes['sample_data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        output_type = validation_attributes['output_type']
+        output_molecule_count = validation_attributes['output_molecule_count']
+        molecules_per_packet = validation_attributes.get('molecules_per_packet')
+
+        if output_type not in ("packet", "file"):
+            return None
+
+        output_file_extension = MoleculeMakerStep.OUTPUT_OPTIONS_W_EXTENSIONS[output_type]
+        if not molecules_per_packet:
+            molecules_per_packet = MoleculeMakerStep.DEFAULT_MOLECULES_PER_PACKET
+
+        if output_type == "packet":
+            packet_nums = range(1, output_molecule_count // molecules_per_packet + 1)
+        else:
+            packet_nums = [""]
+
+        output_file_paths = [os.path.join(sample_data_directory,
+                                          MoleculeMakerStep.OUTPUT_FILENAME_PATTERN.format(output_type=output_type,
+                                                                                           packet_num=packet_num,
+                                                                                           extension=output_file_extension))
+                             for packet_num in packet_nums]
+        output_file_paths.append(os.path.join(log_directory_path, f'sample{sample_id}',
+                                              CAMPAREE_CONSTANTS.MOLECULE_MAKER_LOG_FILENAME))
+        return output_file_paths
+
     @staticmethod
     def main():
         """Entry point into script. Parses the argument list to obtain all the
@@ -707,8 +1158,8 @@ class MoleculeMakerStep(AbstractCampareeStep):
         parser.add_argument('--seed', type=int, default=None, required=False,
                             help='Seed value for random number generator.')
         parser.add_argument('--molecules_per_packet', type=int, default=None, required=False,
-                            help='Number of molecules per molecule packet. '
-                                 'Only used if output_type set to "packet".')
+                            help='Number of molecules per molecule packet. For output_type '
+                                 '"file", the number of molecules generated at a time.')
         args = parser.parse_args()
         sample = eval(args.sample)
 
@@ -722,5 +1173,27 @@ class MoleculeMakerStep(AbstractCampareeStep):
                                seed=args.seed,
                                molecules_per_packet=args.molecules_per_packet)
 
+class MoleculeMakerException(CampareeException):
+    pass
+
+
+def _initialize_worker(molecule_maker, sample, sample_data_directory, output_type):
+    """Store the step and the arguments used by _make_output_chunk() in each
+    worker process.
+    """
+    global _worker_molecule_maker, _worker_sample, _worker_sample_data_directory, _worker_output_type
+    _worker_molecule_maker = molecule_maker
+    _worker_sample = sample
+    _worker_sample_data_directory = sample_data_directory
+    _worker_output_type = output_type
+
+def _make_output_chunk(chunk):
+    """Generate a packet or chunk of the molecule file in a worker process. See
+    MoleculeMakerStep.make_output_chunk().
+    """
+    return _worker_molecule_maker.make_output_chunk(_worker_sample, _worker_sample_data_directory,
+                                                    _worker_output_type, chunk)
+
+
 if __name__ == "__main__":
     sys.exit(MoleculeMakerStep.main())
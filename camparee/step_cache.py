@@ -0,0 +1,258 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from camparee.camparee_constants import CAMPAREE_VERSION
+from camparee.camparee_utils import CampareeUtils, CampareeException
+
+class StepCache:
+    """Content-addressed store of step outputs, shared across CAMPAREE runs.
+
+    Each job submitted by the expression pipeline is assigned a key derived from
+    the name of its step, the CAMPAREE version, the step's parameters from the
+    config file, its command line arguments, and the keys of all of the jobs it
+    depends on. Command line arguments that refer to input files outside of the
+    run's output directory (e.g. reference genome, annotation, FASTQ/BAM files)
+    are replaced by digests of their contents, while paths within the output
+    directory are replaced by their relative location. Because each key includes
+    the keys of upstream jobs, a change to any input, parameter, or upstream
+    output invalidates every job downstream of it, and nothing else.
+
+    The output files of each completed job are stored under its key, relative to
+    the output directory, so an unchanged job in a later run (with a different
+    run id or output directory) can be restored by copying its outputs into
+    place rather than re-running it. Files are copied into and out of the cache
+    as reflinks where the file system supports them (see
+    CampareeUtils.copy_file()), and are never hard-linked, since a step that
+    later rewrites or appends to an output in place would also change the
+    cached copy.
+
+    Digests of input files are memoized by file path, size, and modification
+    time, so large reference files are only read once across runs.
+
+    """
+
+    FILE_DIGEST_MEMO_FILENAME = "file_digests.json"
+
+    def __init__(self, cache_directory_path, output_directory_path):
+        """Constructor for StepCache object.
+
+        Parameters
+        ----------
+        cache_directory_path : string
+            Path to the upper-level directory where cached step outputs are
+            stored. Created if it does not already exist.
+        output_directory_path : string
+            Path to the output directory of the current CAMPAREE run. Paths
+            within this directory are stored relative to it.
+
+        """
+        self.cache_directory_path = cache_directory_path
+        self.output_directory_path = os.path.abspath(output_directory_path)
+        os.makedirs(self.cache_directory_path, mode=0o0755, exist_ok=True)
+        self.file_digest_memo_path = os.path.join(self.cache_directory_path,
+                                                  StepCache.FILE_DIGEST_MEMO_FILENAME)
+        self.file_digest_memo = {}
+        self.file_digest_memo_modified = False
+        if os.path.isfile(self.file_digest_memo_path):
+            with open(self.file_digest_memo_path, 'r') as file_digest_memo_file:
+                self.file_digest_memo = json.load(file_digest_memo_file)
+
+    def get_job_key(self, step_name, step_parameters, cmd_line_args, dependency_keys):
+        """Compute the cache key for a job.
+
+        Parameters
+        ----------
+        step_name : string
+            Name of the step class run by the job.
+        step_parameters : dict
+            Parameters for the step, as given in the config file.
+        cmd_line_args : list
+            Arguments passed to the step's get_commandline_call() method.
+        dependency_keys : list
+            Cache keys of all of the jobs this job depends on.
+
+        Returns
+        -------
+        string
+            Hexadecimal digest identifying the job's inputs.
+
+        """
+        job_description = {
+            'step': step_name,
+            'camparee_version': CAMPAREE_VERSION,
+            'parameters': step_parameters,
+            'arguments': self._normalize(cmd_line_args),
+            'dependencies': sorted(dependency_keys)
+        }
+        job_key = hashlib.sha256(json.dumps(job_description, sort_keys=True, default=str).encode())
+        self._save_file_digest_memo()
+        return job_key.hexdigest()
+
+    def is_cacheable(self, output_file_paths):
+        """Check whether the given output files can be stored in the cache.
+
+        Parameters
+        ----------
+        output_file_paths : list
+            Paths to output files returned by a step's get_output_file_paths()
+            method.
+
+        Returns
+        -------
+        boolean
+            True  - All of the files are located within the output directory.
+            False - No output file paths were given, or one or more of the files
+                    is located outside of the output directory (e.g. the index of
+                    a user-provided BAM file).
+
+        """
+        return bool(output_file_paths) and \
+               all(self._get_output_relative_path(path) is not None for path in output_file_paths)
+
+    def fetch(self, job_key, output_file_paths):
+        """Copy the output files for the given job key into place, if the cache
+        contains a complete entry for this key.
+
+        Parameters
+        ----------
+        job_key : string
+            Key identifying the job, generated by get_job_key().
+        output_file_paths : list
+            Paths to the job's output files in the current output directory.
+
+        Returns
+        -------
+        boolean
+            True  - The cache contained all of the output files and they were
+                    copied into the output directory.
+            False - The cache does not contain a complete entry for this key.
+
+        """
+        cache_entry_path = os.path.join(self.cache_directory_path, job_key)
+        relative_paths = [self._get_output_relative_path(path) for path in output_file_paths]
+        if not all(os.path.isfile(os.path.join(cache_entry_path, relative_path))
+                   for relative_path in relative_paths):
+            return False
+
+        for relative_path, output_file_path in zip(relative_paths, output_file_paths):
+            os.makedirs(os.path.dirname(output_file_path), mode=0o0755, exist_ok=True)
+            if os.path.lexists(output_file_path):
+                os.remove(output_file_path)
+            CampareeUtils.copy_file(os.path.join(cache_entry_path, relative_path), output_file_path)
+        return True
+
+    def store(self, job_key, output_file_paths):
+        """Add the given output files to the cache under the given key. The entry
+        is assembled in a temporary directory and renamed into place, so a
+        partially written entry is never restored. If an entry already exists
+        under the same key, the existing entry is kept.
+
+        Parameters
+        ----------
+        job_key : string
+            Key identifying the job, generated by get_job_key().
+        output_file_paths : list
+            Paths to the job's output files in the current output directory.
+
+        """
+        cache_entry_path = os.path.join(self.cache_directory_path, job_key)
+        if os.path.isdir(cache_entry_path):
+            return
+
+        for output_file_path in output_file_paths:
+            if not os.path.isfile(output_file_path):
+                raise StepCacheException(f"Cannot cache step output. {output_file_path} does not exist.")
+
+        staging_directory_path = tempfile.mkdtemp(prefix=f".{job_key}.", dir=self.cache_directory_path)
+        try:
+            for output_file_path in output_file_paths:
+                cache_file_path = os.path.join(staging_directory_path,
+                                               self._get_output_relative_path(output_file_path))
+                os.makedirs(os.path.dirname(cache_file_path), mode=0o0755, exist_ok=True)
+                CampareeUtils.copy_file(output_file_path, cache_file_path)
+            os.chmod(staging_directory_path, 0o0755)
+            os.rename(staging_directory_path, cache_entry_path)
+        except OSError:
+            # Another run stored the same entry first, or the cache is not
+            # writable. Either way, the outputs of this run are unaffected.
+            shutil.rmtree(staging_directory_path, ignore_errors=True)
+
+    def _get_output_relative_path(self, path):
+        """Return the path relative to the output directory, or None if the path
+        lies outside of the output directory.
+        """
+        absolute_path = os.path.abspath(path)
+        if os.path.commonpath([absolute_path, self.output_directory_path]) != self.output_directory_path:
+            return None
+        return os.path.relpath(absolute_path, self.output_directory_path)
+
+    def _normalize(self, value):
+        """Convert a command line argument into a form that identifies its
+        contents, independent of the location of the current run.
+        """
+        if isinstance(value, (list, tuple)):
+            return [self._normalize(item) for item in value]
+        if isinstance(value, dict):
+            return {str(key): self._normalize(item) for key, item in value.items()}
+        if hasattr(value, 'sample_id'):
+            return {'sample_id': value.sample_id,
+                    'gender': value.gender,
+                    'pooled': value.pooled,
+                    'fastq_file_paths': self._normalize(value.fastq_file_paths),
+                    'bam_file_path': self._normalize(value.bam_file_path)}
+        # Only strings that look like paths are checked against the file system,
+        # so plain arguments (e.g. "packet") never match a file by accident.
+        if isinstance(value, str) and os.sep in value:
+            relative_path = self._get_output_relative_path(value)
+            if relative_path is not None:
+                return {'output_path': relative_path}
+            if os.path.isfile(value):
+                return {'file_digest': self._get_file_digest(value)}
+            if os.path.isdir(value):
+                return {'directory_digest': self._get_directory_digest(value)}
+        return value
+
+    def _get_file_digest(self, file_path):
+        """Return the digest of the file's contents, computing it only if the
+        file has changed since it was last digested.
+        """
+        absolute_path = os.path.abspath(file_path)
+        file_stat = os.stat(absolute_path)
+        memo_entry = self.file_digest_memo.get(absolute_path)
+        if memo_entry and memo_entry[0] == file_stat.st_size and memo_entry[1] == file_stat.st_mtime_ns:
+            return memo_entry[2]
+        file_digest = CampareeUtils.compute_file_digest(absolute_path)
+        self.file_digest_memo[absolute_path] = [file_stat.st_size, file_stat.st_mtime_ns, file_digest]
+        self.file_digest_memo_modified = True
+        return file_digest
+
+    def _get_directory_digest(self, directory_path):
+        """Return a digest of the contents of every file within the directory.
+        """
+        directory_digest = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(directory_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(dirpath, filename)
+                directory_digest.update(os.path.relpath(file_path, directory_path).encode())
+                directory_digest.update(self._get_file_digest(file_path).encode())
+        return directory_digest.hexdigest()
+
+    def _save_file_digest_memo(self):
+        """Write the memoized file digests to the cache directory, so they are
+        available to later runs.
+        """
+        if not self.file_digest_memo_modified:
+            return
+        staging_file_descriptor, staging_file_path = tempfile.mkstemp(dir=self.cache_directory_path)
+        with os.fdopen(staging_file_descriptor, 'w') as file_digest_memo_file:
+            json.dump(self.file_digest_memo, file_digest_memo_file)
+        os.replace(staging_file_path, self.file_digest_memo_path)
+        self.file_digest_memo_modified = False
+
+
+class StepCacheException(CampareeException):
+    pass
@@ -1,10 +1,14 @@
 import argparse
 import sys
 import os
-import collections
+import itertools
+
+import numpy
+import pandas
 
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.transcript_gene_table import TranscriptGeneTable
 
 class TranscriptGeneQuantificationStep(AbstractCampareeStep):
     """This class takes a kallisto output file and generates transcript- and
@@ -52,23 +56,12 @@ class TranscriptGeneQuantificationStep(AbstractCampareeStep):
             by KallistoQuantStep.
         annotation_file_path : string
             Input transcript annotation file. Used to map transcript IDs to gene
-            IDs. This is generally prepared by the UpdateAnnotationForGenomeStep.
+            IDs. This is generally prepared by the UpdateAnnotationForGenomeStep,
+            in which case the TranscriptGeneTable saved alongside it is loaded
+            instead of parsing the annotation file.
 
         """
 
-        # Used in create_transcript_gene_map function, so it needs to be an
-        # instance variable.
-        self.annotation_file_path = annotation_file_path
-
-        # Dictionaries to keep track of length of transcript, number of uniquely
-        # mapped reads to transcript, and final count of reads mapped to transcript.
-        # This procedure does not map all gene info keys used. Consequently we
-        # need to insure that assignments using new keys are initialized to 0.
-        transcript_final_count = collections.defaultdict(float)
-        psi_value_map = collections.defaultdict(list)
-        # Used in create_transcript_gene_map, so it needs to be an instance variable.
-        self.transcript_gene_map = collections.defaultdict(str)
-
         # Prepare paths to output filenames
         transcript_count_filename = os.path.join(self.data_directory_path, f'sample{sample_id}',
                                                  self.OUTPUT_TRANSCRIPT_FILE_NAME)
@@ -91,75 +84,105 @@ class TranscriptGeneQuantificationStep(AbstractCampareeStep):
 
             print("Extracting transcript:gene mappings from annotation file.")
             log_file.write("Extracting transcript:gene mappings from annotation file.\n")
-            # Transcript : parent gene dictionary
-            self.create_transcript_gene_map()
+            transcript_gene_table = TranscriptGeneTable.load_for_annotation(annotation_file_path)
 
             print("Extracting transcript abundances from kallisto file.")
             log_file.write("Extracting transcript abundances from kallisto file.\n")
-            with open(tx_abundance_file_path, "r") as tx_abundance_file:
-                for line in tx_abundance_file:
-                    if line.startswith("target_id"):
-                        continue
-                    line = line.rstrip('\n').split('\t')
-                    transcript_id = line[0].split(':')[0]
-                    transcript_fpk = float(line[3]) / float(line[2]) * 1000 # est_counts / eff_length * 1000 = FPK
-                    transcript_final_count[transcript_id] = transcript_fpk
+            transcript_ids, transcript_fpks = self.read_transcript_abundances(tx_abundance_file_path)
 
             print("Writing transcript-level quants to file.")
             log_file.write("Writing transcript-level quants to file.\n")
             # Write the transcript quantification information to transcript quant filename
             with open(transcript_count_filename, 'w') as transcript_count_file:
                 transcript_count_file.write('#transcript_id' + '\t' + 'cnt' + '\n')
-                for key, value in transcript_final_count.items():
-                    transcript_count_file.write(str(key) + '\t' + str(round(value, 3)) + '\n')
+                transcript_count_file.writelines(map("{}\t{}\n".format, transcript_ids,
+                                                     map(round, transcript_fpks.tolist(), itertools.repeat(3))))
 
             print("Summing transcript-level quants by gene to get gene-level quants.")
             log_file.write("Summing transcript-level quants by gene to get gene-level quants.\n")
-            # Add the transcript counts to parent gene to get gene count
-            gene_count = collections.defaultdict(float)
-            for key, value in transcript_final_count.items():
-                gene_count[self.transcript_gene_map[key]] += value
-
-            gene_count = collections.OrderedDict(sorted(gene_count.items()))
+            # Transcripts missing from the annotation are assigned to the gene '',
+            # which sorts before all annotated genes. Genes are numbered in sorted
+            # order, and the transcript counts are added to their parent gene's
+            # count in the order of the kallisto file.
+            table_indices = transcript_gene_table.find_transcripts(transcript_ids)
+            table_gene_indices = numpy.where(table_indices >= 0,
+                                             transcript_gene_table.transcript_genes[table_indices] + 1, 0)
+            table_gene_indices, gene_indices = numpy.unique(table_gene_indices, return_inverse=True)
+            gene_indices = gene_indices.reshape(-1)
+            gene_ids = [''] + transcript_gene_table.gene_ids.tolist()
+            gene_ids = [gene_ids[index] for index in table_gene_indices.tolist()]
+            gene_fpks = numpy.bincount(gene_indices, weights=transcript_fpks, minlength=len(gene_ids))
 
             print("Writing gene-level quants to file.")
             log_file.write("Writing gene-level quants to file.\n")
             # Write gene quantification information to gene quant filename
             with open(gene_count_filename, 'w') as gene_count_file:
                 gene_count_file.write('#gene_id' + '\t' + 'cnt' + '\n')
-                for key, value in gene_count.items():
-                    gene_count_file.write(str(key) + '\t' + str(round(value,3)) + '\n')
+                gene_count_file.writelines(map("{}\t{}\n".format, gene_ids,
+                                               map(round, gene_fpks.tolist(), itertools.repeat(3))))
 
             print("Deriving PSI values from gene- and transcript-level quants.")
             log_file.write("Deriving PSI values from gene- and transcript-level quants.\n")
-            # Create dictionary with key gene_id and values isoforms and their psi values
-            for transcript_id in transcript_final_count.keys():
-                gene_id = self.transcript_gene_map[transcript_id]
-                if gene_count[gene_id]:
-                    psi_value_map[gene_id].append(transcript_id + ':' \
-                        + str(transcript_final_count[transcript_id]/gene_count[gene_id]))
-                else:
-                    psi_value_map[gene_id].append(transcript_id + ':' + str(0))
+            # Fraction of its gene's count contributed by each transcript. Isoforms
+            # of genes with no count have a PSI value of 0.
+            transcript_gene_fpks = gene_fpks[gene_indices]
+            has_gene_count = transcript_gene_fpks != 0
+            psi_values = numpy.divide(transcript_fpks, transcript_gene_fpks,
+                                      out=numpy.zeros(len(transcript_fpks)), where=has_gene_count)
+            isoform_psi_values = [f"{transcript_id}:{psi_value if gene_count else 0}"
+                                  for transcript_id, psi_value, gene_count
+                                  in zip(transcript_ids, psi_values.tolist(), has_gene_count.tolist())]
+            # List genes in the order they first appear in the kallisto file, with
+            # their isoforms in the order they appear in the kallisto file.
+            _, first_transcripts = numpy.unique(gene_indices, return_index=True)
+            gene_order = numpy.argsort(first_transcripts)
+            transcript_order = numpy.argsort(first_transcripts[gene_indices], kind='stable')
+            isoform_ends = numpy.cumsum(numpy.bincount(gene_indices, minlength=len(gene_ids))[gene_order])
 
             print("Writing PSI values to file.")
             log_file.write("Writing PSI values to file.\n")
             # Write psi value information for each gene
+            isoform_psi_values = [isoform_psi_values[index] for index in transcript_order.tolist()]
             with open(psi_value_filename, 'w') as psi_value_file:
                 psi_value_file.write('#gene_id' + '\t' + 'isoform_psi_value' + '\n')
-                for gene_id in psi_value_map.keys():
-                    psi_value_file.write(str(gene_id) + '\t' + ','.join(psi_value_map[gene_id]) + '\n')
+                psi_value_file.writelines(f"{gene_ids[gene_index]}\t{','.join(isoform_psi_values[start:end])}\n"
+                                          for gene_index, start, end
+                                          in zip(gene_order.tolist(), [0] + isoform_ends[:-1].tolist(),
+                                                 isoform_ends.tolist()))
 
             log_file.write("\nALL DONE!\n")
 
-    def create_transcript_gene_map(self):
-        """Create dictionary to map transcript id to gene id using geneinfo file
+    def read_transcript_abundances(self, tx_abundance_file_path):
+        """Read the transcript abundances from a kallisto abundance.tsv file and
+        convert them to FPK (fragments per kilobase).
+
+        Parameters
+        ----------
+        tx_abundance_file_path : string
+            File of transcript abundances created by kallisto.
+
+        Returns
+        -------
+        tuple
+            List of transcript IDs (kallisto target IDs without the location
+            suffix), and array of the FPK of each transcript. If a transcript ID
+            is listed more than once, the last entry is used.
 
         """
-        with open(self.annotation_file_path, 'r') as annotation_file:
-            next(annotation_file)
-            for line in annotation_file:
-                fields = line.strip('\n').split('\t')
-                self.transcript_gene_map[fields[7]] = fields[8]
+        # Parse floats exactly as Python's float() does.
+        abundances = pandas.read_csv(tx_abundance_file_path, sep='\t',
+                                     usecols=['target_id', 'eff_length', 'est_counts'],
+                                     dtype={'target_id': str}, float_precision='round_trip')
+        # est_counts / eff_length * 1000 = FPK
+        transcript_fpks = abundances['est_counts'].to_numpy(dtype=float) / \
+                          abundances['eff_length'].to_numpy(dtype=float) * 1000
+        transcript_ids = [target_id.partition(':')[0] for target_id in abundances['target_id'].tolist()]
+        if len(set(transcript_ids)) < len(transcript_ids):
+            # Keep each transcript at the position of its first entry.
+            transcript_fpks = dict(zip(transcript_ids, transcript_fpks.tolist()))
+            transcript_ids = list(transcript_fpks)
+            transcript_fpks = numpy.array(list(transcript_fpks.values()), dtype=float)
+        return transcript_ids, transcript_fpks
 
     def get_commandline_call(self, sample_id, tx_abundance_file_path, annotation_file_path):
         """
@@ -288,6 +311,39 @@ class TranscriptGeneQuantificationStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by TranscriptGeneQuantificationStep for a
+        specific job/execution, given a job's data directory, log directory, and
+        sample ID. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, and corresponding sample_id.
+
+        Returns
+        -------
+        list
+            Paths to the transcript, gene, and PSI value files, and the log file.
+
+        """
+
+        data_directory_path = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+
+        return [os.path.join(data_directory_path, f'sample{sample_id}',
+                             TranscriptGeneQuantificationStep.OUTPUT_TRANSCRIPT_FILE_NAME),
+                os.path.join(data_directory_path, f'sample{sample_id}',
+                             TranscriptGeneQuantificationStep.OUTPUT_GENE_FILE_NAME),
+                os.path.join(data_directory_path, f'sample{sample_id}',
+                             TranscriptGeneQuantificationStep.OUTPUT_PSI_VALUE_FILE_NAME),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             CAMPAREE_CONSTANTS.TXQUANT_LOG_FILENAME)]
+
     @staticmethod
     def main():
         """
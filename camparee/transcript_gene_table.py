@@ -0,0 +1,243 @@
+import os
+
+import numpy
+import pandas
+
+from camparee.camparee_utils import CampareeUtils
+
+class TranscriptGeneTable:
+    """Compact table of the transcripts in an annotation file, with integer codes
+    for their parent genes and chromosomes, and their strands and lengths.
+
+    The UpdateAnnotationForGenomeStep saves the table for each updated annotation
+    next to the annotation file (see get_file_path()), so downstream steps can
+    load the transcript and gene IDs without re-parsing the annotation text. The
+    table file records the digest of the annotation file it was built from, and
+    is only used with an annotation file with the same contents.
+
+    Attributes
+    ----------
+    transcript_ids : numpy.ndarray
+        Transcript IDs, in the order they are first listed in the annotation.
+    gene_ids : numpy.ndarray
+        Sorted, unique gene IDs.
+    transcript_genes : numpy.ndarray
+        Index into gene_ids of the parent gene of each transcript.
+    chroms : numpy.ndarray
+        Unique chromosome names, in the order they are listed in the annotation.
+    transcript_chroms : numpy.ndarray
+        Index into chroms of the chromosome of each transcript.
+    transcript_strands : numpy.ndarray
+        Strand ('+' or '-') of each transcript.
+    transcript_lengths : numpy.ndarray
+        Total length of the exons of each transcript.
+
+    """
+
+    # Increment whenever the arrays stored in the table file change, so table
+    # files from older versions are rebuilt from the annotation instead.
+    FILE_FORMAT_VERSION = 2
+
+    def __init__(self, transcript_ids, gene_ids, transcript_genes, chroms, transcript_chroms,
+                 transcript_strands, transcript_lengths):
+        self.transcript_ids = transcript_ids
+        self.gene_ids = gene_ids
+        self.transcript_genes = transcript_genes
+        self.chroms = chroms
+        self.transcript_chroms = transcript_chroms
+        self.transcript_strands = transcript_strands
+        self.transcript_lengths = transcript_lengths
+        # Built the first time find_transcripts() is called.
+        self._transcript_index = None
+
+    def __len__(self):
+        return len(self.transcript_ids)
+
+    @staticmethod
+    def get_file_path(annotation_file_path):
+        """Path of the table file saved alongside the given annotation file.
+
+        Parameters
+        ----------
+        annotation_file_path : string
+            Path to an annotation file.
+
+        Returns
+        -------
+        string
+            The annotation file path, with its extension replaced by ".npz".
+
+        """
+        return os.path.splitext(annotation_file_path)[0] + '.npz'
+
+    @staticmethod
+    def get_transcript_length(exon_starts, exon_ends):
+        """Total length of a transcript's exons, given their 1-based, inclusive
+        start and end coordinates.
+
+        """
+        return sum(exon_end - exon_start + 1 for exon_start, exon_end in zip(exon_starts, exon_ends))
+
+    @staticmethod
+    def from_transcripts(transcripts):
+        """Build a table from a dictionary of transcript info.
+
+        Parameters
+        ----------
+        transcripts : dict
+            Dictionary mapping transcript IDs to tuples of (gene ID, chromosome,
+            strand, transcript length), in annotation order.
+
+        Returns
+        -------
+        TranscriptGeneTable
+            Table listing the transcripts in the order of the dictionary.
+
+        """
+        transcript_ids = numpy.array(list(transcripts), dtype=str)
+        if transcripts:
+            transcript_gene_ids, transcript_chroms, transcript_strands, transcript_lengths = \
+                zip(*transcripts.values())
+        else:
+            transcript_gene_ids, transcript_chroms, transcript_strands, transcript_lengths = (), (), (), ()
+        gene_ids, transcript_genes = numpy.unique(numpy.array(transcript_gene_ids, dtype=str),
+                                                  return_inverse=True)
+        transcript_chroms, chroms = pandas.factorize(numpy.array(transcript_chroms, dtype=object))
+        return TranscriptGeneTable(transcript_ids=transcript_ids,
+                                   gene_ids=gene_ids,
+                                   transcript_genes=transcript_genes.reshape(-1).astype(numpy.int64),
+                                   chroms=numpy.array(chroms, dtype=str),
+                                   transcript_chroms=transcript_chroms.astype(numpy.int64),
+                                   transcript_strands=numpy.array(transcript_strands, dtype='U1'),
+                                   transcript_lengths=numpy.array(transcript_lengths, dtype=numpy.int64))
+
+    @staticmethod
+    def from_annotation_file(annotation_file_path):
+        """Build a table by parsing an annotation file. If a transcript is
+        listed more than once, it keeps the position of its first entry and the
+        info from its last.
+
+        Parameters
+        ----------
+        annotation_file_path : string
+            Path to annotation file in the format described in
+            CampareeUtils.convert_gtf_to_annot_file_format().
+
+        Returns
+        -------
+        TranscriptGeneTable
+            Table of the transcripts in the annotation file.
+
+        """
+        transcripts = {}
+        with open(annotation_file_path, 'r') as annotation_file:
+            for line in annotation_file:
+                if line.startswith('#'):
+                    continue
+                chrom, strand, tx_start, tx_end, exon_count, exon_starts, exon_ends, transcript_id, gene_id, *other = \
+                    line.rstrip('\n').split('\t')
+                transcript_length = TranscriptGeneTable.get_transcript_length(
+                    [int(start) for start in exon_starts.rstrip(',').split(',')],
+                    [int(end) for end in exon_ends.rstrip(',').split(',')])
+                transcripts[transcript_id] = (gene_id, chrom, strand, transcript_length)
+        return TranscriptGeneTable.from_transcripts(transcripts)
+
+    def save(self, table_file_path, annotation_file_path):
+        """Save the table as an uncompressed numpy .npz file.
+
+        Parameters
+        ----------
+        table_file_path : string
+            Path to the table file. Should end in ".npz".
+        annotation_file_path : string
+            Path to the annotation file the table was built from. Its digest is
+            stored in the table file, so the annotation file must be complete
+            (i.e. closed) when the table is saved.
+
+        """
+        numpy.savez(table_file_path,
+                    file_format_version=TranscriptGeneTable.FILE_FORMAT_VERSION,
+                    annotation_file_digest=CampareeUtils.compute_file_digest(annotation_file_path),
+                    transcript_ids=self.transcript_ids,
+                    gene_ids=self.gene_ids,
+                    transcript_genes=self.transcript_genes,
+                    chroms=self.chroms,
+                    transcript_chroms=self.transcript_chroms,
+                    transcript_strands=self.transcript_strands,
+                    transcript_lengths=self.transcript_lengths)
+
+    @staticmethod
+    def load(table_file_path, annotation_file_path):
+        """Load a table saved by save().
+
+        Parameters
+        ----------
+        table_file_path : string
+            Path to the table file.
+        annotation_file_path : string
+            Path to the annotation file the table should describe.
+
+        Returns
+        -------
+        TranscriptGeneTable
+            The loaded table, or None if the file was saved by a different
+            version of this class or built from an annotation file with
+            different contents.
+
+        """
+        with numpy.load(table_file_path, allow_pickle=False) as table_file:
+            if int(table_file['file_format_version']) != TranscriptGeneTable.FILE_FORMAT_VERSION:
+                return None
+            if str(table_file['annotation_file_digest']) != \
+               CampareeUtils.compute_file_digest(annotation_file_path):
+                return None
+            return TranscriptGeneTable(transcript_ids=table_file['transcript_ids'],
+                                       gene_ids=table_file['gene_ids'],
+                                       transcript_genes=table_file['transcript_genes'],
+                                       chroms=table_file['chroms'],
+                                       transcript_chroms=table_file['transcript_chroms'],
+                                       transcript_strands=table_file['transcript_strands'],
+                                       transcript_lengths=table_file['transcript_lengths'])
+
+    @staticmethod
+    def load_for_annotation(annotation_file_path):
+        """Load the table saved alongside an annotation file, or build it from
+        the annotation file if there is no up-to-date table file (e.g. for
+        annotations not generated by the UpdateAnnotationForGenomeStep).
+
+        Parameters
+        ----------
+        annotation_file_path : string
+            Path to annotation file.
+
+        Returns
+        -------
+        TranscriptGeneTable
+            Table of the transcripts in the annotation file.
+
+        """
+        table_file_path = TranscriptGeneTable.get_file_path(annotation_file_path)
+        if os.path.isfile(table_file_path):
+            table = TranscriptGeneTable.load(table_file_path, annotation_file_path)
+            if table is not None:
+                return table
+        return TranscriptGeneTable.from_annotation_file(annotation_file_path)
+
+    def find_transcripts(self, transcript_ids):
+        """Look up the positions of transcripts in the table.
+
+        Parameters
+        ----------
+        transcript_ids : list
+            Transcript IDs to look up.
+
+        Returns
+        -------
+        numpy.ndarray
+            Index of each transcript in the table, or -1 for transcripts that
+            are not in the table.
+
+        """
+        if self._transcript_index is None:
+            self._transcript_index = pandas.Index(self.transcript_ids.astype(object))
+        return self._transcript_index.get_indexer(pandas.Index(transcript_ids, dtype=object))
@@ -2,6 +2,7 @@ import argparse
 import re
 import sys
 import os
+from collections import defaultdict
 
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
@@ -90,8 +91,14 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
         self.log_file_path = os.path.join(self.log_directory_path, f'sample{self.sample_id}',
                                           CAMPAREE_CONSTANTS.TRANSCRIPTOME_FASTA_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix))
 
-        # Holds unique listing of exon locations
-        self.exon_location_list = set()
+        # Holds unique listing of exon locations for each chromosome
+        self.exon_locations_by_chromosome = defaultdict(set)
+        # Holds the annotation lines (i.e. transcripts) for each chromosome, in
+        # the order the chromosomes first appear in the annotation file
+        self.annotation_lines_by_chromosome = defaultdict(list)
+        # Holds (chromosome, line) for every line of the annotation file, in file
+        # order. The chromosome of comment/header lines is None.
+        self.annotation_lines = []
         # Dictionaries to record whether a chromosome is available in the genome file, is available in the exon
         # file.
         self.chromosome_in_genome_file = dict()
@@ -118,8 +125,9 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
             self.scrub_genome_fasta_file()
             log_file.write(f"done scrubbing genome fasta file\n")
 
-            # Create a unique listing of exon locations from the annotation file data.
-            self.create_exon_location_list()
+            # Create a unique listing of exon locations and index the annotation
+            # lines by chromosome, in a single pass of the annotation file.
+            self.index_annotation_file()
             log_file.write(f"done identifying unique set of exon locations\n")
 
             log_file.write(f"Assembling sequences for each transcript by chromosome\n")
@@ -203,11 +211,16 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
             # Finally add a line break to the end of the new genome fasta file.
             edited_genome_fasta_file.write("\n")
 
-    def create_exon_location_list(self):
+    def index_annotation_file(self):
         """
         Generate a unique listing of exon location strings from the provided
-        annotation file.  Note that the same exon may appear in multiple transcripts.
-        So the listing is actually a set to avoid duplicate entries.
+        annotation file and index the annotation lines by chromosome (the first
+        column of the annotation file). Note that the same exon may appear in
+        multiple transcripts. So the listing for each chromosome is actually a
+        set to avoid duplicate entries. Both are built in a single pass of the
+        annotation file, so later stages only need to visit the transcripts on
+        the chromosome they are working on, and the trimmed annotation file is
+        written without reading the annotation file again.
         """
 
         # Open the annotation file for reading only
@@ -216,12 +229,18 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
             # Iterate over each line in the file
             for line in annotation_file:
                 if line.startswith("#"): #Comment line
+                    self.annotation_lines.append((None, line))
                     continue
 
                 # Collect all the field values for the line read following newline removal.
                 (chromosome, strand, start, end, exon_count, exon_starts, exon_ends, name, *other) = \
                     line.rstrip('\n').split('\t')
 
+                # Note that the annotation contains at least one exon on chromosome 'chromosome'
+                self.chromosome_in_exon_file[chromosome] = True
+                self.annotation_lines_by_chromosome[chromosome].append(line)
+                self.annotation_lines.append((chromosome, line))
+
                 # Remove any trailing commas in the exon starts and exon ends fields
                 # and split the starts and stops into their corresponding lists
                 exon_starts_list = re.sub(r'\s*,\s*$', '', exon_starts).split(",")
@@ -229,10 +248,10 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
 
                 # For each exon belonging to the transcript, construct the exon's
                 # location string and add it to the growing set of exon locations
-                # assuming it is not already present.
+                # on this chromosome, assuming it is not already present.
                 for index in range(int(exon_count)):
                     exon_location = f'{chromosome}:{(int(exon_starts_list[index]) + 1)}-{(exon_ends_list[index])}'
-                    self.exon_location_list.add(exon_location)
+                    self.exon_locations_by_chromosome[chromosome].add(exon_location)
 
     def trim_annotation_file(self):
         """
@@ -247,9 +266,9 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
         #       see if the edited one exists, and load the original annotation if
         #       it does not.
 
-        # Holds a list of chromosomes found for exons in the annotation file that are not available in the
+        # Holds the set of chromosomes found for exons in the annotation file that are not available in the
         # genome fasta file
-        missing_genome_chromosomes = []
+        missing_genome_chromosomes = set()
 
         with open(self.log_file_path, 'a') as log_file:
 
@@ -263,7 +282,7 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
                 # chromosome as available.
                 if chromosome not in self.chromosome_in_genome_file:
                     log_file.write(f"\tno genome sequence for {chromosome}\n")
-                    missing_genome_chromosomes.append(chromosome)
+                    missing_genome_chromosomes.add(chromosome)
                 else:
                     log_file.write(f"\tsequence available for {chromosome}\n")
 
@@ -271,17 +290,12 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
             if missing_genome_chromosomes:
                 log_file.write(f"Removing the transcripts on chromosomes for which no genome sequences are available.\n")
 
-        # Open the original annotation for reading and the edited annotation file for writing.
-        with open(self.annotation_file_path, 'r') as annotation_in, \
-                open(self.trimmed_annotation_file_path, 'w') as annotation_out:
-
-            # Iterate over the lines in the original annotation file
-            for line in annotation_in:
-
-                # If none of the missing chromosomes are found on the line, write
-                # the line out to the trimmed version of the annotation file.
-                if not any(chromosome in line for chromosome in missing_genome_chromosomes):
-                    annotation_out.write(line)
+        # Write the lines collected by index_annotation_file() to the edited
+        # annotation file, in their original order, skipping the transcripts on
+        # chromosomes without genome sequence.
+        with open(self.trimmed_annotation_file_path, 'w') as annotation_out:
+            annotation_out.writelines(line for chromosome, line in self.annotation_lines
+                                      if chromosome not in missing_genome_chromosomes)
 
     def create_exon_sequence_map(self, genome_chromosome, sequence):
         """
@@ -295,23 +309,18 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
         # Start with a empty dictionary
         exon_sequence_map = dict()
 
-        # Iterate over the list of previously obtained exon locations
-        for exon_location in self.exon_location_list:
+        # Iterate over the previously obtained exon locations on the genome chromosome
+        # provided as a parameter.
+        for exon_location in self.exon_locations_by_chromosome.get(genome_chromosome, ()):
 
-            # Extract the chromosome, start and end from the exon location string
+            # Extract the start and end from the exon location string
             exon_info_match = re.search(self.exon_info_pattern, exon_location)
-            chromosome = exon_info_match.group(1)
             exon_start = int(exon_info_match.group(2))
             exon_end = int(exon_info_match.group(3))
 
-            # Note that the exon listing contains at least one exon on chromosome 'chromosome'
-            self.chromosome_in_exon_file[chromosome] = True
-
-            # If the chromosome on which the exon is located is the same of the genome chromosome
-            # provided as a parameter, get the sequence for that exon and create a dictionary
-            # entry relating the exon location string to the exon sequence.
-            if chromosome == genome_chromosome:
-                exon_sequence_map[exon_location] = sequence[exon_start-1:exon_end]
+            # Get the sequence for that exon and create a dictionary entry relating
+            # the exon location string to the exon sequence.
+            exon_sequence_map[exon_location] = sequence[exon_start-1:exon_end]
 
         # Return the dictionary of exon location string : exon sequence for the genome chromosome
         # provided in the parameter list.
@@ -319,14 +328,13 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
 
     def make_tx_fasta_file(self, genome_chromosome, exon_sequence_map):
 
-        # Open the original annotation file for reading and the genes fasta file for appending.
-        with open(self.annotation_file_path, 'r') as annotation_file, \
-             open(self.transcriptome_fasta_file_path, 'a') as transcriptome_fasta_file:
+        # Open the genes fasta file for appending.
+        with open(self.transcriptome_fasta_file_path, 'a') as transcriptome_fasta_file:
 
-            # Iterate over the annotation file
-            for line in annotation_file:
-                if line.startswith("#"): # Comment line
-                    continue
+            # Iterate over the indexed annotation lines for transcripts located on
+            # the genome chromosome provided as a parameter, rendering each one as
+            # an entry in the genes fasta file.
+            for line in self.annotation_lines_by_chromosome.get(genome_chromosome, ()):
 
                 # Collect all the field values for the line read following newline removal.
                 (chromosome, strand, start, end, exon_count, exon_starts, exon_ends, feature_id, *other) =\
@@ -337,38 +345,33 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
                 exon_starts_list = re.sub(r'\s*,\s*$', '', exon_starts).split(",")
                 exon_ends_list = re.sub(r'\s*,\s*$', '', exon_ends).split(",")
 
-                # If the chromosome on which this transcript is located is the
-                # same of the genome chromosome provided as a parameter, render
-                # this transcript as an entry in the genes fasta file
-                if chromosome == genome_chromosome:
-
-                    # Initialize the transcripts's sequence
-                    tx_sequence = ""
+                # Initialize the transcripts's sequence
+                tx_sequence = ""
 
-                    # For each exon belonging to the transcript, construct the
-                    # exon's location string and use it as a key to obtain the
-                    # actual exon sequence.  Concatenate that exon sequence to
-                    # the transcript sequence.  Note that the 1 added to each
-                    # exon start takes into account the zero based and half-
-                    # open ucsc coordinates.
-                    for index in range(int(exon_count)):
-                        exon_key = f'{chromosome}:{(int(exon_starts_list[index]) + 1)}-{(exon_ends_list[index])}'
-                        exon_sequence = exon_sequence_map[exon_key]
-                        tx_sequence += exon_sequence
+                # For each exon belonging to the transcript, construct the
+                # exon's location string and use it as a key to obtain the
+                # actual exon sequence.  Concatenate that exon sequence to
+                # the transcript sequence.  Note that the 1 added to each
+                # exon start takes into account the zero based and half-
+                # open ucsc coordinates.
+                for index in range(int(exon_count)):
+                    exon_key = f'{chromosome}:{(int(exon_starts_list[index]) + 1)}-{(exon_ends_list[index])}'
+                    exon_sequence = exon_sequence_map[exon_key]
+                    tx_sequence += exon_sequence
 
-                    # Remove some spurious characters from the transcript ID
-                    tx_id = re.sub(r'::::.*', '', feature_id)
-                    # TODO determine if this substitution is still needed.
-                    tx_id = re.sub(r'\([^(]+$', '', tx_id)
+                # Remove some spurious characters from the transcript ID
+                tx_id = re.sub(r'::::.*', '', feature_id)
+                # TODO determine if this substitution is still needed.
+                tx_id = re.sub(r'\([^(]+$', '', tx_id)
 
-                    if self.include_suffix_w_tx_id:
-                        tx_id = tx_id + "_" + self.genome_suffix
+                if self.include_suffix_w_tx_id:
+                    tx_id = tx_id + "_" + self.genome_suffix
 
-                    # Write the 1st line of the fasta entry - transcript location string
-                    transcriptome_fasta_file.write(f'>{tx_id}:{chromosome}:{start}-{end}_{strand}\n')
+                # Write the 1st line of the fasta entry - transcript location string
+                transcriptome_fasta_file.write(f'>{tx_id}:{chromosome}:{start}-{end}_{strand}\n')
 
-                    # Write the 2nd line of the fasta entry - gene sequence.
-                    transcriptome_fasta_file.write(tx_sequence + '\n')
+                # Write the 2nd line of the fasta entry - gene sequence.
+                transcriptome_fasta_file.write(tx_sequence + '\n')
 
     def get_commandline_call(self, sample_id, genome_suffix, genome_fasta_file_path,
                              annotation_file_path, include_suffix_w_tx_id=False):
@@ -527,6 +530,42 @@ class TranscriptomeFastaPreparationStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by TranscriptomeFastaPreparationStep for a
+        specific job/execution, given a job's data directory, log directory, sample
+        ID, genome suffix, genome FASTA path, and annotation path. Prepare these
+        attributes for a given job using the get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, sample_id, genome_suffix,
+            genome_fasta_file_path, and annotation_file_path.
+
+        Returns
+        -------
+        list
+            Paths to the edited genome FASTA, trimmed annotation, transcriptome
+            FASTA, and log file.
+
+        """
+
+        data_directory = validation_attributes['data_directory']
+        log_directory_path = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_suffix = validation_attributes['genome_suffix']
+        genome_fasta_file_path = validation_attributes['genome_fasta_file_path']
+        annotation_file_path = validation_attributes['annotation_file_path']
+
+        return [os.path.splitext(genome_fasta_file_path)[0] + "_edited.fa",
+                os.path.splitext(annotation_file_path)[0] + "_trimmed.txt",
+                os.path.join(data_directory, f'sample{sample_id}',
+                             CAMPAREE_CONSTANTS.TRANSCRIPTOME_FASTA_OUTPUT_FILENAME_PATTERN.format(genome_name=genome_suffix)),
+                os.path.join(log_directory_path, f'sample{sample_id}',
+                             CAMPAREE_CONSTANTS.TRANSCRIPTOME_FASTA_LOG_FILENAME_PATTERN.format(genome_name=genome_suffix))]
+
     @staticmethod
     def main():
         """Entry point into script when called directly.
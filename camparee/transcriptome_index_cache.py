@@ -0,0 +1,175 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from camparee.camparee_utils import CampareeUtils, CampareeException
+
+class TranscriptomeIndexCache:
+    """Content-addressed store of transcriptome indexes, shared across samples,
+    parental genomes, and CAMPAREE runs.
+
+    Each cache entry is keyed by a digest of the transcriptome FASTA contents,
+    the type of index (e.g. kallisto or bowtie2), the path and version of the
+    tool that builds the index, and any parameters that affect how the index is
+    built. Parental transcriptomes that are identical (e.g. for
+    pooled or variant-poor samples, or repeated runs using the same phased VCF)
+    therefore map to the same entry, and the index only needs to be built once.
+
+    Cached index files are stored under generic names, so the same entry can be
+    copied into the index directory of any sample or parental genome. Files are
+    copied as reflinks where the file system supports them (see
+    CampareeUtils.copy_file()), and are never hard-linked, since rebuilding an
+    index in place would also change the cached copy.
+
+    """
+
+    def __init__(self, cache_directory_path, index_type, index_parameters=None, index_tool_version=None):
+        """Constructor for TranscriptomeIndexCache object.
+
+        Parameters
+        ----------
+        cache_directory_path : string
+            Path to the upper-level directory where cached indexes are stored.
+            Created if it does not already exist.
+        index_type : string
+            Name of the type of index stored (e.g. "kallisto", "bowtie2"). Each
+            type of index is stored in its own sub-directory of the cache.
+        index_parameters : dict
+            [Optional] Parameters used to build the index. These are included in
+            the cache key, so indexes built with different parameters are never
+            shared.
+        index_tool_version : string
+            [Optional] Path and version of the tool used to build the index (see
+            get_tool_version()). Included in the cache key, so indexes built by
+            different versions of the tool are never shared.
+
+        """
+        self.index_type = index_type
+        self.index_parameters = index_parameters if index_parameters else {}
+        self.index_tool_version = index_tool_version if index_tool_version else ""
+        self.cache_directory_path = os.path.join(cache_directory_path, index_type)
+        os.makedirs(self.cache_directory_path, mode=0o0755, exist_ok=True)
+
+    def get_cache_key(self, transcriptome_fasta_path):
+        """Compute the cache key for an index built from the given transcriptome.
+
+        Parameters
+        ----------
+        transcriptome_fasta_path : string
+            Path to the FASTA file of transcripts, used as the basis for the
+            index.
+
+        Returns
+        -------
+        string
+            Hexadecimal digest combining the contents of the transcriptome FASTA,
+            the index type, the index tool version, and the index parameters.
+
+        """
+        cache_key = hashlib.sha256()
+        cache_key.update(CampareeUtils.compute_file_digest(transcriptome_fasta_path).encode())
+        cache_key.update(self.index_type.encode())
+        cache_key.update(json.dumps([self.index_tool_version, self.index_parameters], sort_keys=True).encode())
+        return cache_key.hexdigest()
+
+    @staticmethod
+    def get_tool_version(tool_path, version_option):
+        """Identify the tool used to build an index, for use in the cache key.
+
+        Parameters
+        ----------
+        tool_path : string
+            Path to the executable that builds the index.
+        version_option : string
+            Argument(s) that make the tool print its version (e.g. "version" for
+            kallisto, "--version" for bowtie2-build).
+
+        Returns
+        -------
+        string
+            The resolved path to the tool, followed by its version output.
+
+        """
+        tool_path = os.path.realpath(tool_path)
+        try:
+            version_result = subprocess.run(f"{tool_path} {version_option}", shell=True, check=True,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, # Redirect stderr to stdout.
+                                            encoding="ascii", errors="replace")
+        except subprocess.CalledProcessError as version_exception:
+            raise TranscriptomeIndexCacheException(f"Could not determine the version of {tool_path} "
+                                                   f"for the index cache:\n{version_exception.stdout}")
+        return f"{tool_path}\n{version_result.stdout.strip()}"
+
+    def fetch(self, cache_key, index_file_paths):
+        """Copy the index files for the given cache key into place, if the cache
+        contains a complete entry for this key.
+
+        Parameters
+        ----------
+        cache_key : string
+            Key identifying the cache entry, generated by get_cache_key().
+        index_file_paths : dict
+            Mapping from the generic name of each index file in the cache to the
+            path where the index file should be placed.
+
+        Returns
+        -------
+        boolean
+            True  - The cache contained all of the index files and they were
+                    copied to the given paths.
+            False - The cache does not contain a complete entry for this key.
+
+        """
+        cache_entry_path = os.path.join(self.cache_directory_path, cache_key)
+        if not all(os.path.isfile(os.path.join(cache_entry_path, cache_filename))
+                   for cache_filename in index_file_paths):
+            return False
+
+        for cache_filename, index_file_path in index_file_paths.items():
+            if os.path.lexists(index_file_path):
+                os.remove(index_file_path)
+            CampareeUtils.copy_file(os.path.join(cache_entry_path, cache_filename), index_file_path)
+        return True
+
+    def store(self, cache_key, index_file_paths):
+        """Add the given index files to the cache under the given key. The entry
+        is assembled in a temporary directory and renamed into place, so other
+        jobs never see a partially written entry. If another job already stored
+        an entry under the same key, the existing entry is kept.
+
+        Parameters
+        ----------
+        cache_key : string
+            Key identifying the cache entry, generated by get_cache_key().
+        index_file_paths : dict
+            Mapping from the generic name of each index file in the cache to the
+            path of the newly built index file.
+
+        """
+        cache_entry_path = os.path.join(self.cache_directory_path, cache_key)
+        if os.path.isdir(cache_entry_path):
+            return
+
+        for index_file_path in index_file_paths.values():
+            if not os.path.isfile(index_file_path):
+                raise TranscriptomeIndexCacheException(f"Cannot cache {self.index_type} index. "
+                                                       f"{index_file_path} does not exist.")
+
+        staging_directory_path = tempfile.mkdtemp(prefix=f".{cache_key}.", dir=self.cache_directory_path)
+        try:
+            for cache_filename, index_file_path in index_file_paths.items():
+                CampareeUtils.copy_file(index_file_path, os.path.join(staging_directory_path, cache_filename))
+            os.chmod(staging_directory_path, 0o0755)
+            os.rename(staging_directory_path, cache_entry_path)
+        except OSError:
+            # Another job stored the same entry first, or the cache is not
+            # writable. Either way, the index built by this job is still usable.
+            shutil.rmtree(staging_directory_path, ignore_errors=True)
+
+
+class TranscriptomeIndexCacheException(CampareeException):
+    pass
@@ -9,6 +9,7 @@ from beers_utils.sample import Sample
 from camparee.camparee_utils import CampareeUtils
 from camparee.abstract_camparee_step import AbstractCampareeStep
 from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.transcript_gene_table import TranscriptGeneTable
 
 class UpdateAnnotationForGenomeStep(AbstractCampareeStep):
     """Updates a gene annotation's coordinates to account for insertions &
@@ -42,12 +43,18 @@ class UpdateAnnotationForGenomeStep(AbstractCampareeStep):
     updated_annot_filename : string
         Path to the output file containing gene/transcript annotations with
         coordinates updated to match the variant genome.
+    updated_annot_table_filename : string
+        Path to the output TranscriptGeneTable of the transcripts in the updated
+        annotation, which is loaded by downstream steps in place of parsing the
+        annotation file.
     log_filename : string
         Path to the log file.
     """
 
     #Name of updated annotation file generated by this script.
     UPDATE_ANNOT_OUTPUT_FILENAME_PATTERN = CAMPAREE_CONSTANTS.UPDATEANNOT_OUTPUT_FILENAME_PATTERN
+    #Name of transcript/gene table generated by this script.
+    UPDATE_ANNOT_TABLE_FILENAME_PATTERN = CAMPAREE_CONSTANTS.UPDATEANNOT_TABLE_FILENAME_PATTERN
     #Name of file where script logging is stored
     UPDATE_ANNOT_LOG_FILENAME_PATTERN = CAMPAREE_CONSTANTS.UPDATEANNOT_LOG_FILENAME_PATTERN
 
@@ -92,6 +99,8 @@ class UpdateAnnotationForGenomeStep(AbstractCampareeStep):
         self.input_annot_file_path = input_annot_file_path
         self.updated_annot_file_path = os.path.join(self.data_directory_path, f"sample{sample.sample_id}",
                                                     self.UPDATE_ANNOT_OUTPUT_FILENAME_PATTERN.format(genome_name=genome_indel_suffix))
+        self.updated_annot_table_file_path = os.path.join(self.data_directory_path, f"sample{sample.sample_id}",
+                                                          self.UPDATE_ANNOT_TABLE_FILENAME_PATTERN.format(genome_name=genome_indel_suffix))
         self.log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
                                           self.UPDATE_ANNOT_LOG_FILENAME_PATTERN.format(genome_name=genome_indel_suffix))
 
@@ -99,140 +108,157 @@ class UpdateAnnotationForGenomeStep(AbstractCampareeStep):
         #Load indel offsets from the indel file
         indel_offsets = UpdateAnnotationForGenomeStep._get_offsets_from_variant_file(self.genome_indel_file_path)
 
-        with open(self.input_annot_file_path, 'r') as input_annot_file, \
-                open(self.updated_annot_file_path, 'w') as updated_annot_file, \
-                open(self.log_file_path, 'w') as log_file:
+        #Transcript ID : (gene ID, chrom, strand, transcript length) for each
+        #transcript in the updated annotation. Used to build the TranscriptGeneTable.
+        transcripts = {}
 
-            #Print header for annotation file
-            updated_annot_file.write("#" + CampareeUtils.annot_output_format.replace('{', '').replace('}', ''))
+        with open(self.log_file_path, 'w') as log_file:
 
-            current_chrom = ""
+            with open(self.input_annot_file_path, 'r') as input_annot_file, \
+                    open(self.updated_annot_file_path, 'w') as updated_annot_file:
 
-            for annot_feature in input_annot_file:
+                #Print header for annotation file
+                updated_annot_file.write("#" + CampareeUtils.annot_output_format.replace('{', '').replace('}', ''))
 
-                annot_feature = annot_feature.rstrip('\n')
-                line_data = annot_feature.split('\t')
+                current_chrom = ""
 
-                if current_chrom != line_data[0]:
+                for annot_feature in input_annot_file:
 
-                    #Skip header lines (nest in here so it's only checked when
-                    #chromosomes change).
-                    if annot_feature[0] == '#':
+                    annot_feature = annot_feature.rstrip('\n')
+                    line_data = annot_feature.split('\t')
+
+                    if current_chrom != line_data[0]:
+
+                        #Skip header lines (nest in here so it's only checked when
+                        #chromosomes change).
+                        if annot_feature[0] == '#':
+                            continue
+
+                        current_chrom = line_data[0]
+                        log_file.write(f"Processing indels and annotated features from chromosome {current_chrom}.\n")
+
+                        if current_chrom in indel_offsets:
+                            """
+                            Since code below will be performing many lookups and index-
+                            based references to the values and keys in current_chrom_variants,
+                            it will likely be more efficient to create a list of values
+                            and a list of keys from current_chrom_variants once, rather
+                            than re-creating them each time the code needs to access a
+                            key or value by ordered index.
+                            """
+                            current_chrom_variant_coords = list(indel_offsets[current_chrom].keys())
+                            current_chrom_variant_offsets = list(indel_offsets[current_chrom].values())
+                        else:
+                            #New chromosome contains no variants
+                            log_file.write(f"----No indels from chromosome {current_chrom}.\n")
+                            current_chrom_variant_coords = ()
+                            current_chrom_variant_coords = ()
+
+                    if current_chrom not in desired_chromosomes:
                         continue
 
-                    current_chrom = line_data[0]
-                    log_file.write(f"Processing indels and annotated features from chromosome {current_chrom}.\n")
-
-                    if current_chrom in indel_offsets:
-                        """
-                        Since code below will be performing many lookups and index-
-                        based references to the values and keys in current_chrom_variants,
-                        it will likely be more efficient to create a list of values
-                        and a list of keys from current_chrom_variants once, rather
-                        than re-creating them each time the code needs to access a
-                        key or value by ordered index.
-                        """
-                        current_chrom_variant_coords = list(indel_offsets[current_chrom].keys())
-                        current_chrom_variant_offsets = list(indel_offsets[current_chrom].values())
-                    else:
-                        #New chromosome contains no variants
-                        log_file.write(f"----No indels from chromosome {current_chrom}.\n")
-                        current_chrom_variant_coords = ()
-                        current_chrom_variant_coords = ()
-
-                if current_chrom not in desired_chromosomes:
-                    continue
-
-                #Current chromosome contains variants
-                if current_chrom_variant_coords:
-
-                    tx_start = int(line_data[2])
-                    tx_end = int(line_data[3])
-                    #exon_count = int(line_data[4])
-                    exon_starts = [int(coord) for coord in line_data[5].split(',')]
-                    exon_ends = [int(coord) for coord in line_data[6].split(',')]
-
-                    #bisect_right() finds the index at which to insert the given
-                    #coordinate in sorted order. Since I'm looking for the
-                    #closest coordinate <= the given coordinate, subtract 1 from
-                    #the result of bisect_right() to get the correct index.
-                    tx_start_offset_index = bisect.bisect_right(current_chrom_variant_coords, tx_start) - 1
-                    tx_end_offset_index = bisect.bisect_right(current_chrom_variant_coords, tx_end) - 1
-
-                    #No indels before start of current feature.
-                    if tx_start_offset_index == -1:
-
-                        updated_tx_start = tx_start
-
-                        #No indels before end of current feature
-                        if tx_end_offset_index == -1:
-                            updated_tx_end = tx_end
-                            updated_exon_starts = exon_starts
-                            updated_exon_ends = exon_ends
-                        #First indels occur before end of current feature
+                    #Current chromosome contains variants
+                    if current_chrom_variant_coords:
+
+                        tx_start = int(line_data[2])
+                        tx_end = int(line_data[3])
+                        #exon_count = int(line_data[4])
+                        exon_starts = [int(coord) for coord in line_data[5].split(',')]
+                        exon_ends = [int(coord) for coord in line_data[6].split(',')]
+
+                        #bisect_right() finds the index at which to insert the given
+                        #coordinate in sorted order. Since I'm looking for the
+                        #closest coordinate <= the given coordinate, subtract 1 from
+                        #the result of bisect_right() to get the correct index.
+                        tx_start_offset_index = bisect.bisect_right(current_chrom_variant_coords, tx_start) - 1
+                        tx_end_offset_index = bisect.bisect_right(current_chrom_variant_coords, tx_end) - 1
+
+                        #No indels before start of current feature.
+                        if tx_start_offset_index == -1:
+
+                            updated_tx_start = tx_start
+
+                            #No indels before end of current feature
+                            if tx_end_offset_index == -1:
+                                updated_tx_end = tx_end
+                                updated_exon_starts = exon_starts
+                                updated_exon_ends = exon_ends
+                            #First indels occur before end of current feature
+                            else:
+                                updated_tx_end = tx_end + current_chrom_variant_offsets[tx_end_offset_index]
+
+                                updated_exon_starts = []
+                                updated_exon_ends = []
+                                for coord in exon_starts:
+                                    ex_coord_offset_index = bisect.bisect_right(current_chrom_variant_coords, coord) - 1
+                                    updated_exon_coord = coord
+                                    if ex_coord_offset_index >= 0:
+                                        updated_exon_coord += current_chrom_variant_offsets[ex_coord_offset_index]
+                                    updated_exon_starts.append(updated_exon_coord)
+                                for coord in exon_ends:
+                                    ex_coord_offset_index = bisect.bisect_right(current_chrom_variant_coords, coord) - 1
+                                    updated_exon_coord = coord
+                                    if ex_coord_offset_index >= 0:
+                                        updated_exon_coord += current_chrom_variant_offsets[ex_coord_offset_index]
+                                    updated_exon_ends.append(updated_exon_coord)
+                        #No new variants between the start and stop coordinates, so
+                        #apply the same offset to all coordinates in the current
+                        #feature.
+                        elif tx_start_offset_index == tx_end_offset_index:
+                            offset = current_chrom_variant_offsets[tx_start_offset_index]
+                            updated_tx_start = tx_start + offset
+                            updated_tx_end = tx_end + offset
+                            updated_exon_starts = [coord+offset for coord in exon_starts]
+                            updated_exon_ends = [coord+offset for coord in exon_ends]
                         else:
+                            updated_tx_start = tx_start + current_chrom_variant_offsets[tx_start_offset_index]
                             updated_tx_end = tx_end + current_chrom_variant_offsets[tx_end_offset_index]
 
+                            #Update lists of exon starts/ends with correct offsets
                             updated_exon_starts = []
                             updated_exon_ends = []
                             for coord in exon_starts:
                                 ex_coord_offset_index = bisect.bisect_right(current_chrom_variant_coords, coord) - 1
-                                updated_exon_coord = coord
-                                if ex_coord_offset_index >= 0:
-                                    updated_exon_coord += current_chrom_variant_offsets[ex_coord_offset_index]
+                                updated_exon_coord = coord + current_chrom_variant_offsets[ex_coord_offset_index]
                                 updated_exon_starts.append(updated_exon_coord)
                             for coord in exon_ends:
                                 ex_coord_offset_index = bisect.bisect_right(current_chrom_variant_coords, coord) - 1
-                                updated_exon_coord = coord
-                                if ex_coord_offset_index >= 0:
-                                    updated_exon_coord += current_chrom_variant_offsets[ex_coord_offset_index]
+                                updated_exon_coord = coord + current_chrom_variant_offsets[ex_coord_offset_index]
                                 updated_exon_ends.append(updated_exon_coord)
-                    #No new variants between the start and stop coordinates, so
-                    #apply the same offset to all coordinates in the current
-                    #feature.
-                    elif tx_start_offset_index == tx_end_offset_index:
-                        offset = current_chrom_variant_offsets[tx_start_offset_index]
-                        updated_tx_start = tx_start + offset
-                        updated_tx_end = tx_end + offset
-                        updated_exon_starts = [coord+offset for coord in exon_starts]
-                        updated_exon_ends = [coord+offset for coord in exon_ends]
-                    else:
-                        updated_tx_start = tx_start + current_chrom_variant_offsets[tx_start_offset_index]
-                        updated_tx_end = tx_end + current_chrom_variant_offsets[tx_end_offset_index]
-
-                        #Update lists of exon starts/ends with correct offsets
-                        updated_exon_starts = []
-                        updated_exon_ends = []
-                        for coord in exon_starts:
-                            ex_coord_offset_index = bisect.bisect_right(current_chrom_variant_coords, coord) - 1
-                            updated_exon_coord = coord + current_chrom_variant_offsets[ex_coord_offset_index]
-                            updated_exon_starts.append(updated_exon_coord)
-                        for coord in exon_ends:
-                            ex_coord_offset_index = bisect.bisect_right(current_chrom_variant_coords, coord) - 1
-                            updated_exon_coord = coord + current_chrom_variant_offsets[ex_coord_offset_index]
-                            updated_exon_ends.append(updated_exon_coord)
-
-                    #Format updated annotation data and output
-                    updated_annot_file.write(
-                        CampareeUtils.annot_output_format.format(
-                            chrom=line_data[0],
-                            strand=line_data[1],
-                            txStart=updated_tx_start,
-                            txEnd=updated_tx_end,
-                            exonCount=line_data[4],
-                            exonStarts=','.join([str(x) for x in updated_exon_starts]),
-                            exonEnds=','.join([str(x) for x in updated_exon_ends]),
-                            transcriptID=line_data[7],
-                            geneID=line_data[8],
-                            geneSymbol=line_data[9],
-                            biotype=line_data[10]
+
+                        #Format updated annotation data and output
+                        updated_annot_file.write(
+                            CampareeUtils.annot_output_format.format(
+                                chrom=line_data[0],
+                                strand=line_data[1],
+                                txStart=updated_tx_start,
+                                txEnd=updated_tx_end,
+                                exonCount=line_data[4],
+                                exonStarts=','.join([str(x) for x in updated_exon_starts]),
+                                exonEnds=','.join([str(x) for x in updated_exon_ends]),
+                                transcriptID=line_data[7],
+                                geneID=line_data[8],
+                                geneSymbol=line_data[9],
+                                biotype=line_data[10]
+                            )
                         )
-                    )
 
-                #No variants in the current chromosome, so no need to update
-                #feature coordinates.
-                else:
-                    updated_annot_file.write(f"{annot_feature}\n")
+                    #No variants in the current chromosome, so no need to update
+                    #feature coordinates.
+                    else:
+                        updated_annot_file.write(f"{annot_feature}\n")
+                        updated_exon_starts = [int(coord) for coord in line_data[5].split(',')]
+                        updated_exon_ends = [int(coord) for coord in line_data[6].split(',')]
+
+                    transcripts[line_data[7]] = (line_data[8], line_data[0], line_data[1],
+                                                 TranscriptGeneTable.get_transcript_length(updated_exon_starts,
+                                                                                           updated_exon_ends))
+
+            # Saved once the updated annotation file is closed, since the table
+            # records the digest of the file's final contents.
+            log_file.write("Saving transcript/gene table of the updated annotation.\n")
+            TranscriptGeneTable.from_transcripts(transcripts).save(self.updated_annot_table_file_path,
+                                                                   self.updated_annot_file_path)
 
             #Status message used by is_output_valid() method to determine if
             #this script ran to completion.
@@ -420,10 +446,13 @@ class UpdateAnnotationForGenomeStep(AbstractCampareeStep):
 
         update_annot_outfile_path = os.path.join(data_directory, f"sample{sample_id}",
                                                  UpdateAnnotationForGenomeStep.UPDATE_ANNOT_OUTPUT_FILENAME_PATTERN.format(genome_name=genome_name))
+        update_annot_table_path = os.path.join(data_directory, f"sample{sample_id}",
+                                               UpdateAnnotationForGenomeStep.UPDATE_ANNOT_TABLE_FILENAME_PATTERN.format(genome_name=genome_name))
         update_annot_logfile_path = os.path.join(log_directory, f"sample{sample_id}",
                                                  UpdateAnnotationForGenomeStep.UPDATE_ANNOT_LOG_FILENAME_PATTERN.format(genome_name=genome_name))
 
         if os.path.isfile(update_annot_outfile_path) and \
+           os.path.isfile(update_annot_table_path) and \
            os.path.isfile(update_annot_logfile_path):
             #Read last line in update_annotation_for_genome log file
             line = ""
@@ -435,6 +464,39 @@ class UpdateAnnotationForGenomeStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by UpdateAnnotationForGenomeStep for a
+        specific job/execution, given a job's data directory, log directory, sample
+        id, and genome name. Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, sample_id, and genome_name.
+
+        Returns
+        -------
+        list
+            Paths to the updated annotation file, its transcript/gene table,
+            and log file.
+
+        """
+
+        data_directory = validation_attributes['data_directory']
+        log_directory = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+        genome_name = validation_attributes['genome_name']
+
+        return [os.path.join(data_directory, f"sample{sample_id}",
+                             UpdateAnnotationForGenomeStep.UPDATE_ANNOT_OUTPUT_FILENAME_PATTERN.format(genome_name=genome_name)),
+                os.path.join(data_directory, f"sample{sample_id}",
+                             UpdateAnnotationForGenomeStep.UPDATE_ANNOT_TABLE_FILENAME_PATTERN.format(genome_name=genome_name)),
+                os.path.join(log_directory, f"sample{sample_id}",
+                             UpdateAnnotationForGenomeStep.UPDATE_ANNOT_LOG_FILENAME_PATTERN.format(genome_name=genome_name))]
+
     @staticmethod
     def main():
         """Entry point into script when called directly.
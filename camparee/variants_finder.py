@@ -159,84 +159,97 @@ class VariantsFinderStep(AbstractCampareeStep):
         Iterate over the input txt file containing cigar, seq, start location, chromosome for each read and consolidate
         reads for each position on the genome.
         """
+        self.start_read_collection()
+        for line in self.alignment_file.fetch(chromosome):
+            self.add_read(line)
+        return self.reads
 
-        reads = dict()
-        current_read_components = []
-        current_start = None
+    def start_read_collection(self):
+        """
+        Clear the reads consolidated by add_read(), before collecting the reads of a new chromosome.
+        """
+        self.reads = dict()
+        self.current_read_components = []
+        self.current_start = None
 
-        for line in self.alignment_file.fetch(chromosome):
+    def add_read(self, line):
+        """
+        Consolidate the bases, insertions, and deletions of one aligned read into the reads of the chromosome
+        currently being collected. Reads must be given in order of their start position.
+        :param line: pysam AlignedSegment for the read
+        """
+        reads = self.reads
+
+        # Remove unaligned reads, reverse reads, and non-unique alignments
+        if line.is_unmapped or not line.is_read1 or line.get_tag(tag="NH") != 1:
+            return
+
+        # Alignment Segment reference_start is zero-based - so adding 1 to conform to convention.
+        start = line.reference_start + 1
+        sequence = line.query_sequence.upper()
+        cigar = line.cigarstring
+        cigar, sequence = self.remove_clips(cigar, sequence)
+        current_pos_in_genome = int(start)
+        loc_on_read = 1
+
+        # Dropping duplicate reads (assumed to be PCR artifacts)
+        if not self.current_start:
+            self.current_start = start
+            self.current_read_components.append((cigar, sequence))
+        elif start != self.current_start:
+            self.current_start = start
+            self.current_read_components = []
+            self.current_read_components.append((cigar, sequence))
+        elif (cigar, sequence) in self.current_read_components:
+            return
+        else:
+            self.current_read_components.append((cigar, sequence))
 
-            # Remove unaligned reads, reverse reads, and non-unique alignments
-            if line.is_unmapped or not line.is_read1 or line.get_tag(tag="NH") != 1:
-                continue
+        # Iterate over the variant types and lengths in the cigar string
+        for match in re.finditer(self.variant_pattern, cigar):
+            length = int(match.group(1))
+            read_type = match.group(2)
 
-            # Alignment Segment reference_start is zero-based - so adding 1 to conform to convention.
-            start = line.reference_start + 1
-            sequence = line.query_sequence.upper()
-            cigar = line.cigarstring
-            cigar, sequence = self.remove_clips(cigar, sequence)
-            current_pos_in_genome = int(start)
-            loc_on_read = 1
-
-            # Dropping duplicate reads (assumed to be PCR artifacts)
-            if not current_start:
-                current_start = start
-                current_read_components.append((cigar, sequence))
-            elif start != current_start:
-                current_start = start
-                current_read_components = []
-                current_read_components.append((cigar, sequence))
-            elif (cigar, sequence) in current_read_components:
+            # Skip over N type reads since these generally represent a read bracketing an intron
+            if read_type == "N":
+                current_pos_in_genome += length
                 continue
-            else:
-                current_read_components.append((cigar, sequence))
-
-            # Iterate over the variant types and lengths in the cigar string
-            for match in re.finditer(self.variant_pattern, cigar):
-                length = int(match.group(1))
-                read_type = match.group(2)
-
-                # Skip over N type reads since these generally represent a read bracketing an intron
-                if read_type == "N":
-                    current_pos_in_genome += length
-                    continue
-
-                # For a match, record all the snps at the each location continuously covered by this read type
-                if read_type == "M":
-                    stop = current_pos_in_genome + length
-                    while current_pos_in_genome < stop:
-                        location = current_pos_in_genome
-                        # Skip any read that contains an N or n in the sequence base
-                        base = sequence[loc_on_read - 1]
-                        if 'N' not in base:
-                            key = Read(location, base)
-                            reads[key] = reads.get(key, 0) + 1
-                        loc_on_read += 1
-                        current_pos_in_genome += 1
-                    continue
-
-                # For a deletion, designate the read named tuple description with a Dn where n is the
-                # length of the deletion starting at this position.  In this way, subsequent reads having a
-                # deletion of the same length at the same position will be added to this key.
-                if read_type == "D":
-                    location = current_pos_in_genome
-                    key = Read(location, f'D{length}')
-                    reads[key] = reads.get(key, 0) + 1
-                    current_pos_in_genome += length
-                    continue
 
-                # For an insert, designate the read named tuple description with an Ib+ where b+ are the
-                # bases to a inserted starting with this position.  In this way, subsequent reads having an
-                # insertion of the same bases at the same position will be added to this key.
-                if read_type == "I":
+            # For a match, record all the snps at the each location continuously covered by this read type
+            if read_type == "M":
+                stop = current_pos_in_genome + length
+                while current_pos_in_genome < stop:
                     location = current_pos_in_genome
-                    insertion_sequence = sequence[loc_on_read - 1: loc_on_read - 1 + length]
-                    # Skip any read that contains an N or n in the insertion sequence
-                    if 'N' not in insertion_sequence:
-                        key = Read(location, f'I{insertion_sequence}')
+                    # Skip any read that contains an N or n in the sequence base
+                    base = sequence[loc_on_read - 1]
+                    if 'N' not in base:
+                        key = Read(location, base)
                         reads[key] = reads.get(key, 0) + 1
-                    loc_on_read += length
-        return reads
+                    loc_on_read += 1
+                    current_pos_in_genome += 1
+                continue
+
+            # For a deletion, designate the read named tuple description with a Dn where n is the
+            # length of the deletion starting at this position.  In this way, subsequent reads having a
+            # deletion of the same length at the same position will be added to this key.
+            if read_type == "D":
+                location = current_pos_in_genome
+                key = Read(location, f'D{length}')
+                reads[key] = reads.get(key, 0) + 1
+                current_pos_in_genome += length
+                continue
+
+            # For an insert, designate the read named tuple description with an Ib+ where b+ are the
+            # bases to a inserted starting with this position.  In this way, subsequent reads having an
+            # insertion of the same bases at the same position will be added to this key.
+            if read_type == "I":
+                location = current_pos_in_genome
+                insertion_sequence = sequence[loc_on_read - 1: loc_on_read - 1 + length]
+                # Skip any read that contains an N or n in the insertion sequence
+                if 'N' not in insertion_sequence:
+                    key = Read(location, f'I{insertion_sequence}')
+                    reads[key] = reads.get(key, 0) + 1
+                loc_on_read += length
 
     def execute(self, sample, alignment_file_path, chr_ploidy_data, reference_genome, seed=None, chromosomes=None):
         """
@@ -250,11 +263,29 @@ class VariantsFinderStep(AbstractCampareeStep):
         :param chromosomes: A listing of chromosomes to replace the list obtained from the alignment file.  Used for
         debugging purposes.
         """
-        variants_file_path = os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
-                                          CAMPAREE_CONSTANTS.VARIANTS_FINDER_OUTPUT_FILENAME)
-        log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
-                                     CAMPAREE_CONSTANTS.VARIANTS_FINDER_LOG_FILENAME)
         self.alignment_file = pysam.AlignmentFile(alignment_file_path, "rb")
+        self.prepare_variant_calling(sample, chr_ploidy_data, reference_genome, seed, chromosomes)
+        for chromosome in self.chromosomes:
+            print(f"Finding variants for chromosome {chromosome}")
+            variants = self.call_variants(chromosome, self.collect_reads(chromosome))
+            self.record_variants(chromosome, variants)
+        self.write_log()
+
+    def prepare_variant_calling(self, sample, chr_ploidy_data, reference_genome, seed=None, chromosomes=None):
+        """
+        Set up the list of chromosomes, output paths, and log table used to call the variants of a sample. Must be
+        called before any variants are recorded.
+        :param sample: The sample for which the variants for to be found
+        :param chr_ploidy_data: dictionary of chromosomes as keys and a dictionary of male/female ploidy as values.
+        :param reference_genome: A dictionary representation of the reference genome
+        :param seed: Seed for random number generator
+        :param chromosomes: A listing of chromosomes to replace the list obtained from the alignment file.  Used for
+        debugging purposes.
+        """
+        self.variants_file_path = os.path.join(self.data_directory_path, f'sample{sample.sample_id}',
+                                               CAMPAREE_CONSTANTS.VARIANTS_FINDER_OUTPUT_FILENAME)
+        self.log_file_path = os.path.join(self.log_directory_path, f'sample{sample.sample_id}',
+                                          CAMPAREE_CONSTANTS.VARIANTS_FINDER_LOG_FILENAME)
         self.chromosomes = chromosomes if chromosomes else chr_ploidy_data.keys()
         self.reference_genome = reference_genome
 
@@ -262,32 +293,42 @@ class VariantsFinderStep(AbstractCampareeStep):
             numpy.random.seed(seed)
 
         self.filter_chromosome_list(sample, chr_ploidy_data)
-        log_table = PrettyTable()
-        log_table.field_names =['chromosome','chromosome length','# positions with variants',
-                                '# variants having no ref base variant','# positions having 1 variant',
-                                '# positions having 2 variants']
-        log_table.align['chromosome length'] = 'r'
-        log_table.align['# positions with variants'] = 'r'
-        log_table.align['# positions having no ref base variant'] = 'r'
-        log_table.align['# positions having 1 variant'] = 'r'
-        log_table.align['# positions having 2 variants'] = 'r'
-        row_totals = [0, 0, 0, 0, 0]
-        for chromosome in self.chromosomes:
-            print(f"Finding variants for chromosome {chromosome}")
-            variants = self.call_variants(chromosome, self.collect_reads(chromosome))
-            self.load_variants(variants, variants_file_path)
-            variants_without_ref_base = len([variant for variant in variants if not variant.contains_reference_base])
-            pos_with_one_variant = len([variant for variant in variants if len(variant.reads) == 1])
-            pos_with_two_variants = len([variant for variant in variants if len(variant.reads) == 2])
-            row_values = [len(self.reference_genome[chromosome]), len(variants),
-                          variants_without_ref_base, pos_with_one_variant, pos_with_two_variants]
-            row_totals = [sum(item) for item in zip(row_totals, row_values)]
-            row_values = [chromosome] + row_values
-            log_table.add_row(row_values)
-        row_totals = ['Totals'] + row_totals
-        log_table.add_row(row_totals)
-        with open(log_file_path, 'w') as log_file:
-            log_file.write(log_table.get_string())
+        self.log_table = PrettyTable()
+        self.log_table.field_names =['chromosome','chromosome length','# positions with variants',
+                                     '# variants having no ref base variant','# positions having 1 variant',
+                                     '# positions having 2 variants']
+        self.log_table.align['chromosome length'] = 'r'
+        self.log_table.align['# positions with variants'] = 'r'
+        self.log_table.align['# positions having no ref base variant'] = 'r'
+        self.log_table.align['# positions having 1 variant'] = 'r'
+        self.log_table.align['# positions having 2 variants'] = 'r'
+        self.row_totals = [0, 0, 0, 0, 0]
+
+    def record_variants(self, chromosome, variants):
+        """
+        Write the variants called for one chromosome to the variants file, and add the chromosome's summary to the
+        log table.  Chromosomes are written in the order this is called.
+        :param chromosome: chromosome the variants were called from
+        :param variants: variants list for the chromosome, returned by call_variants()
+        """
+        self.load_variants(variants, self.variants_file_path)
+        variants_without_ref_base = len([variant for variant in variants if not variant.contains_reference_base])
+        pos_with_one_variant = len([variant for variant in variants if len(variant.reads) == 1])
+        pos_with_two_variants = len([variant for variant in variants if len(variant.reads) == 2])
+        row_values = [len(self.reference_genome[chromosome]), len(variants),
+                      variants_without_ref_base, pos_with_one_variant, pos_with_two_variants]
+        self.row_totals = [sum(item) for item in zip(self.row_totals, row_values)]
+        row_values = [chromosome] + row_values
+        self.log_table.add_row(row_values)
+
+    def write_log(self):
+        """
+        Write the log table, including totals over all recorded chromosomes, to the log file.
+        """
+        row_totals = ['Totals'] + self.row_totals
+        self.log_table.add_row(row_totals)
+        with open(self.log_file_path, 'w') as log_file:
+            log_file.write(self.log_table.get_string())
             log_file.write('\nALL DONE!\n')
 
     def filter_chromosome_list(self, sample, chr_ploidy_data):
@@ -479,6 +520,35 @@ class VariantsFinderStep(AbstractCampareeStep):
 
         return valid_output
 
+    @staticmethod
+    def get_output_file_paths(validation_attributes):
+        """
+        List the output files created by VariantsFinderStep for a specific
+        job/execution, given a job's data directory, log directory, and sample id.
+        Prepare these attributes for a given job using the
+        get_validation_attributes() method.
+
+        Parameters
+        ----------
+        validation_attributes : dict
+            A job's data_directory, log_directory, and corresponding sample_id.
+
+        Returns
+        -------
+        list
+            Paths to the variants file and log file.
+
+        """
+
+        data_directory = validation_attributes['data_directory']
+        log_directory = validation_attributes['log_directory']
+        sample_id = validation_attributes['sample_id']
+
+        return [os.path.join(data_directory, f"sample{sample_id}",
+                             CAMPAREE_CONSTANTS.VARIANTS_FINDER_OUTPUT_FILENAME),
+                os.path.join(log_directory, f"sample{sample_id}",
+                             CAMPAREE_CONSTANTS.VARIANTS_FINDER_LOG_FILENAME)]
+
 
 
 class PositionInfo:
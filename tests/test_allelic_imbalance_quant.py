@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+from camparee.allelic_imbalance_quant import AllelicImbalanceQuantificationStep
+
+
+def test_read_in_background_yields_items_in_order(monkeypatch):
+    monkeypatch.setattr(AllelicImbalanceQuantificationStep, 'BATCH_SIZE', 7)
+    items = list(range(100))
+    assert list(AllelicImbalanceQuantificationStep.read_in_background(iter(items))) == items
+    assert list(AllelicImbalanceQuantificationStep.read_in_background([])) == []
+
+
+def test_read_in_background_reraises_errors():
+    def failing_items():
+        yield 1
+        raise ValueError("Malformed alignment.")
+
+    read_items = []
+    with pytest.raises(ValueError, match="Malformed alignment."):
+        for item in AllelicImbalanceQuantificationStep.read_in_background(failing_items()):
+            read_items.append(item)
+    assert read_items == [1]
+
+
+def test_read_in_background_starts_reading_immediately():
+    items_read = threading.Event()
+
+    def items():
+        yield 1
+        items_read.set()
+
+    read_items = AllelicImbalanceQuantificationStep.read_in_background(items())
+    # The items are read before the first is requested.
+    assert items_read.wait(timeout=10)
+    assert list(read_items) == [1]
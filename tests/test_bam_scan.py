@@ -0,0 +1,166 @@
+import os
+import random
+from types import SimpleNamespace
+
+import numpy
+import pysam
+import pytest
+
+from camparee.allelic_imbalance_quant import AllelicImbalanceQuantificationStep
+from camparee.bam_scan import BamScanStep, BamScanException
+from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeUtils
+from camparee.intron_quant import IntronQuantificationStep
+from camparee.variants_finder import VariantsFinderStep
+
+CHROM_LENGTHS = {'chr1': 6000, 'chr2': 5000}
+CHR_PLOIDY_DATA = {chrom: {'male': 2, 'female': 2} for chrom in CHROM_LENGTHS}
+ANNOTATION = [
+    "#chrom\tstrand\ttxStart\ttxEnd\texonCount\texonStarts\texonEnds\ttranscriptID\tgeneID\tgeneSymbol\tbiotype",
+    "chr1\t+\t1001\t3000\t3\t1001,1801,2601\t1200,2000,3000\tT1\tG1\tS1\tprotein_coding",
+    "chr1\t-\t4001\t5000\t2\t4001,4701\t4200,5000\tT2\tG2\tS2\tprotein_coding",
+    "chr2\t+\t1501\t3500\t2\t1501,3001\t1700,3500\tT3\tG3\tS3\tprotein_coding",
+]
+INTRON_QUANT_PARAMETERS = {'flank_size': 100, 'forward_read_is_sense': False}
+SAMPLE = SimpleNamespace(sample_id=1, gender='female')
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Write a coordinate-sorted, indexed BAM file of read pairs from a genome
+    with a few SNPs, and the annotation of the genome."""
+    rng = random.Random(0)
+    reference_genome = {chrom: ''.join(rng.choice('ACGT') for _ in range(length))
+                        for chrom, length in CHROM_LENGTHS.items()}
+    snp_genome = {chrom: ''.join('T' if position % 700 == 0 and base != 'T' else base
+                                 for position, base in enumerate(sequence))
+                  for chrom, sequence in reference_genome.items()}
+
+    chroms = list(CHROM_LENGTHS)
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': chrom, 'LN': length} for chrom, length in CHROM_LENGTHS.items()]}
+    reads = []
+    for pair_number in range(1500):
+        chrom_index = rng.randrange(len(chroms))
+        genome = snp_genome if rng.random() < 0.5 else reference_genome
+        start = rng.randrange(0, CHROM_LENGTHS[chroms[chrom_index]] - 800)
+        mate_start = start + rng.randrange(150, 500)
+        is_multimapper = rng.random() < 0.1
+        for mate_number, (position, is_reverse) in enumerate([(start, False), (mate_start, True)]):
+            read = pysam.AlignedSegment()
+            read.query_name = f"read{pair_number}"
+            read.reference_id = chrom_index
+            read.reference_start = position
+            if rng.random() < 0.2:
+                read.cigarstring = '40M150N60M'
+                sequence = genome[chroms[chrom_index]][position:position + 40] + \
+                           genome[chroms[chrom_index]][position + 190:position + 250]
+            else:
+                read.cigarstring = '100M'
+                sequence = genome[chroms[chrom_index]][position:position + 100]
+            read.query_sequence = sequence
+            read.query_qualities = pysam.qualitystring_to_array('I' * 100)
+            read.flag = 1 | 2 | (16 if is_reverse else 32) | (64 if mate_number == 0 else 128)
+            read.next_reference_id = chrom_index
+            read.next_reference_start = mate_start if mate_number == 0 else start
+            read.mapping_quality = 255
+            read.set_tag('NH', 2 if is_multimapper else 1)
+            reads.append(read)
+    reads.sort(key=lambda read: (read.reference_id, read.reference_start))
+
+    alignment_file_path = str(tmp_path / "genome_alignment.bam")
+    with pysam.AlignmentFile(alignment_file_path, 'wb', header=header) as alignment_file:
+        for read in reads:
+            alignment_file.write(read)
+    pysam.index(alignment_file_path)
+
+    geneinfo_file_path = str(tmp_path / "annotation.txt")
+    with open(geneinfo_file_path, 'w') as geneinfo_file:
+        geneinfo_file.write('\n'.join(ANNOTATION) + '\n')
+
+    return SimpleNamespace(alignment_file_path=alignment_file_path, geneinfo_file_path=geneinfo_file_path,
+                           reference_genome=reference_genome, reads=reads)
+
+
+def make_directories(tmp_path, name):
+    log_directory_path = tmp_path / name / "logs"
+    data_directory_path = tmp_path / name / "data"
+    (log_directory_path / "sample1").mkdir(parents=True)
+    (data_directory_path / "sample1").mkdir(parents=True)
+    return str(log_directory_path), str(data_directory_path)
+
+
+def read_file(file_path):
+    with open(file_path, 'rb') as output_file:
+        return output_file.read()
+
+
+def test_bam_scan_matches_individual_steps(tmp_path, inputs):
+    scan_log_directory_path, scan_data_directory_path = make_directories(tmp_path, "scan")
+    bam_scan = BamScanStep(scan_log_directory_path, scan_data_directory_path)
+    bam_scan.execute(SAMPLE, inputs.alignment_file_path, CHR_PLOIDY_DATA, inputs.reference_genome,
+                     inputs.geneinfo_file_path, seed=1, variants_finder_parameters={},
+                     intron_quant_parameters=INTRON_QUANT_PARAMETERS)
+    validation_attributes = bam_scan.get_validation_attributes(SAMPLE, inputs.alignment_file_path, None, None,
+                                                               inputs.geneinfo_file_path,
+                                                               intron_quant_parameters=INTRON_QUANT_PARAMETERS)
+    assert BamScanStep.is_output_valid(validation_attributes)
+    with open(os.path.join(scan_log_directory_path, "sample1", CAMPAREE_CONSTANTS.BAM_SCAN_LOG_FILENAME)) as log_file:
+        assert f"Scanned {len(inputs.reads)} alignments.\n" in log_file.read()
+
+    log_directory_path, data_directory_path = make_directories(tmp_path, "steps")
+    VariantsFinderStep(log_directory_path, data_directory_path, {}).execute(
+        SAMPLE, inputs.alignment_file_path, CHR_PLOIDY_DATA, inputs.reference_genome, seed=1)
+    IntronQuantificationStep(log_directory_path, data_directory_path, INTRON_QUANT_PARAMETERS).execute(
+        inputs.alignment_file_path, os.path.join(data_directory_path, "sample1"), inputs.geneinfo_file_path)
+
+    # Every consumer saw every read: the variants (including the log table) and
+    # the intron and intergenic quantifications match those of the steps.
+    output_file_names = [CAMPAREE_CONSTANTS.VARIANTS_FINDER_OUTPUT_FILENAME,
+                         CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME,
+                         CAMPAREE_CONSTANTS.INTRON_OUTPUT_ANTISENSE_FILENAME,
+                         CAMPAREE_CONSTANTS.INTERGENIC_OUTPUT_FILENAME]
+    for output_file_name in output_file_names:
+        step_output = read_file(os.path.join(data_directory_path, "sample1", output_file_name))
+        assert step_output
+        assert read_file(os.path.join(scan_data_directory_path, "sample1", output_file_name)) == step_output
+    assert read_file(os.path.join(scan_log_directory_path, "sample1", CAMPAREE_CONSTANTS.VARIANTS_FINDER_LOG_FILENAME)) == \
+           read_file(os.path.join(log_directory_path, "sample1", CAMPAREE_CONSTANTS.VARIANTS_FINDER_LOG_FILENAME))
+
+    # The multimappers match those found by the AllelicImbalanceQuantificationStep.
+    allelic_imbalance = AllelicImbalanceQuantificationStep(log_directory_path, data_directory_path)
+    allelic_imbalance.genome_alignment_file = inputs.alignment_file_path
+    allelic_imbalance.multimapper_read_hashes_file_path = None
+    multimapper_read_hashes = numpy.load(os.path.join(scan_data_directory_path, "sample1",
+                                                      CAMPAREE_CONSTANTS.MULTIMAPPER_READ_HASHES_FILENAME))
+    assert len(multimapper_read_hashes) > 0
+    assert numpy.array_equal(multimapper_read_hashes, allelic_imbalance.reads_to_ignore())
+    multimapper_read_names = {read.query_name for read in inputs.reads if read.get_tag('NH') > 1}
+    assert numpy.array_equal(multimapper_read_hashes,
+                             numpy.unique(CampareeUtils.hash_read_names(multimapper_read_names)))
+
+
+def test_bam_scan_without_intron_quantification(tmp_path, inputs):
+    log_directory_path, data_directory_path = make_directories(tmp_path, "scan")
+    bam_scan = BamScanStep(log_directory_path, data_directory_path)
+    bam_scan.execute(SAMPLE, inputs.alignment_file_path, CHR_PLOIDY_DATA, inputs.reference_genome,
+                     inputs.geneinfo_file_path, seed=1)
+    validation_attributes = bam_scan.get_validation_attributes(SAMPLE, inputs.alignment_file_path, None, None,
+                                                               inputs.geneinfo_file_path)
+    assert BamScanStep.is_output_valid(validation_attributes)
+    assert not os.path.exists(os.path.join(data_directory_path, "sample1", CAMPAREE_CONSTANTS.INTRON_OUTPUT_FILENAME))
+
+
+def test_bam_scan_requires_coordinate_sorted_bam(tmp_path, inputs):
+    unsorted_alignment_file_path = str(tmp_path / "unsorted.bam")
+    with pysam.AlignmentFile(inputs.alignment_file_path) as alignments:
+        header = alignments.header.to_dict()
+        header['HD']['SO'] = 'unsorted'
+        with pysam.AlignmentFile(unsorted_alignment_file_path, 'wb', header=header) as unsorted_alignments:
+            for read in alignments.fetch(until_eof=True):
+                unsorted_alignments.write(read)
+
+    log_directory_path, data_directory_path = make_directories(tmp_path, "scan")
+    with pytest.raises(BamScanException):
+        BamScanStep(log_directory_path, data_directory_path).execute(
+            SAMPLE, unsorted_alignment_file_path, CHR_PLOIDY_DATA, inputs.reference_genome, inputs.geneinfo_file_path)
@@ -0,0 +1,151 @@
+import gzip
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy
+import pytest
+
+from camparee.allelic_imbalance_quant import AllelicImbalanceQuantificationStep
+from camparee.camparee_constants import CAMPAREE_CONSTANTS
+from camparee.camparee_utils import CampareeUtils
+
+# Seconds to wait for the step before deciding it deadlocked.
+TIMEOUT = 300
+NUM_TRANSCRIPTS = 10
+READ_LENGTH = 100
+
+# Stands in for bowtie2, reading the two mate files in lockstep and writing an
+# alignment of each pair to a transcript to stdout. The edit distances differ
+# between the parents, so the reads are split unevenly between the alleles.
+STUB_BOWTIE2 = textwrap.dedent(f"""\
+    #!{sys.executable}
+    import gzip
+    import sys
+
+    arguments = sys.argv[1:]
+    index_prefix = arguments[arguments.index('-x') + 1]
+    mate_file_paths = [arguments[arguments.index('-1') + 1], arguments[arguments.index('-2') + 1]]
+    parent = index_prefix[-1]
+    mate_files = [gzip.open(path, 'rt') if path.endswith('.gz') else open(path) for path in mate_file_paths]
+
+    output = sys.stdout
+    output.write("@HD\\tVN:1.0\\tSO:unsorted\\n")
+    for transcript in range({NUM_TRANSCRIPTS}):
+        output.write(f"@SQ\\tSN:T{{transcript}}\\tLN:1000\\n")
+    read_number = 0
+    while True:
+        records = [[mate_file.readline() for _ in range(4)] for mate_file in mate_files]
+        if not records[0][0]:
+            break
+        name = records[0][0][1:].split()[0]
+        if parent == '2' and read_number % 7 == 0:
+            for flag, record in zip((77, 141), records):
+                output.write(f"{{name}}\\t{{flag}}\\t*\\t0\\t0\\t*\\t*\\t0\\t0\\t{{record[1].strip()}}\\t{{record[3].strip()}}\\n")
+        else:
+            transcript = read_number % {NUM_TRANSCRIPTS}
+            edit_distance = int(read_number % 3 == 0) if parent == '1' else int(read_number % 3 != 0)
+            for flag, position, mate_position, template_length, record in zip((99, 147), (1, 101), (101, 1),
+                                                                             (200, -200), records):
+                output.write(f"{{name}}\\t{{flag}}\\tT{{transcript}}\\t{{position}}\\t255\\t{READ_LENGTH}M\\t=\\t"
+                             f"{{mate_position}}\\t{{template_length}}\\t{{record[1].strip()}}\\t"
+                             f"{{record[3].strip()}}\\tNM:i:{{edit_distance}}\\n")
+        read_number += 1
+    sys.stderr.write(f"{{read_number}} reads; of these:\\n")
+""")
+
+# Runs the Bowtie2AllelicImbalanceStep in a separate process, so it can be
+# stopped if it deadlocks.
+RUN_STEP = textwrap.dedent("""\
+    import sys
+    from types import SimpleNamespace
+    from camparee.bowtie2_allelic_imbalance import Bowtie2AllelicImbalanceStep
+
+    (log_directory_path, data_directory_path, bin_directory_path, annotation_file_path,
+     multimapper_read_hashes_file_path, *fastq_file_paths) = sys.argv[1:]
+    sample = SimpleNamespace(sample_id=1, fastq_file_paths=fastq_file_paths)
+    Bowtie2AllelicImbalanceStep(log_directory_path, data_directory_path).execute(
+        sample, bin_directory_path, None, annotation_file_path, annotation_file_path,
+        multimapper_read_hashes_file_path=multimapper_read_hashes_file_path)
+""")
+
+
+def make_directories(tmp_path, name):
+    log_directory_path = tmp_path / name / "logs"
+    data_directory_path = tmp_path / name / "data"
+    (log_directory_path / "sample1").mkdir(parents=True)
+    (data_directory_path / "sample1").mkdir(parents=True)
+    return str(log_directory_path), str(data_directory_path)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Write the stub bowtie2, an annotation of its transcripts, multimapper
+    read name hashes, and paired gzipped FASTQ files with more read pairs than
+    the AllelicImbalanceQuantificationStep reads in a batch."""
+    bin_directory_path = tmp_path / "bin"
+    bin_directory_path.mkdir()
+    stub_bowtie2_path = bin_directory_path / "bowtie2"
+    stub_bowtie2_path.write_text(STUB_BOWTIE2)
+    stub_bowtie2_path.chmod(0o755)
+
+    annotation_file_path = tmp_path / "annotation.txt"
+    with open(annotation_file_path, 'w') as annotation_file:
+        annotation_file.write("#" + CampareeUtils.annot_output_format.replace('{', '').replace('}', ''))
+        for transcript in range(NUM_TRANSCRIPTS):
+            start = transcript * 2000 + 1
+            annotation_file.write(CampareeUtils.annot_output_format.format(
+                chrom='chr1', strand='+', txStart=start, txEnd=start + 999, exonCount=1, exonStarts=start,
+                exonEnds=start + 999, transcriptID=f"T{transcript}", geneID=f"G{transcript // 2}",
+                geneSymbol=f"S{transcript // 2}", biotype="protein_coding"))
+
+    num_read_pairs = AllelicImbalanceQuantificationStep.BATCH_SIZE * 3 // 2
+    fastq_file_paths = [str(tmp_path / f"reads_{mate}.fastq.gz") for mate in (1, 2)]
+    for mate, fastq_file_path in enumerate(fastq_file_paths, start=1):
+        with gzip.open(fastq_file_path, 'wt', compresslevel=1) as fastq_file:
+            fastq_file.writelines(f"@read{read_number}/{mate}\n{'ACGT'[read_number % 4] * READ_LENGTH}\n+\n"
+                                  f"{'I' * READ_LENGTH}\n" for read_number in range(num_read_pairs))
+
+    multimapper_read_hashes_file_path = str(tmp_path / "multimapper_read_hashes.npy")
+    numpy.save(multimapper_read_hashes_file_path,
+               numpy.unique(CampareeUtils.hash_read_names([f"read{read_number}"
+                                                           for read_number in range(0, num_read_pairs, 10)])))
+
+    return [str(bin_directory_path), str(annotation_file_path), multimapper_read_hashes_file_path,
+            *fastq_file_paths]
+
+
+def test_streamed_quantification_matches_alignment_files(tmp_path, inputs):
+    bin_directory_path, annotation_file_path, multimapper_read_hashes_file_path, *fastq_file_paths = inputs
+
+    log_directory_path, data_directory_path = make_directories(tmp_path, "streamed")
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    try:
+        subprocess.run([sys.executable, '-c', RUN_STEP, log_directory_path, data_directory_path, *inputs],
+                       env=environment, check=True, timeout=TIMEOUT, stdout=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        pytest.fail("Streaming the alignments of both parents deadlocked.")
+
+    # Quantify the same alignments, written to files by the stub bowtie2.
+    file_log_directory_path, file_data_directory_path = make_directories(tmp_path, "files")
+    alignment_file_paths = []
+    for parent in ('1', '2'):
+        alignment_file_path = str(tmp_path / f"parent{parent}.sam")
+        with open(alignment_file_path, 'w') as alignment_file:
+            subprocess.run([os.path.join(bin_directory_path, "bowtie2"), '-x', f"index_{parent}",
+                            '-1', fastq_file_paths[0], '-2', fastq_file_paths[1]],
+                           stdout=alignment_file, stderr=subprocess.DEVNULL, check=True)
+        alignment_file_paths.append(alignment_file_path)
+    AllelicImbalanceQuantificationStep(file_log_directory_path, file_data_directory_path).execute(
+        1, None, annotation_file_path, annotation_file_path, *alignment_file_paths,
+        multimapper_read_hashes_file_path=multimapper_read_hashes_file_path)
+
+    output_file_paths = [os.path.join(directory_path, "sample1", CAMPAREE_CONSTANTS.ALLELIC_IMBALANCE_OUTPUT_FILENAME)
+                         for directory_path in (data_directory_path, file_data_directory_path)]
+    with open(output_file_paths[0]) as streamed_output_file, open(output_file_paths[1]) as file_output_file:
+        streamed_output = streamed_output_file.read()
+        assert streamed_output == file_output_file.read()
+    # Every gene has reads, split unevenly between the alleles.
+    assert len(streamed_output.splitlines()) == NUM_TRANSCRIPTS // 2 + 1
+    assert "\t0.5\t0.5\n" not in streamed_output
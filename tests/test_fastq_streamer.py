@@ -0,0 +1,87 @@
+import gzip
+import os
+import threading
+
+import pytest
+
+from camparee.bowtie2 import FastqStreamer
+
+# Seconds to wait for the readers before deciding the copy deadlocked.
+TIMEOUT = 60
+
+
+def write_fastq(fastq_file_path, num_reads, read_length):
+    """Write a gzipped FASTQ file and return its records."""
+    records = [f"@read{read_number}\n{'ACGT'[read_number % 4] * read_length}\n+\n{'I' * read_length}\n"
+               for read_number in range(num_reads)]
+    with gzip.open(fastq_file_path, 'wt', compresslevel=1) as fastq_file:
+        fastq_file.writelines(records)
+    return records
+
+
+def read_mates_in_lockstep(fifo_paths, batch_size, records):
+    """Read batches of records from the two mate files in turn, as bowtie2
+    does for paired-end reads, appending them to records."""
+    with open(fifo_paths[0]) as mate_file_1, open(fifo_paths[1]) as mate_file_2:
+        while True:
+            batch_1 = [''.join(mate_file_1.readline() for _ in range(4)) for _ in range(batch_size)]
+            batch_2 = [''.join(mate_file_2.readline() for _ in range(4)) for _ in range(batch_size)]
+            records.extend(zip([record for record in batch_1 if record],
+                               [record for record in batch_2 if record]))
+            if not batch_1[-1] or not batch_2[-1]:
+                return
+
+
+@pytest.mark.parametrize('decompressor', ['python', 'parallel'])
+def test_tee_paired_fastqs_to_lockstep_readers(tmp_path, monkeypatch, decompressor):
+    if decompressor == 'parallel' and FastqStreamer.find_parallel_decompressor() is None:
+        pytest.skip("No parallel decompressor installed.")
+    if decompressor == 'python':
+        monkeypatch.setattr(FastqStreamer, 'find_parallel_decompressor', staticmethod(lambda: None))
+
+    # Mate 1 reads are much longer than mate 2 reads, so the readers get through
+    # the mate 1 file faster and each streamer has to buffer ahead of one of them.
+    num_reads = 20_000
+    mate_records = [write_fastq(str(tmp_path / "reads_1.fastq.gz"), num_reads, 300),
+                    write_fastq(str(tmp_path / "reads_2.fastq.gz"), num_reads, 50)]
+
+    fifo_paths = {parent: [] for parent in (1, 2)}
+    for parent in (1, 2):
+        for mate in (1, 2):
+            fifo_path = str(tmp_path / f"parent{parent}_read{mate}.fastq")
+            os.mkfifo(fifo_path)
+            fifo_paths[parent].append(fifo_path)
+
+    read_records = {parent: [] for parent in (1, 2)}
+    readers = [threading.Thread(target=read_mates_in_lockstep, args=(fifo_paths[parent], 1000, read_records[parent]),
+                                daemon=True)
+               for parent in (1, 2)]
+    for reader in readers:
+        reader.start()
+    fastq_streamers = [FastqStreamer(str(tmp_path / f"reads_{mate}.fastq.gz"),
+                                     [(fifo_paths[parent][mate - 1], lambda: True) for parent in (1, 2)])
+                       for mate in (1, 2)]
+    for fastq_streamer in fastq_streamers:
+        fastq_streamer.start()
+
+    for reader in readers:
+        reader.join(TIMEOUT)
+        assert not reader.is_alive(), "Reading the streamed FASTQ files deadlocked."
+    for fastq_streamer in fastq_streamers:
+        fastq_streamer.join()
+        assert fastq_streamer.error is None
+
+    expected_records = list(zip(*mate_records))
+    assert read_records[1] == expected_records
+    assert read_records[2] == expected_records
+
+
+def test_stops_when_reader_never_opens_pipe(tmp_path):
+    write_fastq(str(tmp_path / "reads.fastq.gz"), 10, 50)
+    fifo_path = str(tmp_path / "reads.fastq")
+    os.mkfifo(fifo_path)
+
+    fastq_streamer = FastqStreamer(str(tmp_path / "reads.fastq.gz"), [(fifo_path, lambda: False)])
+    fastq_streamer.start()
+    fastq_streamer.join()
+    assert "No process read" in str(fastq_streamer.error)
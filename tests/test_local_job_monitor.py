@@ -0,0 +1,87 @@
+import pytest
+
+from camparee.local_job_monitor import LocalJobMonitor, LocalJobMonitorException
+
+
+class AlwaysValidStep:
+    @staticmethod
+    def is_output_valid(validation_attributes):
+        return True
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(LocalJobMonitor, 'POLL_INTERVAL', 0.01)
+
+
+def submit_job(job_monitor, tmp_path, job_id, dependency_list=None, command=None, num_processors=1):
+    """Submit a job that records when it starts and ends in the events file."""
+    events_file_path = tmp_path / "events.txt"
+    command = command or f"echo start {job_id} >> {events_file_path}; sleep 0.3; echo end {job_id} >> {events_file_path}"
+    job_monitor.submit_new_job(job_id, command, None, 'Step',
+                               {'stdout_logfile': str(tmp_path / f"{job_id}.out"),
+                                'stderr_logfile': str(tmp_path / f"{job_id}.err"),
+                                'num_processors': num_processors},
+                               {}, str(tmp_path), dependency_list=dependency_list)
+
+
+def read_events(tmp_path):
+    events_file_path = tmp_path / "events.txt"
+    if not events_file_path.exists():
+        return []
+    return [tuple(line.split()) for line in events_file_path.read_text().splitlines()]
+
+
+def test_jobs_start_after_their_dependencies(tmp_path):
+    completed_job_ids = []
+    job_monitor = LocalJobMonitor(str(tmp_path), max_processors=4, job_completed_callback=completed_job_ids.append)
+    job_monitor.add_pipeline_step('Step', AlwaysValidStep)
+    dependencies = {'A': [], 'B': ['A'], 'C': ['A'], 'D': ['B', 'C'], 'E': []}
+    for job_id, dependency_list in dependencies.items():
+        submit_job(job_monitor, tmp_path, job_id, dependency_list)
+    job_monitor.monitor_until_all_jobs_completed(queue_update_interval=60)
+
+    events = read_events(tmp_path)
+    assert sorted(events) == sorted([(event, job_id) for job_id in dependencies for event in ('start', 'end')])
+    for job_id, dependency_list in dependencies.items():
+        for dependency in dependency_list:
+            assert events.index(('end', dependency)) < events.index(('start', job_id))
+    # Independent jobs run concurrently, rather than in submission order.
+    assert events.index(('start', 'E')) < events.index(('end', 'A'))
+    assert sorted(completed_job_ids) == sorted(dependencies)
+    for job_id, dependency_list in dependencies.items():
+        for dependency in dependency_list:
+            assert completed_job_ids.index(dependency) < completed_job_ids.index(job_id)
+
+
+def test_jobs_wait_for_processors(tmp_path):
+    job_monitor = LocalJobMonitor(str(tmp_path), max_processors=2)
+    job_monitor.add_pipeline_step('Step', AlwaysValidStep)
+    submit_job(job_monitor, tmp_path, 'A', num_processors=2)
+    submit_job(job_monitor, tmp_path, 'B', num_processors=1)
+    # Requests beyond the pool are capped at its size, rather than never starting.
+    submit_job(job_monitor, tmp_path, 'C', num_processors=8)
+    job_monitor.monitor_until_all_jobs_completed(queue_update_interval=60)
+
+    events = read_events(tmp_path)
+    assert events.index(('end', 'A')) < events.index(('start', 'B'))
+    assert events.index(('end', 'B')) < events.index(('start', 'C'))
+
+
+def test_failed_dependency_stops_run(tmp_path):
+    job_monitor = LocalJobMonitor(str(tmp_path), max_processors=2, max_resub_limit=1)
+    job_monitor.add_pipeline_step('Step', AlwaysValidStep)
+    submit_job(job_monitor, tmp_path, 'A', command=f"echo start A >> {tmp_path / 'events.txt'}; exit 1")
+    submit_job(job_monitor, tmp_path, 'B', ['A'])
+    with pytest.raises(LocalJobMonitorException, match="resubmission limit"):
+        job_monitor.monitor_until_all_jobs_completed(queue_update_interval=60)
+
+    # The failed job was resubmitted once, and the job depending on it never started.
+    assert read_events(tmp_path) == [('start', 'A'), ('start', 'A')]
+
+
+def test_unknown_dependency(tmp_path):
+    job_monitor = LocalJobMonitor(str(tmp_path))
+    job_monitor.add_pipeline_step('Step', AlwaysValidStep)
+    with pytest.raises(LocalJobMonitorException, match="never submitted"):
+        submit_job(job_monitor, tmp_path, 'B', ['A'])
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from camparee.step_cache import StepCache, StepCacheException
+
+
+@pytest.fixture
+def input_file_path(tmp_path):
+    input_file_path = tmp_path / "inputs" / "reference.fa"
+    input_file_path.parent.mkdir()
+    input_file_path.write_text(">chr1\nACGT\n")
+    return str(input_file_path)
+
+
+def make_step_cache(tmp_path, run_name):
+    output_directory_path = tmp_path / run_name
+    (output_directory_path / "data").mkdir(parents=True)
+    return StepCache(str(tmp_path / "cache"), str(output_directory_path))
+
+
+def get_job_key(step_cache, input_file_path, parameters=None, dependency_keys=None):
+    output_file_path = os.path.join(step_cache.output_directory_path, "data", "sample1", "variants.txt")
+    return step_cache.get_job_key("VariantsFinderStep", parameters or {'min_threshold': 0.03},
+                                  [input_file_path, output_file_path, 'packet'], dependency_keys or [])
+
+
+def test_key_is_independent_of_run_location(tmp_path, input_file_path):
+    job_key = get_job_key(make_step_cache(tmp_path, "run_1"), input_file_path)
+    assert get_job_key(make_step_cache(tmp_path, "run_2"), input_file_path) == job_key
+
+
+def test_key_changes_with_input_file_contents(tmp_path, input_file_path):
+    step_cache = make_step_cache(tmp_path, "run_1")
+    job_key = get_job_key(step_cache, input_file_path)
+    with open(input_file_path, 'a') as input_file:
+        input_file.write(">chr2\nTTTT\n")
+    assert get_job_key(step_cache, input_file_path) != job_key
+
+
+def test_key_changes_with_parameters(tmp_path, input_file_path):
+    step_cache = make_step_cache(tmp_path, "run_1")
+    job_key = get_job_key(step_cache, input_file_path)
+    assert get_job_key(step_cache, input_file_path, parameters={'min_threshold': 0.05}) != job_key
+
+
+def test_key_changes_with_dependency_keys(tmp_path, input_file_path):
+    step_cache = make_step_cache(tmp_path, "run_1")
+    upstream_key = get_job_key(step_cache, input_file_path)
+    job_key = get_job_key(step_cache, input_file_path, dependency_keys=[upstream_key])
+    with open(input_file_path, 'a') as input_file:
+        input_file.write(">chr2\nTTTT\n")
+    changed_upstream_key = get_job_key(step_cache, input_file_path)
+    assert get_job_key(step_cache, input_file_path, dependency_keys=[changed_upstream_key]) != job_key
+
+
+def test_store_and_fetch_outputs(tmp_path, input_file_path):
+    step_cache = make_step_cache(tmp_path, "run_1")
+    job_key = get_job_key(step_cache, input_file_path)
+    output_file_path = os.path.join(step_cache.output_directory_path, "data", "sample1", "variants.txt")
+    os.makedirs(os.path.dirname(output_file_path))
+    with open(output_file_path, 'w') as output_file:
+        output_file.write("chr1:1 | A:10\n")
+    assert step_cache.is_cacheable([output_file_path])
+    assert not step_cache.is_cacheable([output_file_path, input_file_path])
+    step_cache.store(job_key, [output_file_path])
+
+    # A later run in a different output directory restores the same outputs.
+    later_step_cache = make_step_cache(tmp_path, "run_2")
+    later_output_file_path = os.path.join(later_step_cache.output_directory_path, "data", "sample1", "variants.txt")
+    assert later_step_cache.fetch(job_key, [later_output_file_path])
+    with open(later_output_file_path) as later_output_file:
+        assert later_output_file.read() == "chr1:1 | A:10\n"
+    assert not later_step_cache.fetch("0" * 64, [later_output_file_path])
+
+
+def test_rewriting_outputs_leaves_cache_unchanged(tmp_path, input_file_path):
+    step_caches = [make_step_cache(tmp_path, run_name) for run_name in ("run_1", "run_2", "run_3")]
+    output_file_paths = [os.path.join(step_cache.output_directory_path, "data", "sample1", "variants.txt")
+                         for step_cache in step_caches]
+    job_key = get_job_key(step_caches[0], input_file_path)
+    os.makedirs(os.path.dirname(output_file_paths[0]))
+    with open(output_file_paths[0], 'w') as output_file:
+        output_file.write("chr1:1 | A:10\n")
+    step_caches[0].store(job_key, [output_file_paths[0]])
+
+    # A step run again in the directory restored from the cache rewrites its
+    # outputs in place, both by truncating them and by appending to them.
+    assert step_caches[1].fetch(job_key, [output_file_paths[1]])
+    with open(output_file_paths[1], 'w') as output_file:
+        output_file.write("chr1:1 | C:10\n")
+    with open(output_file_paths[1], 'a') as output_file:
+        output_file.write("chr1:2 | G:5\n")
+
+    assert step_caches[2].fetch(job_key, [output_file_paths[2]])
+    for output_file_path in (output_file_paths[0], output_file_paths[2]):
+        with open(output_file_path) as output_file:
+            assert output_file.read() == "chr1:1 | A:10\n"
+
+
+def test_store_missing_output(tmp_path, input_file_path):
+    step_cache = make_step_cache(tmp_path, "run_1")
+    job_key = get_job_key(step_cache, input_file_path)
+    with pytest.raises(StepCacheException):
+        step_cache.store(job_key, [os.path.join(step_cache.output_directory_path, "data", "missing.txt")])
+    assert not os.path.exists(os.path.join(step_cache.cache_directory_path, job_key))